@@ -0,0 +1,128 @@
+import random
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .search import normalize
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+MERSENNE = (1 << 31) - 1  # a * x tient dans un entier 64 bits, ce qui permet le calcul vectorisé
+
+_rng = random.Random(1337)
+PERMUTATIONS = [(_rng.randrange(1, MERSENNE), _rng.randrange(0, MERSENNE)) for _ in range(NUM_PERM)]
+if np is not None:
+    _PERM_A = np.array([a for a, _ in PERMUTATIONS], dtype=np.uint64)[:, None]
+    _PERM_B = np.array([b for _, b in PERMUTATIONS], dtype=np.uint64)[:, None]
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> set:
+    text = normalize(text)
+    if len(text) <= k:
+        return {zlib.crc32(text.encode()) % MERSENNE}
+    return {zlib.crc32(text[i:i + k].encode()) % MERSENNE for i in range(len(text) - k + 1)}
+
+
+def minhash(shingle_set: set) -> Tuple[int, ...]:
+    if np is not None:
+        x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))[None, :]
+        return tuple(int(v) for v in ((_PERM_A * x + _PERM_B) % MERSENNE).min(axis=1))
+    return tuple(min((a * x + b) % MERSENNE for x in shingle_set) for a, b in PERMUTATIONS)
+
+
+def minhash_many(shingle_sets: List[set]) -> List[Tuple[int, ...]]:
+    """Calcule les signatures de plusieurs ensembles en une seule opération vectorisée lorsque NumPy est disponible"""
+    if np is None or not shingle_sets:
+        return [minhash(s) for s in shingle_sets]
+    sizes = [len(s) for s in shingle_sets]
+    x = np.fromiter((v for s in shingle_sets for v in s), dtype=np.uint64, count=sum(sizes))[None, :]
+    offsets = np.cumsum([0] + sizes[:-1])
+    sigs = np.minimum.reduceat((_PERM_A * x + _PERM_B) % MERSENNE, offsets, axis=1)
+    return [tuple(col) for col in sigs.T.tolist()]
+
+
+def similarity(sig1: tuple, sig2: tuple) -> float:
+    """Estimation de l'indice de Jaccard à partir de deux signatures MinHash"""
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / NUM_PERM
+
+
+def analyze_pack(item: Tuple[str, dict]) -> dict:
+    """Calcule les métriques de qualité et les signatures MinHash des questions d'un pack (exécuté dans un processus séparé)"""
+    pack_id, pack = item
+    content = pack['content']
+    issues = []
+    signatures = []
+    qlens, nbads = [], []
+    for question, data in content.items():
+        good = normalize(data['good'])
+        bads = [normalize(b) for b in data['bad']]
+        qlens.append(len(question))
+        nbads.append(len(bads))
+        if good in bads:
+            issues.append((question, "La bonne réponse figure parmi les mauvaises"))
+        if len(set(bads)) < len(bads):
+            issues.append((question, "Mauvaises réponses en double"))
+        if len(normalize(question)) < 10:
+            issues.append((question, "Question très courte"))
+        if not good:
+            issues.append((question, "Bonne réponse vide"))
+        signatures.append((question, good, shingles(question)))
+    signatures = [(q, good, sig) for (q, good, _), sig in zip(signatures, minhash_many([sh for _, _, sh in signatures]))]
+
+    nb = max(len(content), 1)
+    metrics = {'questions': len(content),
+               'avg_question_length': round(sum(qlens) / nb, 1),
+               'avg_bad_answers': round(sum(nbads) / nb, 2),
+               'images_ratio': round(sum(1 for d in content.values() if d.get('image')) / nb, 2),
+               'details_ratio': round(sum(1 for d in content.values() if d.get('show')) / nb, 2),
+               'issues': len(issues)}
+    return {'id': pack_id, 'metrics': metrics, 'issues': issues, 'signatures': signatures}
+
+
+def find_duplicates(results: List[dict], threshold: float = 0.7) -> List[dict]:
+    """Regroupe les signatures par bandes (LSH) et vérifie les paires candidates"""
+    entries = [(r['id'], q, good, sig) for r in results for q, good, sig in r['signatures']]
+    buckets = {}
+    for n, (_, _, _, sig) in enumerate(entries):
+        for band in range(BANDS):
+            buckets.setdefault((band, sig[band * ROWS:(band + 1) * ROWS]), []).append(n)
+
+    seen, duplicates = set(), []
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if (a, b) in seen:
+                    continue
+                seen.add((a, b))
+                score = similarity(entries[a][3], entries[b][3])
+                if score >= threshold:
+                    duplicates.append({'score': round(score, 2),
+                                       'same_answer': entries[a][2] == entries[b][2],
+                                       'a': {'pack': entries[a][0], 'question': entries[a][1]},
+                                       'b': {'pack': entries[b][0], 'question': entries[b][1]}})
+    duplicates.sort(key=lambda d: d['score'], reverse=True)
+    return duplicates
+
+
+def analyze_packs(packs: Dict[str, dict], workers: int = None, threshold: float = 0.7) -> dict:
+    """Analyse l'ensemble des packs dans un pool de processus et renvoie le rapport complet"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(analyze_pack, packs.items(), chunksize=8))
+    duplicates = find_duplicates(results, threshold)
+
+    report = {'packs': {}, 'duplicates': duplicates}
+    for r in results:
+        report['packs'][r['id']] = dict(r['metrics'],
+                                        issues_detail=r['issues'],
+                                        duplicates_inside=sum(1 for d in duplicates if d['a']['pack'] == d['b']['pack'] == r['id']),
+                                        duplicates_across=sum(1 for d in duplicates if d['a']['pack'] != d['b']['pack'] and r['id'] in (d['a']['pack'], d['b']['pack'])))
+    return report
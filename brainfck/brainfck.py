@@ -1,4 +1,5 @@
 import asyncio
+import json
 import logging
 import yaml
 import random
@@ -6,9 +7,9 @@ import os
 import string
 import time
 from datetime import datetime
-from fuzzywuzzy import process
 
 import discord
+from discord.ext import tasks
 from redbot.core.data_manager import cog_data_path
 from redbot.core.utils.menus import start_adding_reactions, menu, DEFAULT_CONTROLS
 
@@ -17,6 +18,14 @@ from redbot.core import Config, commands, checks, errors
 from redbot.core.utils.chat_formatting import box, humanize_number
 from tabulate import tabulate
 
+from .analyzer import analyze_packs
+from .leaderboard import LeaderboardStore
+from .packs import PackStore, PackWatcher
+from .rooms import QuizRoom
+from .search import SearchIndex
+from .sessions import SessionStore
+from .telemetry import Telemetry
+
 logger = logging.getLogger("red.RedAppsv2.brainfck")
 
 
@@ -47,22 +56,75 @@ class Brainfck(commands.Cog):
 
         default_global = {"Global_Leaderboard": {},
                           "Packs_Leaderboard": {},
-                          "Sessions": {}}
+                          "Sessions": {},
+                          "session_ttl": 2592000,  # 30 jours
+                          "adaptive_delay": False}
         default_user = {"stats": {"w": 0, "d": 0, "l": 0},
                         "receive_lb_notifs": False}
         self.config.register_global(**default_global)
         self.config.register_user(**default_user)
+        self.sessions = SessionStore(self.config)
+        self.rooms = {}  # ID du message de la question en cours -> QuizRoom
+        self.leaderboards = LeaderboardStore(self.config)
+        self.telemetry = Telemetry(cog_data_path(self) / "telemetry.bin")
 
         self.packs = cog_data_path(self) / "packs"
         self.packs.mkdir(exist_ok=True, parents=True)
 
         self.loaded_packs = {}
+        self.search_index = SearchIndex()
+        self._theme_pages = None
+        self.pack_store = PackStore(self.packs, cog_data_path(self) / "packs_cache.json", self.read_pack_file)
+        self.pack_watcher = PackWatcher(self.packs, self.load_packs)
+        self.bot.loop.create_task(self.load_packs())
+        self.pack_watcher.start(self.bot.loop)
+        self.expire_sessions_loop.start()
+        self.bot.loop.create_task(self.load_telemetry())
+        self.flush_loop.start()
+
+    async def load_telemetry(self):
+        try:
+            data = await self.bot.loop.run_in_executor(None, self.telemetry.read_log)
+        except Exception:
+            logger.error("Impossible de relire le journal de télémétrie", exc_info=True)
+            self.telemetry.discard_log()
+        else:
+            self.telemetry.merge(*data)
+
+    @tasks.loop(minutes=1)
+    async def flush_loop(self):
+        try:
+            await self.leaderboards.flush()
+        except Exception:
+            logger.exception("Impossible d'enregistrer les classements Brainfck")
+        try:
+            self.telemetry.flush()
+        except Exception:
+            logger.exception("Impossible d'enregistrer la télémétrie Brainfck")
+
+    @flush_loop.before_loop
+    async def before_flush_loop(self):
+        logger.info('Starting flush_loop...')
+        await self.bot.wait_until_red_ready()
+
+    @tasks.loop(hours=6)
+    async def expire_sessions_loop(self):
+        ttl = await self.config.session_ttl()
+        if ttl:
+            nb = await self.sessions.expire(ttl)
+            if nb:
+                logger.info(f"{nb} sessions Brainfck expirées supprimées")
+
+    @expire_sessions_loop.before_loop
+    async def before_expire_sessions_loop(self):
+        logger.info('Starting expire_sessions_loop...')
+        await self.sessions.initialize()
 
     def read_pack_file(self, path: str) -> Tuple[str, dict]:
         """Extraire un Pack de questions depuis un fichier .yaml"""
         try:
             with open(path, 'rt', encoding='utf8') as f:
-                pack = yaml.safe_load(f)
+                pack = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
         except Exception as e:
             logger.info(msg=f"Erreur dans la lecture du fichier yaml : {e}", exc_info=True)
             raise ReaderError("Erreur lors de la lecture du fichier : `{}`".format(e))
@@ -112,19 +174,40 @@ class Brainfck(commands.Cog):
                     paths.append(os.path.abspath(os.path.join(dirpath, f)))
         return paths
 
-    def load_packs(self):
-        self.loaded_packs = {}
-        for path in self.filespaths(str(self.packs)):
-            pid, content = self.read_pack_file(path)
-            self.loaded_packs[pid] = content
-        return self.loaded_packs
+    async def load_packs(self, only: list = None):
+        """Met à jour les packs chargés en ne relisant que les fichiers modifiés depuis la dernière compilation
+
+        Les packs sont remplacés d'un bloc : les parties en cours conservent leur version du pack.
+        Les sessions des packs modifiés ou supprimés sont effacées."""
+        changed, new = await self.pack_store.refresh(only)
+        old = self.loaded_packs
+        self.loaded_packs = new
+        self.search_index.sync(old, new)
+        self._theme_pages = None
+        for packid in [p for p in old if new.get(p) is not old[p]]:
+            logger.info(f"Pack {packid} modifié ou supprimé, réinitialisation de ses sessions")
+            await self.reset_sessions_for(packid)
+        return changed
 
     async def reset_sessions_for(self, packid):
-        sessions = await self.config.Sessions()
-        for sess in sessions:
-            if sessions[sess]['pack_id'] == packid:
-                await self.config.Sessions.clear_raw(sess)
-        return sessions
+        return await self.sessions.reset_pack(packid)
+
+    def theme_pages(self) -> list:
+        """Renvoie les pages de la liste des thèmes, recalculées uniquement après un changement de packs"""
+        if self._theme_pages is None:
+            pages, txt = [], ""
+            for p in self.loaded_packs:
+                nb = len(self.loaded_packs[p]['content'])
+                chunk = f"• `{p}` : {self.loaded_packs[p]['description']} (#{nb})\n"
+                if len(txt + chunk) < 2000:
+                    txt += chunk
+                else:
+                    pages.append(txt)
+                    txt = chunk
+            if txt:
+                pages.append(txt)
+            self._theme_pages = pages
+        return self._theme_pages
 
     def get_random_pack(self):
         if self.loaded_packs:
@@ -153,44 +236,39 @@ class Brainfck(commands.Cog):
         confirm, cancel = self.bot.get_emoji(812451214037221439), self.bot.get_emoji(812451214179434551)
 
         if not self.loaded_packs:
-            self.load_packs()
+            await self.load_packs()
 
         if not theme_invite:
-            txt = ""
-            em = discord.Embed(title="Liste des thèmes disponibles", color=emcolor)
-            page = 1
-            for p in self.loaded_packs:
-                nb = len(self.loaded_packs[p]['content'])
-                chunk = f"• `{p}` : {self.loaded_packs[p]['description']} (#{nb})\n"
-                if len(txt + chunk) < 2000:
-                    txt += chunk
-                else:
-                    em.description = txt
-                    txt = chunk
-                    em.set_footer(text=f"Page #{page}")
-                    await ctx.send(embed=em)
-                    page += 1
-            if txt:
-                em.description = txt
+            pages = self.theme_pages()
+            if not pages:
+                return await ctx.send("**Aucun thème n'est disponible**")
+            for page, txt in enumerate(pages, start=1):
+                em = discord.Embed(title="Liste des thèmes disponibles", description=txt, color=emcolor)
                 em.set_footer(text=f"Page #{page}")
                 await ctx.send(embed=em)
-            else:
-                await ctx.send("**Aucun thème n'est disponible**")
             return
 
-        sessions = await self.config.Sessions()
-        packid = theme_invite.upper() if theme_invite.upper() in self.loaded_packs else None
-        invite = theme_invite if theme_invite in sessions else None
+        # Les invitations sont prioritaires sur les identifiants de packs, comme avant le stockage individuel des sessions
+        session = await self.sessions.get(theme_invite)
+        invite = theme_invite if session else None
+        packid = theme_invite.upper() if not invite and theme_invite.upper() in self.loaded_packs else None
+        suggestions = []
+        if not packid and not invite:
+            suggestions = self.search_index.find_packs(theme_invite, limit=3)
+            if suggestions and suggestions[0][0] >= 0.5:
+                packid = suggestions[0][1]
 
         if invite:
-            sess_author = self.bot.get_user(int(sessions[invite]['author']))
+            sess_author = self.bot.get_user(int(session['author']))
             if ctx.author == sess_author:
                 return await ctx.send(f"**Impossible de jouer** • Vous êtes l'auteur de ce défi, vous ne pouvez pas vous défier vous-même !")
-            sess_pack_id = sessions[invite]['pack_id']
-            sess_players = sessions[invite]['leaderboard']
-            if ctx.author.id in [int(us) for us in sess_players]:
-                return await ctx.send(f"**Impossible d'y rejouer** • Votre score ({sess_players[ctx.author.id]} points)"
+            sess_pack_id = session['pack_id']
+            sess_players = session['leaderboard']
+            if str(ctx.author.id) in sess_players:
+                return await ctx.send(f"**Impossible d'y rejouer** • Votre score ({sess_players[str(ctx.author.id)]} points)"
                                       f" figure déjà dans le classement pour cette partie !")
+            if sess_pack_id not in self.loaded_packs:
+                return await ctx.send("**Défi indisponible** • Le thème de ce défi n'est plus disponible")
             theme_invite = self.loaded_packs[sess_pack_id]
             packid = sess_pack_id
             packname = theme_invite['name']
@@ -243,9 +321,12 @@ class Brainfck(commands.Cog):
             if react.emoji == cancel:
                 return await conf.delete()
         else:
-            return await ctx.send("**Identifiant de thème ou code de partie invalide** • Consultez la liste des thèmes avec `;bf` ou vérifiez que l'invitation donnée est correcte (Attention aux 'O'/0)")
+            txt = "**Identifiant de thème ou code de partie invalide** • Consultez la liste des thèmes avec `;bf` ou vérifiez que l'invitation donnée est correcte (Attention aux 'O'/0)"
+            if suggestions:
+                txt += "\nVouliez-vous dire : " + ", ".join(f"`{p}`" for _, p in suggestions) + " ?"
+            return await ctx.send(txt)
 
-        seed = sessions[invite]['seed'] if invite else random.randint(1, 999999)
+        seed = session['seed'] if invite else random.randint(1, 999999)
         rng = random.Random(seed)
         pack = theme_invite
 
@@ -263,6 +344,7 @@ class Brainfck(commands.Cog):
                            'leaderboard': {}}
         qlist = list(pack['content'].keys())
         timelimit = pack['delay']
+        adaptive = await self.config.adaptive_delay()
         while manche <= 6:
             question = rng.choice(qlist)
             qlist.remove(question)
@@ -270,6 +352,7 @@ class Brainfck(commands.Cog):
             bad = rng.sample(pack['content'][question]['bad'], 3)
             reps = [good] + bad
             rng.shuffle(reps)
+            qlimit = self.telemetry.adaptive_delay(packid, question, timelimit) if adaptive else timelimit
 
             if manche != 6:
                 em = discord.Embed(title=f"{pack['name']} • Question #{manche}",
@@ -293,7 +376,7 @@ class Brainfck(commands.Cog):
                 rtxt += f"{letters[rindex]} → {rep}\n"
                 rdict[letters[rindex]] = rep
             em.add_field(name="Réponses possibles", value=rtxt)
-            em.set_footer(text=f"Répondez avec les emojis ci-dessous | {str(timelimit)}s")
+            em.set_footer(text=f"Répondez avec les emojis ci-dessous | {str(qlimit)}s")
             await start.edit(embed=em)
 
             start_adding_reactions(start, letters)
@@ -303,11 +386,14 @@ class Brainfck(commands.Cog):
                 react, ruser = await self.bot.wait_for("reaction_add",
                                                        check=lambda m,
                                                                     u: u == ctx.author and m.message.id == start.id,
-                                                       timeout=timelimit)
+                                                       timeout=qlimit)
             except asyncio.TimeoutError:
                 react, ruser = None, None
             finally:
-                timescore = time.time() - starttime
+                latency = time.time() - starttime
+                self.telemetry.record(packid, question, latency, react is not None,
+                                      react is not None and rdict.get(react.emoji, None) == good)
+                timescore = latency
                 if timescore > 10:
                     timescore = 10
                 roundscore = round((10 - timescore) * 10)
@@ -350,11 +436,11 @@ class Brainfck(commands.Cog):
                 if invite:
                     waittime += 3
                     reptxt += "\n"
-                    sess_author = self.bot.get_user(int(sessions[invite]['author']))
-                    sess_rep = sessions[invite]['answers'][question]['answer']
+                    sess_author = self.bot.get_user(int(session['author']))
+                    sess_rep = session['answers'][question]['answer']
                     if sess_rep == None:
                         sess_rep = "[Aucune réponse]"
-                    sess_time = round(sessions[invite]['answers'][question]['time'], 2)
+                    sess_time = round(session['answers'][question]['time'], 2)
 
                     is_good = "(Bonne réponse)" if sess_rep == good else "(Mauvaise réponse)"
                     advname = sess_author.name if sess_author else "Votre adversaire"
@@ -375,10 +461,9 @@ class Brainfck(commands.Cog):
         result = discord.Embed(title=f"{pack['name']} • Fin de la partie", color=emcolor)
 
         if invite:
-            sess_author = self.bot.get_user(int(sessions[invite]['author']))
+            sess_author = self.bot.get_user(int(session['author']))
             dvname = sess_author.name if sess_author else "Votre adversaire"
-            sess_score = sessions[invite]['score']
-            sessions[invite]['leaderboard'][ctx.author.id] = pts
+            sess_score = session['score']
             if pts > sess_score:
                 result.description = f"Bravo, vous avez battu **{dvname}** !\n" \
                                      f"- __Votre score__ : {pts}\n" \
@@ -398,7 +483,8 @@ class Brainfck(commands.Cog):
                 notifdesc = f"**{ctx.author.name}** a participé à votre défi [{invite}] sur le thème ***{pack['name']}*** et a perdu :\n" \
                             f"- Son score : {pts}\n" \
                             f"- __Votre score__ : {sess_score}"
-            await self.config.Sessions.set_raw(invite, value=sessions[invite])
+            await self.sessions.add_score(invite, ctx.author.id, pts)
+            await self.leaderboards.record_challenge(packid, ctx.author.id, pts, int(session['author']), sess_score)
             result.set_footer(text=f"Votre score a été enregistré au leaderboard de ce défi. Consultez-le avec \";bfl {invite}\"")
 
             notif = discord.Embed(description=notifdesc, color=await ctx.embed_color())
@@ -412,11 +498,8 @@ class Brainfck(commands.Cog):
                 pass
 
         else:
-            newinvite = lambda: "&" + str(''.join(random.SystemRandom().choice(string.ascii_letters + string.digits) for _ in range(5)))
-            sessinvite = newinvite()
-            while newinvite in sessions:
-                sessinvite = newinvite()
-            await self.config.Sessions.set_raw(sessinvite, value=present_session)
+            sessinvite = await self.sessions.create(present_session)
+            await self.leaderboards.record_score(packid, ctx.author.id, pts)
             if pts >= 500: encour = " Excellent !"
             elif pts >= 350: encour = " Bien joué !"
             elif pts >= 200: encour = " Pas mal."
@@ -427,21 +510,117 @@ class Brainfck(commands.Cog):
             result.set_footer(text="Partagez ce code pour défier d'autres personnes sur ce thème !")
         await ctx.send(embed=result)
 
+    @commands.command(name="brainfckroom", aliases=["bfroom"])
+    @commands.guild_only()
+    @commands.max_concurrency(1, commands.BucketType.channel)
+    async def brainfck_room(self, ctx, packid: str):
+        """Lancer un Quiz Brainfck multijoueur sur ce salon
+
+        Tous les membres du salon peuvent répondre en même temps, les points dépendent de la rapidité de la bonne réponse
+        <packid> = Identifiant du pack (v. `;bf`)"""
+        if not self.loaded_packs:
+            await self.load_packs()
+        packid = packid.upper()
+        if packid not in self.loaded_packs:
+            return await ctx.send("**Identifiant de thème invalide** • Consultez la liste des thèmes avec `;bf`")
+
+        pack = self.loaded_packs[packid]
+        emcolor = pack['color'] if pack['color'] else await ctx.embed_color()
+        room = QuizRoom(ctx.channel, ctx.author, packid, pack)
+        letters = [i for i in '🇦🇧🇨🇩']
+
+        em = discord.Embed(title=f"{pack['name']} • Partie multijoueur", description=pack['description'], color=emcolor)
+        em.set_footer(text="Tout le monde peut répondre ! La partie commence dans 10s ...")
+        if pack['pack_thumbnail']:
+            em.set_thumbnail(url=pack['pack_thumbnail'])
+        await ctx.send(embed=em)
+        await asyncio.sleep(10)
+
+        rng = random.Random()
+        qlist = list(pack['content'].keys())
+        timelimit = pack['delay']
+        for manche in range(1, 7):
+            question = rng.choice(qlist)
+            qlist.remove(question)
+            good = pack['content'][question]['good']
+            reps = [good] + rng.sample(pack['content'][question]['bad'], 3)
+            rng.shuffle(reps)
+            multiplier = 2 if manche == 6 else 1
+            title = f"{pack['name']} • Question #{manche}" + (" (BONUS)" if multiplier > 1 else "")
+
+            em = discord.Embed(title=title, description=box(question), color=emcolor)
+            em.set_footer(text="Préparez-vous ..." + (" (x2 points)" if multiplier > 1 else ""))
+            if pack['content'][question]['image']:
+                em.set_image(url=pack['content'][question]['image'])
+            start = await ctx.send(embed=em)
+            await asyncio.sleep((0.075 * len(question)) + 1)
+
+            rdict = dict(zip(letters, reps))
+            em.add_field(name="Réponses possibles", value="\n".join(f"{l} → {r}" for l, r in rdict.items()))
+            em.set_footer(text=f"Répondez avec les emojis ci-dessous | {timelimit}s")
+            await start.edit(embed=em)
+            start_adding_reactions(start, letters)
+
+            self.rooms[start.id] = room
+            room.open_question(start.id, rdict)
+            try:
+                await asyncio.wait_for(room.everyone_answered.wait(), timeout=timelimit)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                del self.rooms[start.id]
+                answers = room.close_question()
+            for rep, elapsed in answers.values():
+                self.telemetry.record(packid, question, elapsed, True, rep == good)
+
+            gains = room.score_question(good, multiplier)
+            end = discord.Embed(title=title, description=box(question), color=emcolor)
+            reptxt = f"La bonne réponse était **{good}** !\n"
+            if gains:
+                fastest = sorted(gains.items(), key=lambda g: g[1], reverse=True)[:5]
+                reptxt += "\n".join(f"• <@{u}> +{pts} ({round(answers[u][1], 2)}s)" for u, pts in fastest)
+            else:
+                reptxt += "Personne n'a trouvé la bonne réponse."
+            end.add_field(name="Réponse", value=reptxt)
+            waittime = 5
+            if pack['content'][question].get('show', False):
+                end.add_field(name="Détails", value=pack['content'][question]['show'])
+                waittime += 0.03 * len(pack['content'][question]['show'])
+            end.set_footer(text=f"{len(answers)} réponses | {len(gains)} bonnes réponses")
+            await start.edit(embed=end)
+            await asyncio.sleep(waittime)
+
+        result = discord.Embed(title=f"{pack['name']} • Fin de la partie multijoueur", color=emcolor)
+        ranking = room.ranking(20)
+        if ranking:
+            tabl = [(ctx.guild.get_member(u).display_name if ctx.guild.get_member(u) else str(u), score, room.correct.get(u, 0))
+                    for u, score in ranking]
+            result.description = box(tabulate(tabl, headers=("Joueur", "Score", "Bonnes rép.")))
+        else:
+            result.description = "Personne n'a participé à cette partie."
+        await ctx.send(embed=result)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        room = self.rooms.get(payload.message_id)
+        if room and payload.user_id != self.bot.user.id:
+            room.answer(payload.user_id, str(payload.emoji))
+
     @commands.command(name='bfleaderboard', aliases=['bfl'])
     async def brainfck_leaderboard(self, ctx, invite: str):
         """Affiche le leaderboard sur une partie (défi)"""
-        sessions = await self.config.Sessions()
+        session = await self.sessions.get(invite)
         if not self.loaded_packs:
-            self.load_packs()
+            await self.load_packs()
 
-        if invite in sessions:
-            lb = sessions[invite]['leaderboard']
+        if session:
+            lb = session['leaderboard']
             if lb:
-                pack_id = sessions[invite]['pack_id']
-                auteur = self.bot.get_user(int(sessions[invite]['author']))
+                pack_id = session['pack_id']
+                auteur = self.bot.get_user(int(session['author']))
                 autname = auteur if auteur else "Inconnu"
                 pack = self.loaded_packs.get(pack_id, None)
-                sess_score = sessions[invite]['score']
+                sess_score = session['score']
                 packname = pack['name'] if pack else f"SUPPR:{pack_id}"
 
                 embeds = []
@@ -470,6 +649,34 @@ class Brainfck(commands.Cog):
         else:
             await ctx.send(f"**Code invalide** • Vérifiez que le code donné corresponde à un code de partie valide")
 
+    @commands.command(name="brainfcktop", aliases=['bftop'])
+    async def brainfck_top(self, ctx, packid: str = None):
+        """Affiche le classement global (Elo des défis) ou celui d'un pack (meilleur score)
+
+        [packid] = Identifiant du pack, ne rien mettre affiche le classement global"""
+        await self.leaderboards.initialize()
+        if packid:
+            packid = packid.upper()
+            lb = self.leaderboards.packs.get(packid)
+            if not lb:
+                return await ctx.send("**Aucun score** • Personne n'a encore joué à ce pack")
+            packname = self.loaded_packs[packid]['name'] if packid in self.loaded_packs else packid
+            title, field, header = f"Classement du thème \"{packname}\"", 'best', "Meilleur score"
+        else:
+            lb = self.leaderboards.glob
+            title, field, header = "Classement global Brainfck", 'elo', "Elo"
+
+        tabl = []
+        for n, (uid, entry) in enumerate(lb.top(15), start=1):
+            user = self.bot.get_user(int(uid))
+            tabl.append((n, user.name if user else uid, entry[field], entry['games']))
+        em = discord.Embed(title=title, color=await ctx.embed_color())
+        em.description = box(tabulate(tabl, headers=("#", "Pseudo", header, "Parties"))) if tabl else "Aucun joueur classé"
+        rank = lb.rank(str(ctx.author.id))
+        if rank:
+            em.set_footer(text=f"Votre rang : {rank}/{len(lb)} • {header} : {lb.get(str(ctx.author.id))[field]}")
+        await ctx.send(embed=em)
+
     @commands.command(name="brainfcknotif", aliases=['bfnotif'])
     async def brainfck_allow_notifs(self, ctx):
         """Active/Désactive la réception d'une notification quand quelqu'un termine votre défi"""
@@ -535,7 +742,7 @@ class Brainfck(commands.Cog):
         filename = msg.attachments[0].filename
         file_path = "{}/{}".format(str(self.packs), filename)
         await msg.attachments[0].save(file_path)
-        self.load_packs()
+        await self.load_packs([file_path])
         return file_path
 
     @_brainfuck_settings.command()
@@ -557,7 +764,7 @@ class Brainfck(commands.Cog):
         try:
             os.remove(str(path))
             await ctx.send("**Fichier supprimé**")
-            self.load_packs()
+            await self.load_packs([str(path)])
         except Exception as e:
             logger.error(msg=f"Fichier non supprimé ({path})", exc_info=True)
             await ctx.send(f"**Erreur** • Impossible de supprimer le fichier : `{e}`")
@@ -574,20 +781,133 @@ class Brainfck(commands.Cog):
 
     @_brainfuck_settings.command()
     async def reload(self, ctx):
-        """Recharge manuellement la liste des packs chargés"""
+        """Recharge manuellement la liste des packs chargés (seuls les fichiers modifiés sont relus)"""
         try:
-            self.load_packs()
+            changed = await self.load_packs()
         except Exception as e:
             await ctx.send(f"**Erreur** : `{e}`")
             raise
+        errors = [f"• `{os.path.basename(p)}` : {e[1]}" for p, e in self.pack_store.errors.items()]
+        errors += [f"• `{os.path.basename(p)}` : L'ID {i} est déjà utilisé par un autre pack" for p, i in self.pack_store.duplicates.items()]
+        txt = f"**Pack de questions rechargés** • {len(self.loaded_packs)} packs chargés, {len(changed)} fichiers relus"
+        if errors:
+            txt += "\n__Fichiers ignorés :__\n" + "\n".join(errors)
+        await ctx.send(txt[:2000])
+
+    @_brainfuck_settings.command()
+    async def search(self, ctx, *, text: str):
+        """Recherche les questions proches du texte donné dans tous les packs chargés (doublons, fautes...)"""
+        results = self.search_index.find_questions(text, limit=15)
+        if not results:
+            return await ctx.send("**Aucun résultat** • Aucune question ne ressemble à ce texte")
+        tabl = [(pid, f"{round(score * 100)}%", q if len(q) <= 60 else q[:57] + "...") for score, pid, q in results]
+        await ctx.send(box(tabulate(tabl, headers=("Pack", "Score", "Question"))))
+
+    @_brainfuck_settings.command()
+    async def analyze(self, ctx, threshold: float = 0.7):
+        """Analyse la qualité de tous les packs et recherche les questions en double entre packs
+
+        [threshold] = Similarité minimale (0-1) pour considérer deux questions comme doublons, par défaut 0.7
+        Le rapport complet est enregistré au format JSON et envoyé en pièce jointe"""
+        if not 0 < threshold <= 1:
+            return await ctx.send("**Erreur** • Le seuil doit être compris entre 0 et 1")
+        if not self.loaded_packs:
+            await self.load_packs()
+        if not self.loaded_packs:
+            return await ctx.send("**Aucun pack chargé**")
+
+        async with ctx.typing():
+            start = time.time()
+            report = await self.bot.loop.run_in_executor(None, analyze_packs, dict(self.loaded_packs), None, threshold)
+            elapsed = time.time() - start
+
+            reports = cog_data_path(self) / "reports"
+            reports.mkdir(exist_ok=True)
+            path = reports / f"analyse_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            with open(str(path), 'wt', encoding='utf8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        nbq = sum(p['questions'] for p in report['packs'].values())
+        across = sum(1 for d in report['duplicates'] if d['a']['pack'] != d['b']['pack'])
+        worst = sorted(report['packs'].items(), key=lambda p: p[1]['issues'] + p[1]['duplicates_inside'] + p[1]['duplicates_across'], reverse=True)[:10]
+        tabl = [(pid, m['questions'], m['issues'], m['duplicates_inside'], m['duplicates_across']) for pid, m in worst]
+        em = discord.Embed(title="Analyse des packs Brainfck", color=await ctx.embed_color(),
+                           description=box(tabulate(tabl, headers=("Pack", "Q.", "Pb.", "Dbl. int.", "Dbl. ext."))))
+        em.add_field(name="Résumé", value=f"{len(report['packs'])} packs • {nbq} questions • {len(report['duplicates'])} doublons ({across} entre packs)")
+        em.set_footer(text=f"Analyse réalisée en {round(elapsed, 2)}s")
+        try:
+            await ctx.send(embed=em, file=discord.File(str(path)))
+        except discord.HTTPException:
+            await ctx.send(embed=em)
+            await ctx.send(f"**Rapport trop volumineux pour Discord** • Chemin = `{path}`")
+
+    @_brainfuck_settings.command()
+    async def difficulty(self, ctx, packid: str):
+        """Affiche les statistiques de réponse d'un pack et ses questions les plus difficiles
+
+        Les questions presque toujours ratées ou toujours réussies sont signalées comme potentiellement défectueuses"""
+        packid = packid.upper()
+        if packid not in self.loaded_packs:
+            return await ctx.send("**Le pack demandé n'est pas chargé**")
+        agg = self.telemetry.pack_stats(packid)
+        if not agg or not agg.samples:
+            return await ctx.send("**Aucune donnée** • Personne n'a encore répondu aux questions de ce pack")
+
+        pack = self.loaded_packs[packid]
+        em = discord.Embed(title=f"Difficulté du thème \"{pack['name']}\"", color=await ctx.embed_color())
+        median, p90 = agg.latency.quantile(0.5), agg.latency.quantile(0.9)
+        em.add_field(name="Réponses", value=f"{agg.samples} ({round(agg.correct_rate * 100)}% correctes)")
+        if agg.latency.count:
+            em.add_field(name="Temps de réponse", value=f"Moy. {round(agg.latency.mean, 2)}s • Méd. {round(median, 2)}s • P90 {round(p90, 2)}s")
+
+        ranking = self.telemetry.question_ranking(packid, pack)
+        if ranking:
+            tabl = []
+            for question, qagg in ranking[:10]:
+                flag = "⚠" if qagg.correct_rate < 0.1 or qagg.correct_rate > 0.98 else ""
+                qmed = qagg.latency.quantile(0.5)
+                tabl.append((flag + (question if len(question) <= 40 else question[:37] + "..."),
+                             f"{round(qagg.correct_rate * 100)}%", f"{round(qmed, 1)}s" if qmed else "-", qagg.samples))
+            em.description = box(tabulate(tabl, headers=("Question", "Réussite", "Méd.", "Rép.")))
+        em.set_footer(text="⚠ = Question potentiellement défectueuse (presque toujours ratée ou réussie)")
+        await ctx.send(embed=em)
+
+    @_brainfuck_settings.command()
+    async def adaptive(self, ctx):
+        """Active/désactive l'adaptation du délai de réponse de chaque question aux temps de réponse observés"""
+        current = await self.config.adaptive_delay()
+        await self.config.adaptive_delay.set(not current)
+        if current:
+            await ctx.send("**Désactivé** • Le délai de réponse est de nouveau fixé par chaque pack")
         else:
-            await ctx.send("**Pack de questions rechargés**")
+            await ctx.send("**Activé** • Le délai de réponse s'adapte aux temps de réponse observés (min. 5s)")
 
     @_brainfuck_settings.command()
     async def resetsess(self, ctx, packid: str):
         """Reset les sessions d'un pack"""
         if packid in self.loaded_packs:
-            await self.reset_sessions_for(packid)
-            await ctx.send(f"**Reset des sessions de {packid} effectué**")
+            nb = await self.reset_sessions_for(packid)
+            await ctx.send(f"**Reset des sessions de {packid} effectué** • {nb} sessions supprimées")
         else:
             await ctx.send("**Le pack demandé n'est pas chargé**")
+
+    @_brainfuck_settings.command()
+    async def sessionttl(self, ctx, days: int = 30):
+        """Modifie la durée de vie (en jours) des sessions avant leur suppression automatique
+
+        0 = Les sessions n'expirent jamais"""
+        if days < 0:
+            return await ctx.send("**Erreur** • La durée ne peut être négative")
+        await self.config.session_ttl.set(days * 86400)
+        if days:
+            await ctx.send(f"**Valeur modifiée** • Les sessions seront supprimées {days} jours après leur création")
+        else:
+            await ctx.send("**Valeur modifiée** • Les sessions n'expirent plus")
+
+    def cog_unload(self):
+        self.flush_loop.cancel()
+        self.bot.loop.create_task(self.leaderboards.flush())
+        self.telemetry.flush()
+        self.expire_sessions_loop.cancel()
+        self.pack_watcher.stop()
+        self.pack_store.close()
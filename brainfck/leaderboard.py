@@ -0,0 +1,147 @@
+import logging
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from redbot.core import Config
+
+logger = logging.getLogger("red.RedAppsv2.brainfck.leaderboard")
+
+DEFAULT_ELO = 1200
+ELO_K = 32
+
+
+def new_entry() -> dict:
+    return {'elo': DEFAULT_ELO, 'best': 0, 'total': 0, 'games': 0}
+
+
+def elo_delta(rating: float, opponent: float, result: float) -> float:
+    """Variation Elo d'un joueur (result : 1 = victoire, 0.5 = égalité, 0 = défaite)"""
+    expected = 1 / (1 + 10 ** ((opponent - rating) / 400))
+    return ELO_K * (result - expected)
+
+
+class Leaderboard:
+    """Classement trié maintenu de manière incrémentale
+
+    Les clés de tri (-valeur, ID) sont conservées dans une liste triée : une mise à jour ne déplace qu'une entrée,
+    le top N est une simple tranche et le rang d'un joueur une recherche dichotomique."""
+
+    def __init__(self, field: str, entries: Dict[str, dict] = None):
+        self.field = field
+        self.entries = entries if entries is not None else {}
+        self._keys = sorted(self._key(uid) for uid in self.entries)
+
+    def _key(self, uid: str) -> Tuple[float, str]:
+        return -self.entries[uid][self.field], uid
+
+    def get(self, uid: str) -> dict:
+        return self.entries.get(uid) or new_entry()
+
+    def update(self, uid: str, entry: dict):
+        if uid in self.entries:
+            del self._keys[bisect_left(self._keys, self._key(uid))]
+        self.entries[uid] = entry
+        insort(self._keys, self._key(uid))
+
+    def top(self, n: int = 10) -> List[Tuple[str, dict]]:
+        return [(uid, self.entries[uid]) for _, uid in self._keys[:n]]
+
+    def rank(self, uid: str) -> Optional[int]:
+        if uid not in self.entries:
+            return None
+        return bisect_left(self._keys, self._key(uid)) + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class LeaderboardStore:
+    """Classements global (par Elo) et par pack (par meilleur score)
+
+    Les résultats de fin de partie sont appliqués en mémoire puis écrits par lots avec les statistiques des joueurs."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.glob = None
+        self.packs = {}
+        self._dirty_global = set()
+        self._dirty_packs = set()
+        self._pending_stats = {}
+
+    async def initialize(self):
+        if self.glob is not None:
+            return
+        self.glob = Leaderboard('elo', await self.config.Global_Leaderboard())
+        self.packs = {pid: Leaderboard('best', data) for pid, data in (await self.config.Packs_Leaderboard()).items()}
+
+    def pack(self, pack_id: str) -> Leaderboard:
+        if pack_id not in self.packs:
+            self.packs[pack_id] = Leaderboard('best')
+        return self.packs[pack_id]
+
+    def _add_score(self, pack_id: str, uid: str, score: int):
+        for lb in (self.glob, self.pack(pack_id)):
+            entry = dict(lb.get(uid))
+            entry['best'] = max(entry['best'], score)
+            entry['total'] += score
+            entry['games'] += 1
+            lb.update(uid, entry)
+        self._dirty_global.add(uid)
+        self._dirty_packs.add((pack_id, uid))
+
+    def _add_stat(self, uid: str, stat: str):
+        self._pending_stats.setdefault(uid, {'w': 0, 'd': 0, 'l': 0})[stat] += 1
+
+    async def record_score(self, pack_id: str, user_id: int, score: int):
+        """Enregistre le score d'une partie solo"""
+        await self.initialize()
+        self._add_score(pack_id, str(user_id), score)
+
+    async def record_challenge(self, pack_id: str, user_id: int, score: int, opponent_id: int, opponent_score: int):
+        """Enregistre le résultat d'un défi et met à jour l'Elo des deux joueurs"""
+        await self.initialize()
+        uid, oid = str(user_id), str(opponent_id)
+        self._add_score(pack_id, uid, score)
+
+        result = 1 if score > opponent_score else 0.5 if score == opponent_score else 0
+        user, opp = dict(self.glob.get(uid)), dict(self.glob.get(oid))
+        delta = elo_delta(user['elo'], opp['elo'], result)
+        user['elo'] = round(user['elo'] + delta, 1)
+        opp['elo'] = round(opp['elo'] - delta, 1)
+        self.glob.update(uid, user)
+        self.glob.update(oid, opp)
+        self._dirty_global.update((uid, oid))
+
+        stats = {1: ('w', 'l'), 0.5: ('d', 'd'), 0: ('l', 'w')}[result]
+        self._add_stat(uid, stats[0])
+        self._add_stat(oid, stats[1])
+
+    async def flush(self):
+        """Écrit les classements modifiés et les statistiques des joueurs en attente
+
+        En cas d'erreur, ce qui n'a pas pu être écrit est remis en attente pour la prochaine écriture"""
+        if self.glob is None:
+            return
+        dirty_global, self._dirty_global = self._dirty_global, set()
+        dirty_packs, self._dirty_packs = self._dirty_packs, set()
+        pending, self._pending_stats = self._pending_stats, {}
+
+        try:
+            for uid in dirty_global:
+                await self.config.Global_Leaderboard.set_raw(uid, value=self.glob.entries[uid])
+            for pack_id, uid in dirty_packs:
+                await self.config.Packs_Leaderboard.set_raw(pack_id, uid, value=self.packs[pack_id].entries[uid])
+            for uid in list(pending):
+                async with self.config.user_from_id(int(uid)).stats() as stats:
+                    for k, v in pending[uid].items():
+                        stats[k] = stats.get(k, 0) + v
+                # Les statistiques sont incrémentales : celles déjà écrites ne doivent pas être remises en attente
+                del pending[uid]
+        except Exception:
+            # Réécrire un classement est sans effet s'il l'a déjà été, il suffit de tout remettre en attente
+            self._dirty_global |= dirty_global
+            self._dirty_packs |= dirty_packs
+            for uid, incr in pending.items():
+                for k, v in incr.items():
+                    self._pending_stats.setdefault(uid, {'w': 0, 'd': 0, 'l': 0})[k] += v
+            raise
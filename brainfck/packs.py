@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("red.RedAppsv2.brainfck.packs")
+
+CACHE_VERSION = 1
+
+
+class PackStore:
+    """Cache compilé des packs de questions
+
+    Chaque fichier .yaml validé est enregistré dans un cache JSON avec son mtime, sa taille et son empreinte SHA-1.
+    Au rechargement, seuls les fichiers dont le contenu a réellement changé sont relus et validés (dans un pool de threads)."""
+
+    def __init__(self, directory: Path, cache_path: Path, reader: Callable[[str], Tuple[str, dict]], workers: int = 4):
+        self.directory = directory
+        self.cache_path = cache_path
+        self.reader = reader
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="brainfck-packs")
+
+        self.files = {}   # Chemin -> {'mtime', 'size', 'hash', 'id', 'pack'}
+        self.errors = {}  # Chemin -> (Empreinte, Message d'erreur)
+        self.duplicates = {}  # Chemin -> ID en doublon
+        self._lock = asyncio.Lock()
+        self._cache_loaded = False
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def scan(self) -> Dict[str, os.stat_result]:
+        """Liste les fichiers .yaml du dossier des packs avec leurs informations"""
+        found = {}
+        for dirpath, _, filenames in os.walk(str(self.directory)):
+            for f in filenames:
+                if f.endswith(".yaml"):
+                    path = os.path.abspath(os.path.join(dirpath, f))
+                    found[path] = os.stat(path)
+        return found
+
+    def _read_cache(self):
+        try:
+            with open(str(self.cache_path), 'rt', encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != CACHE_VERSION:
+            return {}
+        return data.get('files', {})
+
+    def _write_cache(self):
+        tmp = str(self.cache_path) + ".tmp"
+        with open(tmp, 'wt', encoding='utf8') as f:
+            json.dump({'version': CACHE_VERSION, 'files': self.files}, f, ensure_ascii=False)
+        os.replace(tmp, str(self.cache_path))
+
+    def _compile(self, path: str, stat: os.stat_result, digest: str) -> dict:
+        pid, pack = self.reader(path)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': digest, 'id': pid, 'pack': pack}
+
+    def _refresh(self, only: list = None) -> Tuple[list, Dict[str, dict]]:
+        """Met à jour le cache à partir du disque et renvoie les chemins dont le contenu a changé et les packs valides"""
+        if not self._cache_loaded:
+            self.files = self._read_cache()
+            self._cache_loaded = True
+
+        found = self.scan()
+        if only is not None:
+            paths = {os.path.abspath(p) for p in only}
+            found = {p: s for p, s in found.items() if p in paths}
+            removed = [p for p in paths if p not in found]
+        else:
+            removed = [p for p in set(self.files) | set(self.errors) if p not in found]
+
+        changed = []
+        for path in removed:
+            self.errors.pop(path, None)
+            if self.files.pop(path, None):
+                changed.append(path)
+
+        to_compile = []
+        for path, stat in found.items():
+            entry = self.files.get(path)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+            digest = self.file_hash(path)
+            if entry and entry['hash'] == digest:
+                entry['mtime'], entry['size'] = stat.st_mtime, stat.st_size
+                continue
+            if path in self.errors and self.errors[path][0] == digest:
+                continue
+            to_compile.append((path, stat, digest))
+
+        futures = {path: self.executor.submit(self._compile, path, stat, digest) for path, stat, digest in to_compile}
+        digests = {path: digest for path, _, digest in to_compile}
+        for path, future in futures.items():
+            try:
+                self.files[path] = future.result()
+            except Exception as e:
+                logger.info(msg=f"Pack invalide ignoré ({path}) : {e}")
+                self.files.pop(path, None)
+                self.errors[path] = (digests[path], str(e))
+            else:
+                self.errors.pop(path, None)
+            changed.append(path)
+
+        if changed:
+            self._write_cache()
+        return changed, self._packs()
+
+    def _packs(self) -> Dict[str, dict]:
+        """Renvoie les packs valides indexés par leur ID (le premier fichier chargé l'emporte en cas de doublon)"""
+        loaded, duplicates = {}, {}
+        for path in sorted(self.files):
+            entry = self.files[path]
+            if entry['id'] in loaded:
+                duplicates[path] = entry['id']
+                continue
+            loaded[entry['id']] = entry['pack']
+        self.duplicates = duplicates
+        return loaded
+
+    async def refresh(self, only: list = None) -> Tuple[list, Dict[str, dict]]:
+        """Version asynchrone de la mise à jour, exécutée hors de la boucle d'événements
+
+        Les packs sont listés pendant la mise à jour, sous le verrou, pour ne jamais lire un état partiellement modifié"""
+        async with self._lock:
+            return await asyncio.get_event_loop().run_in_executor(None, self._refresh, only)
+
+    def pack_id_of(self, path: str):
+        entry = self.files.get(os.path.abspath(path))
+        return entry['id'] if entry else None
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class PackWatcher:
+    """Surveille le dossier des packs et ses sous-dossiers et signale les fichiers modifiés
+
+    Utilise inotify (via `inotify_simple`) lorsqu'il est disponible, sinon compare périodiquement les mtimes du dossier.
+    Avec inotify, chaque sous-dossier (y compris ceux créés ensuite) est surveillé ; l'apparition ou la disparition
+    d'un dossier entraîne un rechargement complet (signalé par `None`)."""
+
+    def __init__(self, directory: Path, callback: Callable, interval: float = 10, debounce: float = 1.5):
+        self.directory = directory
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self._task = None
+        self._inotify = None
+        self._flags = None
+        self._dirs = {}  # Descripteur de surveillance -> Dossier
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            logger.info("inotify_simple indisponible, surveillance des packs par sondage")
+            self._task = loop.create_task(self._poll())
+        else:
+            self._inotify = INotify()
+            self._flags = flags
+            self._add_watches(str(self.directory))
+            self._task = loop.create_task(self._watch())
+
+    def _add_watches(self, directory: str):
+        """Surveille le dossier et tous ses sous-dossiers"""
+        flags = self._flags
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE
+        for dirpath, _, _ in os.walk(directory):
+            try:
+                self._dirs[self._inotify.add_watch(dirpath, mask)] = dirpath
+            except OSError:
+                logger.info(f"Impossible de surveiller le dossier de packs {dirpath}")
+
+    def _changes(self, events) -> Tuple[set, bool]:
+        """Renvoie les fichiers .yaml concernés par les événements et si un dossier est apparu ou a disparu"""
+        flags = self._flags
+        paths, full = set(), False
+        for e in events:
+            if e.mask & flags.IGNORED:
+                self._dirs.pop(e.wd, None)
+                continue
+            base = self._dirs.get(e.wd)
+            if base is None:
+                continue
+            if e.mask & flags.ISDIR:
+                if e.mask & (flags.CREATE | flags.MOVED_TO):
+                    self._add_watches(os.path.join(base, e.name))
+                full = True
+            elif e.name.endswith(".yaml"):
+                paths.add(os.path.abspath(os.path.join(base, e.name)))
+        return paths, full
+
+    async def _watch(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            events = await loop.run_in_executor(None, self._inotify.read, 1000)
+            paths, full = self._changes(events)
+            if not paths and not full:
+                continue
+            await asyncio.sleep(self.debounce)
+            more, more_full = self._changes(self._inotify.read(0))
+            await self._notify(None if full or more_full else list(paths | more))
+
+    def _snapshot(self) -> Dict[str, Tuple[float, int]]:
+        snap = {}
+        for dirpath, _, filenames in os.walk(str(self.directory)):
+            for f in filenames:
+                if f.endswith(".yaml"):
+                    path = os.path.abspath(os.path.join(dirpath, f))
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snap[path] = (stat.st_mtime, stat.st_size)
+        return snap
+
+    async def _poll(self):
+        loop = asyncio.get_event_loop()
+        previous = await loop.run_in_executor(None, self._snapshot)
+        while True:
+            await asyncio.sleep(self.interval)
+            current = await loop.run_in_executor(None, self._snapshot)
+            paths = [p for p in set(previous) | set(current) if previous.get(p) != current.get(p)]
+            previous = current
+            if paths:
+                await self._notify(paths)
+
+    async def _notify(self, paths: Optional[list]):
+        try:
+            await self.callback(paths)
+        except Exception as e:
+            logger.error(f"Erreur lors du rechargement des packs modifiés : {paths}", exc_info=e)
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._inotify:
+            self._inotify.close()
@@ -0,0 +1,66 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+import discord
+
+
+class QuizRoom:
+    """Salle de quiz multijoueur liée à un salon
+
+    Les réactions ne sont pas attendues avec `wait_for` : le module les transmet à la salle via `answer()` après une simple
+    recherche par ID de message, ce qui évite d'évaluer un prédicat par joueur et par question à chaque réaction."""
+
+    def __init__(self, channel: discord.TextChannel, host: discord.Member, pack_id: str, pack: dict):
+        self.channel = channel
+        self.host = host
+        self.pack_id = pack_id
+        self.pack = pack
+
+        self.scores = {}   # ID membre -> Score total
+        self.correct = {}  # ID membre -> Nombre de bonnes réponses
+        self.message_id = None
+        self.choices = {}  # Emoji -> Réponse
+        self.answers = {}  # ID membre -> (Réponse, Temps)
+        self.started_at = 0.0
+        self.expected = 0
+        self.everyone_answered = asyncio.Event()
+
+    def open_question(self, message_id: int, choices: Dict[str, str]):
+        self.message_id = message_id
+        self.choices = choices
+        self.answers = {}
+        self.started_at = time.time()
+        self.expected = len(self.scores)
+        self.everyone_answered.clear()
+
+    def close_question(self) -> Dict[int, Tuple[str, float]]:
+        self.message_id = None
+        return self.answers
+
+    def answer(self, user_id: int, emoji: str) -> bool:
+        """Enregistre la première réponse d'un joueur à la question en cours"""
+        if self.message_id is None or emoji not in self.choices or user_id in self.answers:
+            return False
+        self.answers[user_id] = (self.choices[emoji], time.time() - self.started_at)
+        self.scores.setdefault(user_id, 0)
+        if self.expected and all(u in self.answers for u in list(self.scores)[:self.expected]):
+            self.everyone_answered.set()
+        return True
+
+    @staticmethod
+    def time_score(elapsed: float, multiplier: int = 1) -> int:
+        return round((10 - min(elapsed, 10)) * 10) * multiplier
+
+    def score_question(self, good: str, multiplier: int = 1) -> Dict[int, int]:
+        """Attribue les points de la question fermée et renvoie les gains de chaque joueur"""
+        gains = {}
+        for user_id, (rep, elapsed) in self.answers.items():
+            if rep == good:
+                gains[user_id] = self.time_score(elapsed, multiplier)
+                self.scores[user_id] = self.scores.get(user_id, 0) + gains[user_id]
+                self.correct[user_id] = self.correct.get(user_id, 0) + 1
+        return gains
+
+    def ranking(self, limit: Optional[int] = None) -> list:
+        return sorted(self.scores.items(), key=lambda s: s[1], reverse=True)[:limit]
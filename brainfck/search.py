@@ -0,0 +1,94 @@
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple
+
+
+@lru_cache(maxsize=8192)
+def normalize(text: str) -> str:
+    """Minuscules, sans accents ni ponctuation, espaces simples"""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in text).split())
+
+
+@lru_cache(maxsize=8192)
+def trigrams(text: str) -> frozenset:
+    text = f"  {normalize(text)} "
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class SearchIndex:
+    """Index trigramme des packs (ID, nom, description) et des questions
+
+    Chaque document est découpé en trigrammes une seule fois ; une recherche ne parcourt que les listes des trigrammes
+    de la requête, ce qui tolère les fautes de frappe et les saisies partielles sans comparer tous les documents."""
+
+    def __init__(self):
+        self.grams = {}  # Trigramme -> {Documents}
+        self.docs = {}   # Document -> (Type, ID du pack, Texte, Trigrammes)
+        self.by_pack = {}  # ID du pack -> {Documents}
+
+    def _add(self, doc: tuple, kind: str, pack_id: str, text: str):
+        grams = trigrams(text)
+        self.docs[doc] = (kind, pack_id, text, grams)
+        self.by_pack.setdefault(pack_id, set()).add(doc)
+        for g in grams:
+            self.grams.setdefault(g, set()).add(doc)
+
+    def remove_pack(self, pack_id: str):
+        for doc in self.by_pack.pop(pack_id, ()):
+            _, _, _, grams = self.docs.pop(doc)
+            for g in grams:
+                docs = self.grams.get(g)
+                if docs is not None:
+                    docs.discard(doc)
+                    if not docs:
+                        del self.grams[g]
+
+    def add_pack(self, pack_id: str, pack: dict):
+        self.remove_pack(pack_id)
+        self._add(('pack', pack_id), 'pack', pack_id, f"{pack_id} {pack['name']}")
+        self._add(('desc', pack_id), 'pack', pack_id, pack['description'])
+        for question in pack['content']:
+            self._add(('question', pack_id, question), 'question', pack_id, question)
+
+    def sync(self, old: Dict[str, dict], new: Dict[str, dict]):
+        """Met à jour l'index avec les seuls packs ajoutés, modifiés ou supprimés"""
+        for pid in old:
+            if pid not in new:
+                self.remove_pack(pid)
+        for pid, pack in new.items():
+            if old.get(pid) is not pack or pid not in self.by_pack:
+                self.add_pack(pid, pack)
+
+    def search(self, query: str, kind: str = None, limit: int = 10, threshold: float = 0.3) -> List[Tuple[float, tuple]]:
+        """Renvoie les documents les plus proches de la requête sous la forme (score, document)"""
+        qgrams = trigrams(query)
+        if not qgrams:
+            return []
+        hits = {}
+        for g in qgrams:
+            for doc in self.grams.get(g, ()):
+                hits[doc] = hits.get(doc, 0) + 1
+
+        results = []
+        for doc, common in hits.items():
+            dkind, _, text, grams = self.docs[doc]
+            if kind and dkind != kind:
+                continue
+            # Coefficient de Dice, complété par le taux de couverture de la requête pour les saisies partielles
+            score = max(2 * common / (len(qgrams) + len(grams)), 0.9 * common / len(qgrams) if len(qgrams) >= 4 else 0)
+            if score >= threshold:
+                results.append((score, doc))
+        results.sort(key=lambda r: r[0], reverse=True)
+        return results[:limit]
+
+    def find_packs(self, query: str, limit: int = 5) -> List[Tuple[float, str]]:
+        """Renvoie les IDs des packs correspondant le mieux à la requête"""
+        best = {}
+        for score, doc in self.search(query, kind='pack', limit=limit * 2):
+            pid = doc[1]
+            best[pid] = max(best.get(pid, 0), score)
+        return sorted(((s, p) for p, s in best.items()), reverse=True)[:limit]
+
+    def find_questions(self, query: str, limit: int = 10, threshold: float = 0.5) -> List[Tuple[float, str, str]]:
+        return [(score, doc[1], doc[2]) for score, doc in self.search(query, kind='question', limit=limit, threshold=threshold)]
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import random
+import string
+import time
+from typing import Optional
+
+from redbot.core import Config
+
+logger = logging.getLogger("red.RedAppsv2.brainfck.sessions")
+
+SESSION_GROUP = "Session"
+DEFAULT_SESSION = {'author': None,
+                   'pack_id': None,
+                   'answers': {},
+                   'score': 0,
+                   'seed': 0,
+                   'leaderboard': {},
+                   'created': 0}
+
+
+class SessionStore:
+    """Stockage des sessions (défis) Brainfck
+
+    Chaque session est un groupe Config indépendant identifié par son code d'invitation, ce qui permet de lire et d'écrire
+    une session sans charger les autres. Un index en mémoire (code -> pack, pack -> codes) est construit une seule fois au démarrage."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.config.init_custom(SESSION_GROUP, 1)
+        self.config.register_custom(SESSION_GROUP, **DEFAULT_SESSION)
+
+        self.packs = {}    # Code -> ID du pack
+        self.by_pack = {}  # ID du pack -> {Codes}
+        self.created = {}  # Code -> Timestamp de création
+        self._ready = False
+        self._lock = asyncio.Lock()
+
+    async def initialize(self):
+        async with self._lock:
+            if self._ready:
+                return
+            await self._migrate()
+            all_sessions = await self.config.custom(SESSION_GROUP).all()
+            for invite, data in all_sessions.items():
+                self._index(invite, data['pack_id'], data.get('created', 0))
+            self._ready = True
+            logger.info(f"{len(self.packs)} sessions Brainfck indexées")
+
+    async def _migrate(self):
+        """Transfère les sessions de l'ancien dictionnaire global vers des groupes individuels"""
+        old = await self.config.Sessions()
+        if not old:
+            return
+        now = time.time()
+        for invite, data in old.items():
+            data.setdefault('created', now)
+            await self.config.custom(SESSION_GROUP, invite).set(data)
+        await self.config.Sessions.clear()
+        logger.info(f"{len(old)} sessions Brainfck migrées vers le stockage indexé")
+
+    def _index(self, invite: str, pack_id: str, created: float):
+        self.packs[invite] = pack_id
+        self.by_pack.setdefault(pack_id, set()).add(invite)
+        self.created[invite] = created
+
+    def _unindex(self, invite: str):
+        pack_id = self.packs.pop(invite, None)
+        self.created.pop(invite, None)
+        codes = self.by_pack.get(pack_id)
+        if codes is not None:
+            codes.discard(invite)
+            if not codes:
+                del self.by_pack[pack_id]
+
+    def __contains__(self, invite: str) -> bool:
+        return invite in self.packs
+
+    async def get(self, invite: str) -> Optional[dict]:
+        """Renvoie les données de la session ou None si le code n'existe pas"""
+        await self.initialize()
+        if invite not in self.packs:
+            return None
+        return await self.config.custom(SESSION_GROUP, invite).all()
+
+    def new_invite(self) -> str:
+        gen = lambda: "&" + ''.join(random.SystemRandom().choice(string.ascii_letters + string.digits) for _ in range(5))
+        invite = gen()
+        while invite in self.packs:
+            invite = gen()
+        return invite
+
+    async def create(self, data: dict) -> str:
+        """Enregistre une nouvelle session et renvoie son code d'invitation"""
+        await self.initialize()
+        invite = self.new_invite()
+        data['created'] = time.time()
+        await self.config.custom(SESSION_GROUP, invite).set(data)
+        self._index(invite, data['pack_id'], data['created'])
+        return invite
+
+    async def add_score(self, invite: str, user_id: int, score: int):
+        """Ajoute le score d'un joueur au classement de la session"""
+        await self.config.custom(SESSION_GROUP, invite).leaderboard.set_raw(str(user_id), value=score)
+
+    async def delete(self, invite: str):
+        await self.config.custom(SESSION_GROUP, invite).clear()
+        self._unindex(invite)
+
+    async def reset_pack(self, pack_id: str) -> int:
+        """Supprime toutes les sessions liées à un pack et renvoie leur nombre"""
+        await self.initialize()
+        codes = list(self.by_pack.get(pack_id, ()))
+        for invite in codes:
+            await self.delete(invite)
+        return len(codes)
+
+    async def expire(self, ttl: int) -> int:
+        """Supprime les sessions créées il y a plus de `ttl` secondes et renvoie leur nombre"""
+        await self.initialize()
+        limit = time.time() - ttl
+        stale = [i for i, created in self.created.items() if created < limit]
+        for invite in stale:
+            await self.delete(invite)
+        return len(stale)
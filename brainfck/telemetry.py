@@ -0,0 +1,191 @@
+import logging
+import math
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("red.RedAppsv2.brainfck.telemetry")
+
+RECORD = struct.Struct('<IIfBI')  # Empreinte du pack, empreinte de la question, latence, drapeaux, timestamp
+HEADER = b'BFT2'  # Les journaux sans cet en-tête sont dans un format antérieur et mis de côté
+FLAG_ANSWERED = 1
+FLAG_CORRECT = 2
+
+
+def question_key(question: str) -> int:
+    return zlib.crc32(question.encode('utf8'))
+
+
+def pack_key(pack_id: str) -> int:
+    return zlib.crc32(pack_id.encode('utf8'))
+
+
+class LatencySketch:
+    """Esquisse de quantiles à précision relative (buckets logarithmiques), de taille bornée et fusionnable"""
+
+    GAMMA = 1.1  # ~5% d'erreur relative
+    MIN_VALUE = 0.05
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.mean = 0.0
+
+    def add(self, value: float):
+        value = max(value, self.MIN_VALUE)
+        index = math.ceil(math.log(value, self.GAMMA))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+
+    def merge(self, other: 'LatencySketch'):
+        for index, nb in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + nb
+        total = self.count + other.count
+        if total:
+            self.mean = (self.mean * self.count + other.mean * other.count) / total
+        self.count = total
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.GAMMA ** index / (self.GAMMA + 1)
+        return None
+
+
+class Aggregate:
+    __slots__ = ('samples', 'answered', 'correct', 'latency')
+
+    def __init__(self):
+        self.samples = 0
+        self.answered = 0
+        self.correct = 0
+        self.latency = LatencySketch()
+
+    def add(self, latency: float, flags: int):
+        self.samples += 1
+        if flags & FLAG_ANSWERED:
+            self.answered += 1
+            self.latency.add(latency)
+        if flags & FLAG_CORRECT:
+            self.correct += 1
+
+    def merge(self, other: 'Aggregate'):
+        self.samples += other.samples
+        self.answered += other.answered
+        self.correct += other.correct
+        self.latency.merge(other.latency)
+
+    @property
+    def correct_rate(self) -> float:
+        return self.correct / self.samples if self.samples else 0.0
+
+
+class Telemetry:
+    """Journal binaire en ajout seul des réponses aux questions, avec agrégats calculés au fil de l'eau
+
+    Le journal est relu une seule fois au démarrage pour reconstruire les agrégats ; les nouvelles réponses sont mises
+    en tampon puis ajoutées en fin de fichier par lots."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.questions = {}  # (Empreinte du pack, Empreinte de la question) -> Aggregate
+        self.packs = {}      # Empreinte du pack -> Aggregate
+        self._buffer = []
+        self.loaded = False
+
+    def read_log(self) -> Tuple[Dict[tuple, Aggregate], Dict[int, Aggregate]]:
+        """Relit le journal et renvoie les agrégats correspondants (sans modifier l'état courant, utilisable hors de la boucle)
+
+        Soulève ValueError si le fichier n'est pas un journal valide"""
+        questions, packs = {}, {}
+        if not os.path.exists(str(self.path)):
+            return questions, packs
+        with open(str(self.path), 'rb') as f:
+            data = f.read()
+        if not data:
+            return questions, packs
+        if not data.startswith(HEADER):
+            raise ValueError("En-tête du journal de télémétrie invalide")
+        data = data[len(HEADER):]
+        usable = len(data) - len(data) % RECORD.size
+        for pkey, qkey, latency, flags, _ in RECORD.iter_unpack(data[:usable]):
+            self._aggregate(pkey, qkey, latency, flags, questions, packs)
+        return questions, packs
+
+    def discard_log(self):
+        """Met de côté un journal illisible pour repartir d'un journal vide, sans bloquer l'écriture des nouvelles réponses"""
+        if os.path.exists(str(self.path)):
+            aside = self.path.with_name(f"{self.path.name}.corrupt-{int(time.time())}")
+            try:
+                os.replace(str(self.path), str(aside))
+                logger.warning(f"Journal de télémétrie illisible déplacé vers {aside}")
+            except OSError:
+                logger.error("Impossible de déplacer le journal de télémétrie illisible", exc_info=True)
+        self.merge({}, {})
+
+    def merge(self, questions: Dict[tuple, Aggregate], packs: Dict[int, Aggregate]):
+        """Intègre les agrégats relus depuis le journal à ceux accumulés depuis le démarrage"""
+        for key, agg in questions.items():
+            self.questions.setdefault(key, Aggregate()).merge(agg)
+        for key, agg in packs.items():
+            self.packs.setdefault(key, Aggregate()).merge(agg)
+        self.loaded = True
+
+    def _aggregate(self, pkey: int, qkey: int, latency: float, flags: int, questions: dict = None, packs: dict = None):
+        questions = self.questions if questions is None else questions
+        packs = self.packs if packs is None else packs
+        questions.setdefault((pkey, qkey), Aggregate()).add(latency, flags)
+        packs.setdefault(pkey, Aggregate()).add(latency, flags)
+
+    def record(self, pack_id: str, question: str, latency: float, answered: bool, correct: bool):
+        flags = (FLAG_ANSWERED if answered else 0) | (FLAG_CORRECT if correct else 0)
+        pkey, qkey = pack_key(pack_id), question_key(question)
+        self._aggregate(pkey, qkey, latency, flags)
+        self._buffer.append(RECORD.pack(pkey, qkey, latency, flags, int(time.time())))
+
+    def flush(self):
+        """Ajoute les réponses en attente au journal (seulement une fois celui-ci relu, pour ne rien compter deux fois)"""
+        if not self._buffer or not self.loaded:
+            return
+        buffer, self._buffer = self._buffer, []
+        try:
+            with open(str(self.path), 'ab') as f:
+                if not f.tell():
+                    f.write(HEADER)
+                f.write(b''.join(buffer))
+        except OSError:
+            logger.error("Impossible d'écrire le journal de télémétrie", exc_info=True)
+            self._buffer = buffer + self._buffer
+
+    def question_stats(self, pack_id: str, question: str) -> Optional[Aggregate]:
+        return self.questions.get((pack_key(pack_id), question_key(question)))
+
+    def pack_stats(self, pack_id: str) -> Optional[Aggregate]:
+        return self.packs.get(pack_key(pack_id))
+
+    def question_ranking(self, pack_id: str, pack: dict, min_samples: int = 5) -> List[Tuple[str, Aggregate]]:
+        """Renvoie les questions du pack ayant assez de données, de la plus difficile à la plus facile"""
+        stats = []
+        for question in pack['content']:
+            agg = self.question_stats(pack_id, question)
+            if agg and agg.samples >= min_samples:
+                stats.append((question, agg))
+        stats.sort(key=lambda s: s[1].correct_rate)
+        return stats
+
+    def adaptive_delay(self, pack_id: str, question: str, default: int, min_samples: int = 10) -> int:
+        """Délai de réponse adapté au 90e centile des temps de réponse observés, borné entre 5s et le double du délai du pack"""
+        agg = self.question_stats(pack_id, question)
+        if not agg or agg.answered < min_samples:
+            return default
+        p90 = agg.latency.quantile(0.9)
+        return int(min(max(5, math.ceil(p90 * 1.25) + 1), default * 2))
@@ -10,7 +10,6 @@ from typing import Optional, Union
 from urllib.parse import urlsplit
 
 import aiofiles
-import aiohttp
 import discord
 from PIL import Image, ImageSequence, ImageOps
 import wand
@@ -21,6 +20,7 @@ from redbot.core.utils.chat_formatting import box
 from redbot.core.data_manager import cog_data_path, bundled_data_path
 
 from .converters import ImageFinder
+from .downloader import Downloader, DownloadError
 
 logger = logging.getLogger("red.RedAppsv2.Canva")
 
@@ -46,39 +46,9 @@ class Canva(commands.Cog):
         self.temp = cog_data_path(self) / "temp"
         self.temp.mkdir(exist_ok=True, parents=True)
         
-        self.image_mimes = ["image/png", "image/pjpeg", "image/jpeg", "image/x-icon"]
+        self.image_mimes = ["image/png", "image/pjpeg", "image/jpeg", "image/x-icon", "image/webp", "image/bmp"]
         self.gif_mimes = ["image/gif"]
-        
-    async def download(self, url: str, path: str):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        with open(path, "wb") as f:
-                            f.write(data)
-                        return resp.headers.get("Content-type", "").lower()
-        except asyncio.TimeoutError:
-            return False
-
-    async def bytes_download(self, url: str):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        mime = resp.headers.get("Content-type", "").lower()
-                        b = BytesIO(data)
-                        b.seek(0)
-                        return b, mime
-                    else:
-                        return False, False
-        except asyncio.TimeoutError:
-            return False, False
-        except Exception:
-            logger.error(
-                "Impossible de télécharger en bytes-like", exc_info=True)
-            return False, False
+        self.downloader = Downloader()
         
     async def safe_send(self, ctx, text, file, file_size):
         if not ctx.channel.permissions_for(ctx.me).send_messages:
@@ -147,17 +117,20 @@ class Canva(commands.Cog):
             if rscale < 1:
                 rscale = 1
                 
-            b, mime = await self.bytes_download(url)
-            if mime not in self.image_mimes + self.gif_mimes and not isinstance(
-                url, discord.Asset
-            ):
+            try:
+                image = await self.downloader.fetch(url)
+            except DownloadError:
                 return await ctx.reply("Ce n'est pas une image valide.", mention_author=False)
-            
-            wmm, mime = await self.bytes_download(mark)
-            wm_gif = mime in self.gif_mimes
-            if wmm is False or b is False:
+            if image.mime not in self.image_mimes + self.gif_mimes:
+                return await ctx.reply("Ce n'est pas une image valide.", mention_author=False)
+
+            try:
+                watermark = await self.downloader.fetch(mark)
+            except DownloadError:
                 await ctx.send(":warning: **Le téléchargement du canva échoué...**")
                 return
+            b, wmm = BytesIO(image.data), BytesIO(watermark.data)
+            wm_gif = watermark.mime in self.gif_mimes
             wmm.name = "watermark.png"
             if wm_gif:
                 wmm.name = "watermark.gif"
@@ -356,3 +329,6 @@ class Canva(commands.Cog):
                 txt += f"- {canva}\n"
             em = discord.Embed(title=f"Canva disponibles sur *{ctx.guild.name}*", description=box(txt))
             await ctx.reply(embed=em, mention_author=False)
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.downloader.close())
@@ -0,0 +1,162 @@
+# Service de téléchargement des cogs d'images : session unique réutilisée, transfert borné en taille, format détecté
+# d'après le contenu, téléchargements simultanés d'une même URL regroupés et contenus récents gardés quelques instants
+#
+# Module partagé : chaque cog s'installant séparément, ce fichier est copié à l'identique dans canva, hexcolor et imgedit
+# (comme converters.py). Toute modification doit être reportée dans les trois copies, ce que vérifie
+# tests/test_shared_modules.py
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import aiohttp
+
+# Signatures des formats reconnus : (décalage, octets, type MIME, extension)
+SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (0, b'GIF87a', 'image/gif', 'gif'),
+    (0, b'GIF89a', 'image/gif', 'gif'),
+    (8, b'WEBP', 'image/webp', 'webp'),
+    (0, b'BM', 'image/bmp', 'bmp'),
+    (0, b'\x00\x00\x01\x00', 'image/x-icon', 'ico'),
+    (4, b'ftyp', 'video/mp4', 'mp4'),
+]
+SNIFF_SIZE = 16
+
+
+class DownloadError(Exception):
+    """Soulevée lorsque le fichier n'a pas pu être téléchargé, dépasse la taille maximale ou n'est pas dans un format attendu"""
+
+
+class Download(NamedTuple):
+    data: bytes
+    mime: str  # Type détecté d'après le contenu, à défaut celui annoncé par le serveur
+    ext: str
+
+
+def sniff(data: bytes) -> Optional[Tuple[str, str]]:
+    """Renvoie (type MIME, extension) d'après les premiers octets du fichier, ou None si le format n'est pas reconnu"""
+    for offset, magic, mime, ext in SIGNATURES:
+        if data[offset:offset + len(magic)] == magic:
+            if ext == 'webp' and data[:4] != b'RIFF':
+                continue
+            return mime, ext
+    head = data[:256].lstrip().lower()
+    if head.startswith(b'<svg') or (head.startswith(b'<?xml') and b'<svg' in head):
+        return 'image/svg+xml', 'svg'
+    return None
+
+
+def is_image(kind: Optional[Tuple[str, str]]) -> bool:
+    """Indique si le format détecté par `sniff` est une image (une vidéo MP4 est reconnue mais n'en est pas une)"""
+    return kind is not None and kind[0].startswith('image/')
+
+
+class Downloader:
+    """Téléchargeur partagé par toutes les commandes d'un module
+
+    Le transfert est lu par morceaux et interrompu dès que la taille maximale est dépassée ou, si `images_only` est
+    demandé, dès que les premiers octets ne correspondent à aucun format d'image."""
+
+    def __init__(self, max_size: int = 20 * 1024 * 1024, timeout: float = 20, connections: int = 8,
+                 ttl: float = 120, max_cached: int = 32 * 1024 * 1024):
+        self.max_size = max_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=5)
+        self.connections = connections
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.session = None  # type: Optional[aiohttp.ClientSession]
+        self.inflight = {}  # type: Dict[Tuple[str, bool], asyncio.Future]
+        self.recent = OrderedDict()  # URL -> (Expiration, Download)
+        self.recent_size = 0
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    def _cached(self, url: str) -> Optional[Download]:
+        entry = self.recent.get(url)
+        if entry is None:
+            return None
+        expires, download = entry
+        if expires < time.monotonic():
+            del self.recent[url]
+            self.recent_size -= len(download.data)
+            return None
+        self.recent.move_to_end(url)
+        return download
+
+    def _remember(self, url: str, download: Download):
+        if len(download.data) > self.max_cached // 4:
+            return
+        if url in self.recent:
+            self.recent_size -= len(self.recent.pop(url)[1].data)
+        self.recent[url] = (time.monotonic() + self.ttl, download)
+        self.recent_size += len(download.data)
+        while self.recent_size > self.max_cached:
+            _, (_, old) = self.recent.popitem(last=False)
+            self.recent_size -= len(old.data)
+
+    async def _fetch(self, url: str, images_only: bool) -> Download:
+        try:
+            async with self._session().get(url) as resp:
+                if resp.status != 200:
+                    raise DownloadError(f"Réponse HTTP {resp.status}")
+                if resp.content_length and resp.content_length > self.max_size:
+                    raise DownloadError("Fichier trop volumineux")
+                data = bytearray()
+                kind = None
+                async for chunk in resp.content.iter_chunked(65536):
+                    data.extend(chunk)
+                    if len(data) > self.max_size:
+                        raise DownloadError("Fichier trop volumineux")
+                    if kind is None and len(data) >= SNIFF_SIZE:
+                        kind = sniff(bytes(data[:256]))
+                        if images_only and not is_image(kind):
+                            raise DownloadError("Le fichier n'est pas une image")
+                header = resp.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DownloadError(str(e) or e.__class__.__name__)
+
+        data = bytes(data)
+        kind = kind or sniff(data)
+        if images_only and not is_image(kind):
+            raise DownloadError("Le fichier n'est pas une image")
+        if kind is None:
+            kind = header, header.rsplit('/', 1)[-1]
+        return Download(data, *kind)
+
+    async def fetch(self, url: str, *, images_only: bool = True) -> Download:
+        """Télécharge le fichier en mémoire, ou renvoie celui téléchargé récemment ou en cours de téléchargement"""
+        url = str(url)
+        download = self._cached(url)
+        if download is not None:
+            if images_only and not is_image((download.mime, download.ext)):
+                raise DownloadError("Le fichier n'est pas une image")
+            return download
+
+        future = self.inflight.get((url, images_only))
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(url, images_only))
+            self.inflight[(url, images_only)] = future
+
+            def done(f: asyncio.Future):
+                self.inflight.pop((url, images_only), None)
+                if not f.cancelled() and not f.exception():
+                    self._remember(url, f.result())
+            future.add_done_callback(done)
+        # Un demandeur annulé ne doit pas interrompre le téléchargement attendu par les autres
+        return await asyncio.shield(future)
+
+    async def close(self):
+        for future in self.inflight.values():
+            future.cancel()
+        self.inflight.clear()
+        self.recent.clear()
+        self.recent_size = 0
+        if self.session is not None:
+            await self.session.close()
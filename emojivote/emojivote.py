@@ -1,3 +1,4 @@
+import asyncio
 from copy import copy
 from datetime import datetime, timedelta
 import time
@@ -32,36 +33,113 @@ class EmojiVote(commands.Cog):
                          'props_duration': 604800} # Une semaine
         self.config.register_guild(**default_guild)
 
-        self.check_emoji_votes.start()
+        self.rollover_tasks = {}
+        self.props_channels = set()
+        self.props_cache = {}
+        self.props_dirty = set()
+        self.settings_cache = {}
+        self.bot.loop.create_task(self.schedule_all_rollovers())
+        self.flush_props_loop.start()
 
-
-    @tasks.loop(minutes=1)
-    async def check_emoji_votes(self):
+    async def schedule_all_rollovers(self):
+        """Charge les salons de propositions et programme la prochaine fin de période de chaque serveur au chargement du module"""
         all_guilds = await self.config.all_guilds()
-        for g in all_guilds:
-            if all_guilds[g]['channel']:
-                if all_guilds[g]['props_expiration'] + all_guilds[g]['props_duration'] <= time.time():
-                    guild = self.bot.get_guild(g)
-                    channel = guild.get_channel(all_guilds[g]['channel'])
-                    await self.config.guild(guild).props_users.clear()
-                    await self.config.guild(guild).props_expiration.set(time.time())
-                    duration = await self.config.guild(guild).props_duration()
-                    
-                    for target in [t for t in channel.overwrites if type(t) == discord.Member]:
-                        await channel.set_permissions(target, overwrite=None)
-                    
-                    em = discord.Embed(title="Nouvelle période de propositions d'emojis", description="Les limites de propositions ont été réinitialisées.\n" \
-                                    "N'oubliez pas que vous n'avez le droit qu'à un nombre limité de propositions et qu'elles doivent être réalisées dans des messages distincts.")
-                    em.add_field(name="Fin de la période*", value=box((datetime.now() + timedelta(seconds=duration)).strftime("%d/%m/%Y %H:%M")))
-                    em.set_footer(text="*Estimation, la période peut terminer avant ou après si un modérateur le décide")
-                    await channel.send(embed=em)
-
-    @check_emoji_votes.before_loop
-    async def before_check(self):
-        logger.info('Starting check_emoji_votes loop...')
+        self.props_channels = {all_guilds[g]['channel'] for g in all_guilds if all_guilds[g]['channel']}
+
         await self.bot.wait_until_ready()
-        
-        
+        logger.info('Scheduling emoji proposal rollovers...')
+        for g in all_guilds:
+            if all_guilds[g]['channel'] and all_guilds[g]['props_expiration'] is not None:
+                self.schedule_rollover(g, all_guilds[g]['props_expiration'] + all_guilds[g]['props_duration'])
+
+    def schedule_rollover(self, guild_id: int, timestamp: float):
+        """(Re)programme la fin de période du serveur au moment indiqué"""
+        self.cancel_rollover(guild_id)
+        self.rollover_tasks[guild_id] = self.bot.loop.create_task(self._rollover_timer(guild_id, timestamp))
+
+    def cancel_rollover(self, guild_id: int):
+        task = self.rollover_tasks.pop(guild_id, None)
+        if task:
+            task.cancel()
+
+    async def _rollover_timer(self, guild_id: int, timestamp: float):
+        await asyncio.sleep(max(timestamp - time.time(), 0))
+        self.rollover_tasks.pop(guild_id, None)
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return
+        try:
+            await self.start_new_period(guild)
+        except Exception as e:
+            logger.error(f"Erreur lors du changement de période sur {guild_id}", exc_info=e)
+
+    async def get_props_users(self, guild: discord.Guild) -> dict:
+        """Renvoie les compteurs de propositions du serveur, chargés une seule fois en mémoire"""
+        if guild.id not in self.props_cache:
+            self.props_cache[guild.id] = await self.config.guild(guild).props_users()
+        return self.props_cache[guild.id]
+
+    async def get_settings(self, guild: discord.Guild) -> dict:
+        """Renvoie les paramètres du serveur utilisés à chaque proposition, chargés une seule fois en mémoire"""
+        if guild.id not in self.settings_cache:
+            setts = await self.config.guild(guild).all()
+            self.settings_cache[guild.id] = {k: setts[k] for k in ('channel', 'mods_immune', 'booster_bonus')}
+        return self.settings_cache[guild.id]
+
+    async def flush_props(self):
+        """Enregistre les compteurs de propositions modifiés depuis la dernière écriture
+
+        Les serveurs dont l'écriture a échoué restent à enregistrer au prochain passage"""
+        dirty, self.props_dirty = self.props_dirty, set()
+        for guild_id in dirty:
+            if guild_id in self.props_cache:
+                try:
+                    await self.config.guild_from_id(guild_id).props_users.set(self.props_cache[guild_id])
+                except Exception as e:
+                    logger.error(f"Impossible d'enregistrer les propositions de {guild_id}", exc_info=e)
+                    self.props_dirty.add(guild_id)
+
+    @tasks.loop(seconds=30)
+    async def flush_props_loop(self):
+        try:
+            await self.flush_props()
+        except Exception as e:
+            logger.error("Erreur lors de l'enregistrement des propositions", exc_info=e)
+
+    async def start_new_period(self, guild: discord.Guild):
+        """Réinitialise les limites de propositions, nettoie les permissions du salon et programme la période suivante"""
+        setts = await self.config.guild(guild).all()
+        channel = guild.get_channel(setts['channel']) if setts['channel'] else None
+        if not channel:
+            return self.cancel_rollover(guild.id)
+
+        now = time.time()
+        self.props_cache[guild.id] = {}
+        self.props_dirty.discard(guild.id)
+        await self.config.guild(guild).props_users.clear()
+        await self.config.guild(guild).props_expiration.set(now)
+        self.schedule_rollover(guild.id, now + setts['props_duration'])
+
+        await self.clear_member_overwrites(channel)
+
+        em = discord.Embed(title="Nouvelle période de propositions d'emojis", description="Les limites de propositions ont été réinitialisées.\n" \
+                           "N'oubliez pas que vous n'avez le droit qu'à un nombre limité de propositions et qu'elles doivent être réalisées dans des messages distincts.")
+        em.add_field(name="Fin de la période*", value=box((datetime.now() + timedelta(seconds=setts['props_duration'])).strftime("%d/%m/%Y %H:%M")))
+        em.set_footer(text="*Estimation, la période peut terminer avant ou après si un modérateur le décide")
+        await channel.send(embed=em)
+
+    async def clear_member_overwrites(self, channel: discord.TextChannel):
+        """Retire les permissions spécifiques aux membres du salon en une seule modification si possible"""
+        members = [t for t in channel.overwrites if isinstance(t, discord.Member)]
+        if not members:
+            return
+        kept = {t: o for t, o in channel.overwrites.items() if not isinstance(t, discord.Member)}
+        try:
+            await channel.edit(overwrites=kept, reason="Nouvelle période de propositions d'emojis")
+        except discord.HTTPException:
+            for target in members:
+                await channel.set_permissions(target, overwrite=None)
+
     @commands.group(name="emojivoteset", aliases=['evset'])
     @checks.admin_or_permissions(manage_messages=True)
     async def emojivote_settings(self, ctx):
@@ -72,12 +150,19 @@ class EmojiVote(commands.Cog):
         """Configurer le salon textuel reçevant les propositions d'emojis, activant de facto la fonctionnalité sur votre serveur
         
         Ne pas préciser de salon désactive la fonctionnalité sur votre serveur"""
+        old = await self.config.guild(ctx.guild).channel()
+        self.props_channels.discard(old)
         if channel:
+            self.props_channels.add(channel.id)
             await self.config.guild(ctx.guild).channel.set(channel.id)
+            self.settings_cache.pop(ctx.guild.id, None)
             await self.config.guild(ctx.guild).props_expiration.set(time.time())
+            self.schedule_rollover(ctx.guild.id, time.time() + await self.config.guild(ctx.guild).props_duration())
             await ctx.send(f"**Channel de proposition configuré** • Vérifiez que {channel.mention} soit correctement paramétré en permissions, notamment en donnant l'accès en écriture aux membres ayant la possibilité de proposer les emojis.")
         else:
             await self.config.guild(ctx.guild).channel.clear()
+            self.settings_cache.pop(ctx.guild.id, None)
+            self.cancel_rollover(ctx.guild.id)
             await ctx.send("**Proposition d'emojis désactivé** • Aucun channel n'est désormais dédié à cette fonctionnalité")
             
     @emojivote_settings.command(name="immunemods")
@@ -89,6 +174,7 @@ class EmojiVote(commands.Cog):
         else:
             await ctx.send("**Activé** • Les modérateurs sont immunisés à la suppression de propositions supperflues et au mute de salon")
         await self.config.guild(ctx.guild).mods_immune.set(not current)
+        self.settings_cache.pop(ctx.guild.id, None)
             
     @emojivote_settings.command(name="periode")
     async def props_duration(self, ctx, value: int = 10080):
@@ -97,10 +183,13 @@ class EmojiVote(commands.Cog):
         Par défaut 10080 (1 semaine)
         La valeur ne peut être inférieure à 30 minutes"""
         if value < 30:
-            await ctx.send("**Erreur** • La période ne peut être inférieure à 30 minutes")
+            return await ctx.send("**Erreur** • La période ne peut être inférieure à 30 minutes")
 
         value *= 60
         await self.config.guild(ctx.guild).props_duration.set(value)
+        expiration = await self.config.guild(ctx.guild).props_expiration()
+        if await self.config.guild(ctx.guild).channel() and expiration is not None:
+            self.schedule_rollover(ctx.guild.id, expiration + value)
         await ctx.send(f"**Valeur modifiée** • Les périodes de propositions dureront désormais {value / 60} minutes")
             
     @emojivote_settings.command(name="manualreset")
@@ -109,22 +198,8 @@ class EmojiVote(commands.Cog):
         
         Attention, cette action est irréversible"""
         guild = ctx.guild
-        channel = await self.config.guild(guild).channel()
-        if channel:
-            channel = guild.get_channel(channel)
-            await self.config.guild(guild).props_users.clear()
-            await self.config.guild(guild).props_expiration.set(time.time())
-            duration = await self.config.guild(guild).props_duration()
-            
-            em = discord.Embed(title="Nouvelle période de propositions d'emojis", description="Les limites de propositions ont été réinitialisées.\n" \
-                               "N'oubliez pas que vous n'avez le droit qu'à un nombre limité de propositions et qu'elles doivent être réalisées dans des messages distincts.")
-            em.add_field(name="Fin de la période*", value=box((datetime.now() + timedelta(seconds=duration)).strftime("%d/%m/%Y %H:%M")))
-            em.set_footer(text="*Estimation, la période peut terminer avant ou après si un modérateur le décide")
-        
-            for target in [t for t in channel.overwrites if type(t) == discord.Member]:
-                await channel.set_permissions(target, overwrite=None)
-            
-            await channel.send(embed=em)
+        if await self.config.guild(guild).channel():
+            await self.start_new_period(guild)
         else:
             await ctx.send("**Erreur** • Le salon de proposition d'emojis n'est pas configuré. Consultez `;help evset channel` pour plus d'informations.")
 
@@ -137,15 +212,19 @@ class EmojiVote(commands.Cog):
         else:
             await ctx.send("**Activé** • Les boosters du serveur bénéficient désormais de la possibilité de proposer deux emojis")
         await self.config.guild(ctx.guild).booster_bonus.set(not current)
+        self.settings_cache.pop(ctx.guild.id, None)
 
 
     @commands.Cog.listener()
     async def on_message(self, message):
+        if not message.guild or message.channel.id not in self.props_channels:
+            return
         channel, guild, author = message.channel, message.guild, message.author
-        setts = await self.config.guild(guild).all()
+        setts = await self.get_settings(guild)
         
         if channel.id == setts.get('channel', False):
-            prop_nb = setts['props_users'].get(str(author.id), 0)
+            props_users = await self.get_props_users(guild)
+            prop_nb = props_users.get(str(author.id), 0)
             prop_limit = 1 if not author.premium_since else 2
             props = 0
             
@@ -173,10 +252,16 @@ class EmojiVote(commands.Cog):
                     pass
                 return message.delete()
             
-            await self.config.guild(guild).props_users.set_raw(author.id, value=prop_nb + props)
+            props_users[str(author.id)] = prop_nb + props
+            self.props_dirty.add(guild.id)
             if prop_nb + props >= prop_limit and not all([author.permissions_in(channel).manage_messages and setts['mods_immune']]):
                 await channel.set_permissions(author, send_messages=False, reason="Proposition(s) d'emoji réalisée(s)")
             
             if props:
                 start_adding_reactions(message, ['⬆️','⬇️'])
-        
+
+    def cog_unload(self):
+        self.flush_props_loop.cancel()
+        self.bot.loop.create_task(self.flush_props())
+        for task in self.rollover_tasks.values():
+            task.cancel()
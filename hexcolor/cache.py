@@ -0,0 +1,175 @@
+# Cache adressé par contenu des palettes extraites et des images rendues : LRU en mémoire doublé d'un stockage sur disque
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("red.RedAppsv2.HexColor.cache")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def make_key(kind: str, digest: str, *params) -> str:
+    """Clef d'une entrée : le type de résultat, l'empreinte du contenu source et les paramètres d'extraction"""
+    raw = ":".join([kind, digest] + [str(p) for p in params])
+    return hashlib.sha1(raw.encode('utf8')).hexdigest()
+
+
+class PaletteCache:
+    """Cache à deux niveaux des résultats d'extraction (couleurs + image rendue éventuelle)
+
+    Les entrées les plus récentes sont gardées en mémoire, toutes sont écrites sur disque ; chaque niveau est borné
+    en taille et évince les entrées les moins récemment utilisées. Les lectures et écritures de fichiers sont faites
+    dans un thread pour ne pas bloquer la boucle d'événements, l'index des entrées n'étant modifié que depuis celle-ci.
+    L'image est enregistrée avec l'extension de son format (PNG ou WebP)."""
+
+    IMAGE_EXTS = ('png', 'webp')
+
+    def __init__(self, path: Path, max_memory: int = 16 * 1024 * 1024, max_disk: int = 128 * 1024 * 1024):
+        self.path = path
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.memory = OrderedDict()  # Clef -> (Couleurs, Image)
+        self.memory_size = 0
+        self.disk = OrderedDict()  # Clef -> (Taille sur disque, Extension de l'image ou '' sans image)
+        self.disk_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Retrouve les entrées déjà présentes sur disque, de la moins récemment utilisée à la plus récente"""
+        entries = {}
+        for file in os.scandir(str(self.path)):
+            key, ext = os.path.splitext(file.name)
+            ext = ext[1:]
+            if ext != 'json' and ext not in self.IMAGE_EXTS:
+                continue
+            stat = file.stat()
+            size, mtime, image_ext = entries.get(key, (0, 0, ''))
+            entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime), image_ext if ext == 'json' else ext)
+        for key, (size, _, ext) in sorted(entries.items(), key=lambda e: e[1][1]):
+            self.disk[key] = (size, ext)
+            self.disk_size += size
+        self._remove_files(self._evict_disk())
+
+    def _files(self, key: str, ext: str) -> List[str]:
+        """Fichiers d'une entrée : les couleurs (JSON) puis, si elle en a une, l'image"""
+        files = [str(self.path / f"{key}.json")]
+        if ext:
+            files.append(str(self.path / f"{key}.{ext}"))
+        return files
+
+    @staticmethod
+    def _remove_files(files: List[str]):
+        for file in files:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _sizeof(colors: list, image: bytes) -> int:
+        return len(image) + 32 * len(colors) + 64
+
+    def _remember(self, key: str, colors: list, image: bytes):
+        if key in self.memory:
+            self.memory_size -= self._sizeof(*self.memory.pop(key))
+        self.memory[key] = (colors, image)
+        self.memory_size += self._sizeof(colors, image)
+        while self.memory_size > self.max_memory and len(self.memory) > 1:
+            _, old = self.memory.popitem(last=False)
+            self.memory_size -= self._sizeof(*old)
+
+    def _evict_disk(self) -> List[str]:
+        """Retire de l'index les entrées en trop et renvoie leurs fichiers, à supprimer"""
+        files = []
+        while self.disk_size > self.max_disk and self.disk:
+            key, (size, ext) = self.disk.popitem(last=False)
+            self.disk_size -= size
+            files += self._files(key, ext)
+        return files
+
+    def _read(self, files: List[str]) -> Optional[Tuple[list, bytes]]:
+        try:
+            with open(files[0], 'r') as f:
+                colors = [tuple(c) for c in json.load(f)]
+            image = b''
+            if len(files) > 1:
+                with open(files[1], 'rb') as f:
+                    image = f.read()
+            os.utime(files[0])
+        except (OSError, ValueError):
+            logger.warning(f"Entrée de cache illisible : {files[0]}", exc_info=True)
+            return None
+        return colors, image
+
+    @staticmethod
+    def _write(files: List[str], colors: list, image: bytes) -> int:
+        with open(files[0], 'w') as f:
+            json.dump(colors, f)
+        if len(files) > 1:
+            with open(files[1], 'wb') as f:
+                f.write(image)
+        return os.path.getsize(files[0]) + len(image)
+
+    async def get(self, key: str, need_image: bool = False) -> Optional[Tuple[List[tuple], bytes]]:
+        """Renvoie (couleurs, image) si la clef est en cache ; avec `need_image`, une entrée sans image compte comme absente"""
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+        elif key in self.disk:
+            files = self._files(key, self.disk[key][1])
+            entry = await asyncio.get_event_loop().run_in_executor(None, self._read, files)
+            if entry is None:
+                self.disk_size -= self.disk.pop(key, (0, ''))[0]
+            else:
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                self._remember(key, *entry)
+        if entry is None or (need_image and not entry[1]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    async def set(self, key: str, colors: List[tuple], image: bytes = b'', ext: str = 'png'):
+        """Enregistre les couleurs et l'image éventuelle, `ext` étant le format de l'image (png ou webp)"""
+        colors = [tuple(c) for c in colors]
+        self._remember(key, colors, image)
+        ext = ext.lower() if image else ''
+        files = self._files(key, ext)
+        loop = asyncio.get_event_loop()
+        try:
+            size = await loop.run_in_executor(None, self._write, files, colors, image)
+        except OSError:
+            logger.warning(f"Impossible d'écrire l'entrée de cache {key}", exc_info=True)
+            return
+        self.disk_size -= self.disk.pop(key, (0, ''))[0]
+        self.disk[key] = (size, ext)
+        self.disk_size += size
+        evicted = self._evict_disk()
+        if evicted:
+            await loop.run_in_executor(None, self._remove_files, evicted)
+
+    async def clear(self):
+        files = [file for key, (_, ext) in self.disk.items() for file in self._files(key, ext)]
+        self.memory.clear()
+        self.disk.clear()
+        self.memory_size = self.disk_size = 0
+        await asyncio.get_event_loop().run_in_executor(None, self._remove_files, files)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'memory_entries': len(self.memory), 'memory_size': self.memory_size,
+                'disk_entries': len(self.disk), 'disk_size': self.disk_size,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
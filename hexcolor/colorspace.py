@@ -0,0 +1,157 @@
+# Conversions de couleurs, distance perceptuelle CIEDE2000 et index spatial (arbre k-d) sur les coordonnées Lab
+
+import math
+from typing import Any, Iterable, List, Optional, Tuple
+
+Lab = Tuple[float, float, float]
+
+
+def hex_to_rgb(color: str) -> Tuple[int, int, int]:
+    color = color[-6:]
+    return int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+
+
+def _linear(c: float) -> float:
+    c /= 255
+    return ((c + 0.055) / 1.055) ** 2.4 if c > 0.04045 else c / 12.92
+
+
+def _f(t: float) -> float:
+    return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+
+def rgb_to_lab(rgb: Tuple[int, int, int]) -> Lab:
+    """Convertit une couleur sRGB 8 bits en Lab (illuminant D65), version scalaire de `extract.rgb_to_lab`"""
+    r, g, b = (_linear(c) for c in rgb)
+    x = (0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047
+    y = 0.2126729 * r + 0.7151522 * g + 0.0721750 * b
+    z = (0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883
+    fx, fy, fz = _f(x), _f(y), _f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def hex_to_lab(color: str) -> Lab:
+    return rgb_to_lab(hex_to_rgb(color))
+
+
+def ciede2000(lab1: Lab, lab2: Lab) -> float:
+    """Différence de couleur CIEDE2000 (kL = kC = kH = 1)"""
+    l1, a1, b1 = lab1
+    l2, a2, b2 = lab2
+    c_bar = (math.hypot(a1, b1) + math.hypot(a2, b2)) / 2
+    g = 0.5 * (1 - math.sqrt(c_bar ** 7 / (c_bar ** 7 + 25 ** 7)))
+    a1p, a2p = a1 * (1 + g), a2 * (1 + g)
+    c1p, c2p = math.hypot(a1p, b1), math.hypot(a2p, b2)
+    h1p = math.degrees(math.atan2(b1, a1p)) % 360 if c1p else 0.0
+    h2p = math.degrees(math.atan2(b2, a2p)) % 360 if c2p else 0.0
+
+    dlp = l2 - l1
+    dcp = c2p - c1p
+    if not c1p * c2p:
+        dhp = 0.0
+    elif abs(h2p - h1p) <= 180:
+        dhp = h2p - h1p
+    elif h2p - h1p > 180:
+        dhp = h2p - h1p - 360
+    else:
+        dhp = h2p - h1p + 360
+    dHp = 2 * math.sqrt(c1p * c2p) * math.sin(math.radians(dhp / 2))
+
+    lp_bar = (l1 + l2) / 2
+    cp_bar = (c1p + c2p) / 2
+    if not c1p * c2p:
+        hp_bar = h1p + h2p
+    elif abs(h1p - h2p) <= 180:
+        hp_bar = (h1p + h2p) / 2
+    elif h1p + h2p < 360:
+        hp_bar = (h1p + h2p + 360) / 2
+    else:
+        hp_bar = (h1p + h2p - 360) / 2
+
+    t = (1 - 0.17 * math.cos(math.radians(hp_bar - 30)) + 0.24 * math.cos(math.radians(2 * hp_bar))
+         + 0.32 * math.cos(math.radians(3 * hp_bar + 6)) - 0.20 * math.cos(math.radians(4 * hp_bar - 63)))
+    d_theta = 30 * math.exp(-(((hp_bar - 275) / 25) ** 2))
+    r_c = 2 * math.sqrt(cp_bar ** 7 / (cp_bar ** 7 + 25 ** 7))
+    s_l = 1 + 0.015 * (lp_bar - 50) ** 2 / math.sqrt(20 + (lp_bar - 50) ** 2)
+    s_c = 1 + 0.045 * cp_bar
+    s_h = 1 + 0.015 * cp_bar * t
+    r_t = -math.sin(math.radians(2 * d_theta)) * r_c
+    return math.sqrt((dlp / s_l) ** 2 + (dcp / s_c) ** 2 + (dHp / s_h) ** 2
+                     + r_t * (dcp / s_c) * (dHp / s_h))
+
+
+class KDTree:
+    """Arbre k-d statique sur des points Lab associés à une valeur quelconque
+
+    Les recherches se font en distance euclidienne (ΔE76), qui sert à borner les candidats avant le calcul CIEDE2000."""
+
+    __slots__ = ('root', 'size')
+
+    def __init__(self, items: Iterable[Tuple[Lab, Any]]):
+        items = list(items)
+        self.size = len(items)
+        self.root = self._build(items, 0)
+
+    def _build(self, items: List[Tuple[Lab, Any]], depth: int):
+        if not items:
+            return None
+        axis = depth % 3
+        items.sort(key=lambda i: i[0][axis])
+        mid = len(items) // 2
+        return items[mid], axis, self._build(items[:mid], depth + 1), self._build(items[mid + 1:], depth + 1)
+
+    def within(self, point: Lab, radius: float) -> List[Tuple[float, Lab, Any]]:
+        """Renvoie les éléments situés à moins de `radius` (ΔE76) du point, sous la forme (distance², Lab, valeur)"""
+        found = []
+        r2 = radius * radius
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (lab, value), axis, left, right = node
+            d2 = (lab[0] - point[0]) ** 2 + (lab[1] - point[1]) ** 2 + (lab[2] - point[2]) ** 2
+            if d2 <= r2:
+                found.append((d2, lab, value))
+            diff = point[axis] - lab[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append(near)
+            if diff * diff <= r2:
+                stack.append(far)
+        return found
+
+    def nearest(self, point: Lab) -> Optional[Tuple[float, Lab, Any]]:
+        """Plus proche voisin en distance euclidienne, sous la forme (distance², Lab, valeur)"""
+        best = None
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (lab, value), axis, left, right = node
+            d2 = (lab[0] - point[0]) ** 2 + (lab[1] - point[1]) ** 2 + (lab[2] - point[2]) ** 2
+            if best is None or d2 < best[0]:
+                best = (d2, lab, value)
+            diff = point[axis] - lab[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            if diff * diff < best[0]:
+                stack.append(far)
+            stack.append(near)
+        return best
+
+
+# Le facteur de chroma de CIEDE2000 (1 + 0.045 C) réduit jusqu'à ~7x les écarts mesurés en ΔE76 pour les couleurs
+# les plus saturées : une recherche euclidienne dans ce rayon ne manque donc aucun candidat
+EUCLIDEAN_BOUND = 7.5
+
+
+def nearest_within(tree: KDTree, lab: Lab, max_delta: float) -> Optional[Tuple[float, Any]]:
+    """Renvoie (ΔE2000, valeur) de l'élément perceptuellement le plus proche à moins de `max_delta`, ou None"""
+    if not tree.size or max_delta <= 0:
+        return None
+    best = None
+    for _, other, value in tree.within(lab, max_delta * EUCLIDEAN_BOUND):
+        delta = ciede2000(lab, other)
+        if delta <= max_delta and (best is None or delta < best[0]):
+            best = (delta, value)
+    return best
@@ -0,0 +1,110 @@
+# Extracteurs de couleurs dominantes vectorisés (NumPy) travaillant dans l'espace Lab sur un échantillon de pixels
+
+from typing import List, Tuple
+
+import numpy as np
+
+SAMPLE_SIZE = 8000
+SEED = 0x4EC0
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convertit un tableau (N, 3) de couleurs sRGB 8 bits en Lab (illuminant D65)"""
+    c = rgb.astype(np.float64) / 255
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                        [0.3575761, 0.7151522, 0.1191920],
+                        [0.1804375, 0.0721750, 0.9503041]])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def to_hex(rgb) -> str:
+    return "#" + "".join(f"{int(round(c)):02X}" for c in rgb)
+
+
+def sample_pixels(pixels: np.ndarray, rng: np.random.Generator, size: int = SAMPLE_SIZE) -> Tuple[np.ndarray, float]:
+    """Retire les pixels entièrement transparents et sous-échantillonne le reste
+
+    Renvoie l'échantillon et la part de pixels visibles dans l'image"""
+    total = len(pixels)
+    if pixels.shape[1] == 4:
+        pixels = pixels[pixels[:, 3] > 0][:, :3]
+    opaque = len(pixels) / total if total else 0
+    if len(pixels) > size:
+        pixels = pixels[rng.choice(len(pixels), size, replace=False)]
+    return pixels, opaque
+
+
+def summarize(rgb: np.ndarray, labels: np.ndarray, k: int, opaque: float) -> List[Tuple[str, float]]:
+    """Calcule la couleur moyenne et la part de chaque groupe, du plus représenté au moins représenté"""
+    counts = np.bincount(labels, minlength=k)
+    sums = np.zeros((k, 3))
+    np.add.at(sums, labels, rgb)
+    colors = {}
+    for i in np.argsort(-counts, kind='stable'):
+        if not counts[i]:
+            continue
+        color = to_hex(sums[i] / counts[i])
+        colors[color] = colors.get(color, 0) + counts[i] / len(rgb) * 100 * opaque
+    return [(c, round(float(p), 2)) for c, p in colors.items()]
+
+
+def median_cut(pixels: np.ndarray, limit: int, seed: int = SEED) -> List[Tuple[str, float]]:
+    """Découpage médian dans l'espace Lab : la boîte la plus étendue est coupée en deux à sa médiane jusqu'à obtenir `limit` groupes"""
+    rng = np.random.default_rng(seed)
+    rgb, opaque = sample_pixels(pixels, rng)
+    if not len(rgb):
+        return []
+    lab = rgb_to_lab(rgb)
+    boxes = [np.arange(len(lab))]
+    while len(boxes) < limit:
+        scores = [(np.ptp(lab[b], axis=0).max() * len(b)) if len(b) > 1 else -1 for b in boxes]
+        best = int(np.argmax(scores))
+        if scores[best] <= 0:
+            break
+        box = boxes.pop(best)
+        axis = int(np.argmax(np.ptp(lab[box], axis=0)))
+        order = box[np.argsort(lab[box, axis], kind='stable')]
+        half = len(order) // 2
+        boxes += [order[:half], order[half:]]
+
+    labels = np.empty(len(lab), dtype=np.int64)
+    for n, box in enumerate(boxes):
+        labels[box] = n
+    return summarize(rgb, labels, len(boxes), opaque)
+
+
+def kmeans(pixels: np.ndarray, limit: int, seed: int = SEED, batch_size: int = 512, iterations: int = 30) -> List[Tuple[str, float]]:
+    """K-moyennes par mini-lots dans l'espace Lab, initialisées par k-means++ avec une graine fixe (résultat déterministe)"""
+    rng = np.random.default_rng(seed)
+    rgb, opaque = sample_pixels(pixels, rng)
+    if not len(rgb):
+        return []
+    lab = rgb_to_lab(rgb)
+    k = min(limit, len(np.unique(rgb.astype(np.int64) @ np.array([65536, 256, 1]))))
+
+    centers = [lab[rng.integers(len(lab))]]
+    dist = ((lab - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        probs = dist / dist.sum() if dist.sum() else None
+        centers.append(lab[rng.choice(len(lab), p=probs)])
+        dist = np.minimum(dist, ((lab - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    counts = np.zeros(k)
+    for _ in range(iterations):
+        batch = lab[rng.integers(0, len(lab), min(batch_size, len(lab)))]
+        nearest = ((batch[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        for c in np.unique(nearest):
+            members = batch[nearest == c]
+            counts[c] += len(members)
+            rate = len(members) / counts[c]
+            centers[c] += rate * (members.mean(axis=0) - centers[c])
+
+    labels = ((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    return summarize(rgb, labels, k, opaque)
+
+
+EXTRACTORS = {'mediancut': median_cut, 'kmeans': kmeans}
@@ -1,23 +1,25 @@
 # Merci à Maglatranir#7175 d'avoir donné l'idée originelle du module
 
 import asyncio
-import os
 from copy import copy
+from io import BytesIO
 import logging
 import random
 from typing import List, Optional
-from urllib.parse import urlsplit
 
-import aiohttp
-import webcolors
-import extcolors
 
 import discord
-from PIL import Image, ImageDraw, ImageFont
-from discord.utils import get as discord_get
 from redbot.core import Config, commands, checks
-from redbot.core.data_manager import cog_data_path, bundled_data_path
+from redbot.core.data_manager import bundled_data_path, cog_data_path
+from .cache import PaletteCache, content_hash, make_key
+from .colorspace import KDTree, hex_to_lab, nearest_within
+from .names import get_names
 from .converters import ImageFinder
+from .downloader import Downloader, DownloadError
+from .jobpool import JobPool
+from .reconcile import ReconcileJob
+from .roleindex import RoleIndex
+from . import imaging
 
 
 logger = logging.getLogger("red.RedAppsv2.HexColor")
@@ -41,18 +43,73 @@ class HexColor(commands.Cog):
 
         default_guild = {'roles': {},
                          'delimiter': None,
-                         'whitelist': []}
+                         'whitelist': [],
+                         'reconcile': {},
+                         'snap_delta': 0.0}
         default_global = {'extcolors_limit': 3,
-                          'extcolors_tolerance': 30}
+                          'extcolors_tolerance': 30,
+                          'extractor': 'kmeans',
+                          'image_format': 'png'}
         default_user = {'colors': {}}
         self.config.register_guild(**default_guild)
         self.config.register_global(**default_global)
         self.config.register_user(**default_user)
 
-        self.temp = cog_data_path(self) / "temp"  # Pour stocker l'img de profil temporairement
-        self.temp.mkdir(exist_ok=True, parents=True)
-
         self.FONT = str(bundled_data_path(self) / "Pixellari.ttf")
+        self.NAMES = str(cog_data_path(self) / "colornames.json")  # Liste étendue optionnelle de noms de couleurs {nom: hex}
+
+        self.downloader = Downloader(max_size=self.MAX_DOWNLOAD_SIZE)
+        self.pool = JobPool(2, self.JOB_TIMEOUT)
+        self.cache = PaletteCache(cog_data_path(self) / "cache")
+        self.role_indexes = {}
+        self.reconcile_jobs = {}
+        self.snap_trees = {}
+        self.bot.loop.create_task(self.resume_reconciliations())
+
+    MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+    JOB_TIMEOUT = 30
+
+    async def get_role_index(self, guild: discord.Guild) -> RoleIndex:
+        """Renvoie l'index des rôles colorés du serveur, construit à la première demande"""
+        index = self.role_indexes.get(guild.id)
+        if index is None:
+            names = await self.config.guild(guild).roles()
+            index = self.role_indexes.setdefault(guild.id, RoleIndex(guild, names))
+        return index
+
+    async def get_color_role(self, guild: discord.Guild, color: str) -> Optional[discord.Role]:
+        """Renvoie le rôle coloré correspondant à la couleur s'il existe"""
+        index = await self.get_role_index(guild)
+        role_id = index.role_id(self.format_color(color, "#"))
+        return guild.get_role(role_id) if role_id else None
+
+    async def get_member_colors(self, user: discord.Member) -> List[discord.Role]:
+        """Renvoie les rôles colorés possédés par le membre, du plus haut au plus bas"""
+        index = await self.get_role_index(user.guild)
+        roles = [user.guild.get_role(i) for i in index.roles_of(user.id)]
+        return sorted([r for r in roles if r], key=lambda r: r.position, reverse=True)
+
+    def get_snap_tree(self, index: RoleIndex) -> KDTree:
+        """Renvoie l'arbre k-d (espace Lab) des rôles colorés du serveur, reconstruit seulement si l'index a changé"""
+        cached = self.snap_trees.get(index.guild_id)
+        if cached and cached[0] == index.version:
+            return cached[1]
+        tree = KDTree((hex_to_lab(name), name) for name in index.by_hex)
+        self.snap_trees[index.guild_id] = (index.version, tree)
+        return tree
+
+    async def snap_color(self, guild: discord.Guild, color: str) -> str:
+        """Renvoie la couleur d'un rôle existant perceptuellement proche de celle demandée (si le mode est activé)
+
+        La couleur demandée est renvoyée telle quelle si le mode est désactivé, si elle existe déjà ou si aucun rôle
+        n'est assez proche"""
+        delta = await self.config.guild(guild).snap_delta()
+        name = self.format_color(color, '#')
+        index = await self.get_role_index(guild)
+        if not delta or not name or index.role_id(name):
+            return color
+        found = nearest_within(self.get_snap_tree(index), hex_to_lab(name), delta)
+        return found[1] if found else color
 
     async def create_guild_color(self, guild: discord.Guild, color: str) -> discord.Role:
         """Crée un rôle avec la couleur demandée et le range si le délimiteur est configuré
@@ -60,12 +117,13 @@ class HexColor(commands.Cog):
         Retourne le rôle créé (ou trouvé si déjà présent)"""
         await self.bot.wait_until_ready()
         rolename = self.format_color(color, "#")
-        role = discord_get(guild.roles, name=rolename)
+        role = await self.get_color_role(guild, rolename)
         if not role:
             rolecolor = int(self.format_color(color, '0x'), base=16)
             await self.add_color_to_cache(guild, color)
             role = await guild.create_role(name=rolename, color=discord.Colour(rolecolor),
                                            reason="Création de rôle de couleur", mentionable=False)
+            (await self.get_role_index(guild)).add_role(role)
             await self.sort_role(guild, role)
         return role
 
@@ -76,97 +134,93 @@ class HexColor(commands.Cog):
         await self.remove_color_from_cache(target_role.guild, str(target_role.color))
         rolename = self.format_color(color, "#")
         new_color = int(self.format_color(color, '0x'), base=16)
-        await target_role.edit(name=rolename, color=new_color, reason="Recyclage du rôle coloré")
         await self.add_color_to_cache(target_role.guild, color)
+        (await self.get_role_index(target_role.guild)).rename_role(target_role, rolename)
+        await target_role.edit(name=rolename, color=new_color, reason="Recyclage du rôle coloré")
         return target_role
 
     async def safe_clear_guild_color(self, guild: discord.Guild, color: str) -> bool:
         """Vérifie que des membres ne possèdent plus la couleur et supprime le rôle coloré"""
-        name = self.format_color(color, "#")
-        role = discord_get(guild.roles, name=name)
-        if role:
-            if not self.get_members_with(role):
-                await role.delete(reason="Suppression de rôle de couleur obsolète")
-                await self.remove_color_from_cache(guild, color)
-                return True
-        return False
+        return bool(await self.safe_bulk_clear_guild_colors(guild, [color]))
 
     async def safe_bulk_clear_guild_colors(self, guild: discord.Guild, colors: list) -> list:
-        """Vérifie que des membres ne possèdent pas les couleurs données et supprime les rôles obsolètes
+        """Vérifie que des membres ne possèdent pas les couleurs données et supprime les rôles obsolètes (en parallèle)
 
         Retourne une liste des noms des rôles supprimés"""
         await self.bot.wait_until_ready()
-        names = [self.format_color(c, '#') for c in colors]
-        logs = []
-        for name in names:
-            role = discord_get(guild.roles, name=name)
-            if role:
-                if not self.get_members_with(role):
-                    await role.delete(reason="Suppression de rôle de couleur obsolète")
-                    await self.remove_color_from_cache(guild, name)
-                    logs.append(name)
-        return logs
-
-    async def sort_role(self, guild: discord.Guild, role: discord.Role):
-        """Range le rôle sous le délimiteur"""
-        deid = await self.config.guild(guild).delimiter()
-        if deid and role in guild.roles:
-            delim = guild.get_role(deid)
-            changes = {
-                delim: delim.position,
-                role: delim.position - 1,
-            }
-            return await guild.edit_role_positions(positions=changes)
-        return None
+        index = await self.get_role_index(guild)
+        targets = [index.role_id(self.format_color(c, '#')) for c in colors]
+        job = ReconcileJob(guild, index, self.config.guild(guild), sort=False, targets=[t for t in targets if t])
+        await job.run()
+        return job.deleted
+
+    async def sort_role(self, guild: discord.Guild, role: discord.Role = None):
+        """Range les rôles colorés sous le délimiteur en un seul appel"""
+        job = ReconcileJob(guild, await self.get_role_index(guild), self.config.guild(guild), targets=[],
+                           extra_roles=[role] if role else [])
+        return await job.run()
+
+    async def reconcile(self, guild: discord.Guild, *, delete: bool = True, sort: bool = True) -> ReconcileJob:
+        """Lance (ou renvoie si elle est déjà en cours) la réconciliation complète des rôles colorés du serveur"""
+        job = self.reconcile_jobs.get(guild.id)
+        if job and not job.done:
+            return job
+        job = ReconcileJob(guild, await self.get_role_index(guild), self.config.guild(guild), delete=delete, sort=sort)
+        job.task = self.bot.loop.create_task(job.run())
+        self.reconcile_jobs[guild.id] = job
+        return job
+
+    async def resume_reconciliations(self):
+        """Reprend les réconciliations interrompues par un redémarrage"""
+        await self.bot.wait_until_ready()
+        for guild_id, data in (await self.config.all_guilds()).items():
+            guild = self.bot.get_guild(guild_id)
+            if guild and data.get('reconcile', {}).get('delete'):
+                logger.info(f"Reprise de la réconciliation des rôles colorés de {guild_id}")
+                await self.reconcile(guild, delete=False)
 
     async def is_color_displayed(self, user: discord.Member, role: discord.Role = None):
         """Indique si la couleur du rôle est celle qui s'affiche sur le pseudo du membre"""
-        all_colors = await self.config.guild(user.guild).roles()
         if not role:
-            colors = [r for r in user.roles if r.name in all_colors]
+            colors = await self.get_member_colors(user)
             role = colors[0] if colors else None
         if role:
             return user.color == role.color
         return False
 
-    def get_members_with(self, role: discord.Role) -> List[discord.Member]:
-        """Renvoie les membres possédant le rôle demandé"""
-        guild = role.guild
-        members = []
-        for member in guild.members:
-            if role in member.roles:
-                members.append(member)
-        return members
+    async def get_members_with(self, role: discord.Role) -> List[discord.Member]:
+        """Renvoie les membres possédant le rôle coloré demandé"""
+        index = await self.get_role_index(role.guild)
+        members = [role.guild.get_member(i) for i in index.holders_of(role.id)]
+        return [m for m in members if m]
 
     async def add_color_to_cache(self, guild: discord.Guild, hex_color: str):
         name = self.format_color(hex_color, "#")
         rolecolor = self.format_color(hex_color, "0x")
+        (await self.get_role_index(guild)).register_name(name)
         await self.config.guild(guild).roles.set_raw(name, value=rolecolor)
 
     async def remove_color_from_cache(self, guild: discord.Guild, hex_color: str):
         name = self.format_color(hex_color, "#")
+        (await self.get_role_index(guild)).unregister_name(name)
         try:
             await self.config.guild(guild).roles.clear_raw(name)
         except:
             logger.info(f"Impossible de supprimer {name} du cache de {guild.id}",
                         exc_info=True)
 
-    async def extract_colors(self, image_path: str, tolerance: int = None, limit: int = None) -> list:
-        """Extrait les X couleurs les plus dominantes de l'image
+    async def extract_colors(self, data: bytes, tolerance: int = None, limit: int = None) -> list:
+        """Extrait les X couleurs les plus dominantes de l'image (hors de la boucle d'événements)
 
         Renvoie une liste des couleurs (en hexidécimal) extraites avec le pourcentage arrondi qu'ils représentent sur l'image"""
         tolerance = tolerance if tolerance else await self.config.extcolors_tolerance()
         limit = limit if limit else await self.config.extcolors_limit()
+        method = await self.config.extractor()
 
         try:
-            colors, pixel_count = extcolors.extract_from_path(image_path, tolerance,
-                                                              limit=limit)
-        except:
+            return await self.pool.run(imaging.extract_palette, data, tolerance, limit, method)
+        except Exception:
             raise ColorExtractError("Erreur dans l'extraction des couleurs de l'image")
-        else:
-            colors = [(f"#{''.join(f'{hex(c)[2:].upper():0>2}' for c in clr)}", round(pixnb / pixel_count * 100, 2)) for
-                      clr, pixnb in (k for k in colors)]
-            return colors
 
     async def set_member_color(self, user: discord.Member, color: str) -> discord.Role:
         """Applique la couleur demandée au membre en supprimant les anciens qu'il pourrait posséder
@@ -174,26 +228,32 @@ class HexColor(commands.Cog):
         Renvoie le rôle désormais possédé"""
         await self.bot.wait_until_ready()
         guild = user.guild
-        all_colors = await self.config.guild(guild).roles()
+        index = await self.get_role_index(guild)
+        color = await self.snap_color(guild, color)
         rolename = self.format_color(color, '#')
-        user_colored_roles = [r for r in user.roles if r.name in all_colors]
-        if rolename not in (r.name for r in user.roles):
-            del_roles = user_colored_roles
+        target_id = index.role_id(rolename)
+        if target_id is None or target_id not in index.roles_of(user.id):
+            del_roles = await self.get_member_colors(user)
             role = None
-            for r in user_colored_roles:
-                if self.get_members_with(r) == [user]:
-                    role = await self.replace_guild_color(r, color)
-                    del_roles.remove(r)
-                    break
+            # Le rôle n'est recyclé que si la nouvelle couleur n'existe pas déjà sous forme de rôle
+            if target_id is None:
+                for r in del_roles:
+                    if index.holders_of(r.id) == {user.id}:
+                        role = await self.replace_guild_color(r, color)
+                        del_roles.remove(r)
+                        break
             if del_roles:
                 await user.remove_roles(*del_roles)
+                for r in del_roles:
+                    index.unassign(user.id, r.id)
                 await self.safe_bulk_clear_guild_colors(guild, [r.name for r in del_roles])
 
             if not role:
                 role = await self.create_guild_color(guild, color)
                 await user.add_roles(role, reason="Attribution d'un rôle coloré")
+                index.assign(user.id, role.id)
             return role
-        return discord_get(guild.roles, name=self.format_color(color, "#"))
+        return guild.get_role(target_id)
 
     async def user_in_whitelist(self, user: discord.Member):
         """Vérifie les permissions s'il y a une whitelist active"""
@@ -218,12 +278,13 @@ class HexColor(commands.Cog):
         return False
 
     def css_name_hex(self, name: str):
-        """Retrouve l'hex lié au nom de couleur (CSS3/HTML)"""
-        try:
-            hex = webcolors.name_to_hex(name)
-            return self.format_color(hex, "0x")
-        except:
-            return False
+        """Retrouve l'hex lié au nom de couleur (CSS/X11), en tolérant les saisies partielles et fautes de frappe"""
+        found = get_names(self.NAMES).lookup(name)
+        return self.format_color(found[1], "0x") if found else False
+
+    def color_name(self, color: str) -> str:
+        """Renvoie le nom de couleur (CSS/X11) le plus proche de la couleur donnée"""
+        return get_names(self.NAMES).nearest(self.format_color(color, "#"))[0]
 
     def color_representation(self, color: str, custom_text: str = None):
         color = self.format_color(color)
@@ -239,52 +300,27 @@ class HexColor(commands.Cog):
                 return p
         return "n."
 
-    def show_palette(self, colors, outfile, *, swatchsize=200):
-        num_colors = len(colors)
-        palette = Image.new('RGB', (swatchsize * num_colors, swatchsize))
-        draw = ImageDraw.Draw(palette)
-        myFont = ImageFont.truetype(self.FONT, 36)
-
-        posx = 0
-        for color in colors:
-            draw.rectangle([posx, 0, posx + swatchsize, swatchsize], fill=color)
-            w, h = draw.textsize(str(color), font=myFont)
-            draw.rectangle([posx + (swatchsize / 2) - w / 1.75, (swatchsize / 2) - h / 1.75, posx + (swatchsize / 2) + w / 1.75,
-                            (swatchsize / 2) + h / 1.75], fill="black")
-            draw.text((posx + (swatchsize / 2) - w / 2, (swatchsize / 2) - h / 2), str(color), fill="white", font=myFont)
-            posx = posx + swatchsize
-
-        del draw
-        palette.save(outfile, "PNG")
-
-    def repr_colors_inventory(self, colors_map: dict, outfile: str):
-        swatchsize = 200
+    async def show_palette(self, colors: list, *, swatchsize=200) -> bytes:
+        """Renvoie l'image (en bytes, au format configuré) de la palette de couleurs"""
+        colors = [str(c) for c in colors]
+        fmt = await self.config.image_format()
+        return await self.pool.run(imaging.render_swatches, colors, colors, self.FONT, 36, swatchsize, None, fmt)
+
+    async def repr_colors_inventory(self, colors_map: dict) -> bytes:
+        """Renvoie l'image (en bytes, au format configuré) représentant l'inventaire de couleurs"""
         colors = [c for c in colors_map]
-        num_colors = len(colors)
-        palette = Image.new('RGB', (swatchsize * num_colors, swatchsize))
-        draw = ImageDraw.Draw(palette)
-        myFont = ImageFont.truetype(self.FONT, 32)
-
-        posx = 0
-        for color in colors:
-            draw.rectangle([posx, 0, posx + swatchsize, swatchsize], fill=color)
-            w, h = draw.textsize(colors_map[color], font=myFont)
-            draw.rectangle([posx + (swatchsize / 2) - w / 1.75, (swatchsize / 2) - h / 1.75, posx + (swatchsize / 2) + w / 1.75,
-                            (swatchsize / 2) + h / 1.75], fill="black")
-            draw.text((posx + (swatchsize / 2) - w / 2, (swatchsize / 2) - h / 2), colors_map[color], fill="white", font=myFont)
-            posx = posx + swatchsize
-
-        del draw
-        palette.save(outfile, "PNG")
+        fmt = await self.config.image_format()
+        return await self.pool.run(imaging.render_swatches, colors, [colors_map[c] for c in colors], self.FONT, 32,
+                                   200, None, fmt)
 
     @commands.group(name='colorme', aliases=['color'], invoke_without_command=True)
     @commands.guild_only()
     @commands.cooldown(1, 10, commands.BucketType.member)
     @commands.bot_has_guild_permissions(manage_roles=True, mention_everyone=True)
-    async def set_user_color(self, ctx, couleur: str):
+    async def set_user_color(self, ctx, *, couleur: str):
         """Gestion de votre rôle de couleur
 
-        `colorme custom` : Changer la couleur selon un code hexadécimal (ex. *#fefefe*) ou un nom CSS3/HTML (ex. *lightgray*)
+        `colorme custom` : Changer la couleur selon un code hexadécimal (ex. *#fefefe*) ou un nom de couleur CSS/X11 (ex. *lightgray*)
         `colorme avatar` : Applique la couleur dominante de votre avatar
         `colorme random` : Applique une couleur aléatoire
         `colorme copy` : Copie la couleur d'un autre membre
@@ -301,8 +337,8 @@ class HexColor(commands.Cog):
             return await ctx.invoke(self.custom_color, color=couleur)
 
     @set_user_color.command(name="custom")
-    async def custom_color(self, ctx, color: str):
-        """Changer la couleur selon un code hexadécimal ou un nom CSS3/HTML"""
+    async def custom_color(self, ctx, *, color: str):
+        """Changer la couleur selon un code hexadécimal ou un nom de couleur CSS/X11 (ex. *dark slate blue*)"""
         user = ctx.author
         if not self.user_in_whitelist(user):
             return await ctx.reply(
@@ -315,9 +351,9 @@ class HexColor(commands.Cog):
                 couleur = self.css_name_hex(color)
             else:
                 return await ctx.reply("**Couleur invalide** • La couleur donnée n'est ni une couleur en "
-                                      "hexadécimal (ex. `#fefefe`) ni un nom de couleur CSS3/HTML (ex. *lightgray*)")
+                                      "hexadécimal (ex. `#fefefe`) ni un nom de couleur CSS/X11 (ex. *lightgray*)")
             role = await self.set_member_color(ctx.author, couleur)
-            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}**", color=role.color)
+            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}** (*{self.color_name(role.name)}*)", color=role.color)
             if not await self.is_color_displayed(ctx.author, role):
                 em.set_footer(
                     text="⚠️ Attention, la couleur demandée ne pourra s'afficher qu'après avoir retiré le rôle coloré hiérarchiquement supérieur !")
@@ -331,22 +367,35 @@ class HexColor(commands.Cog):
             return await ctx.reply(
                 "**Interdit** • Vous ne figurez pas sur la whitelist des gens autorisés à utiliser cette commande.")
 
-        notif = await ctx.send("⏳ Veuillez patienter pendant l'extraction de la couleur dominante de votre avatar...")
         async with ctx.channel.typing():
             member = ctx.author
-            path = str(self.temp)
-            filename = path + "/avatar_{}.jpg".format(member.id)
-            await member.avatar_url.save(filename)
-            avatar_color = await self.extract_colors(filename, limit=1)
-            await notif.delete()
+            method = await self.config.extractor()
+            tolerance = await self.config.extcolors_tolerance()
+            key = make_key('avatar', member.avatar or f"default-{member.default_avatar.value}", method, tolerance)
+            cached = await self.cache.get(key)
+            if cached and cached[0]:
+                avatar_color = cached[0]
+            else:
+                notif = await ctx.send("⏳ Veuillez patienter pendant l'extraction de la couleur dominante de votre avatar...")
+                data = await member.avatar_url_as(static_format="png", size=256).read()
+                try:
+                    avatar_color = await self.extract_colors(data, limit=1)
+                except ColorExtractError:
+                    logger.error(msg="avatar : Erreur lors de l'extraction de la couleur", exc_info=True)
+                    avatar_color = []
+                await notif.delete()
+                # Un avatar entièrement transparent ne donne aucune couleur
+                if not avatar_color:
+                    return await ctx.reply("**Impossible** • Je n'ai pas réussi à extraire une couleur de votre avatar.",
+                                           mention_author=False)
+                await self.cache.set(key, avatar_color)
 
             role = await self.set_member_color(user, avatar_color[0][0])
-            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}**", color=role.color)
+            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}** (*{self.color_name(role.name)}*)", color=role.color)
             if not await self.is_color_displayed(ctx.author, role):
                 em.set_footer(
                     text="⚠️ Attention, la couleur demandée ne pourra s'afficher qu'après avoir retiré le rôle coloré hiérarchiquement supérieur !")
             await ctx.reply(embed=em, mention_author=False)
-        os.remove(filename)
 
     @set_user_color.command(name="random")
     async def random_color(self, ctx):
@@ -360,7 +409,7 @@ class HexColor(commands.Cog):
             r = lambda: random.randint(0, 255)
             couleur = '%02X%02X%02X' % (r(), r(), r())
             role = await self.set_member_color(ctx.author, couleur)
-            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}**", color=role.color)
+            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}** (*{self.color_name(role.name)}*)", color=role.color)
             if not await self.is_color_displayed(ctx.author, role):
                 em.set_footer(
                     text="⚠️ Attention, la couleur demandée ne pourra s'afficher qu'après avoir retiré le rôle coloré hiérarchiquement supérieur !")
@@ -377,7 +426,7 @@ class HexColor(commands.Cog):
         async with ctx.channel.typing():
             couleur = self.format_color(str(target.color), '#')
             role = await self.set_member_color(ctx.author, couleur)
-            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}** (copiée sur {target.mention})",
+            em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}** (*{self.color_name(role.name)}*) (copiée sur {target.mention})",
                                color=role.color)
             if not await self.is_color_displayed(ctx.author, role):
                 em.set_footer(
@@ -430,7 +479,7 @@ class HexColor(commands.Cog):
             if name in inv:
                 couleur = inv[name]
                 role = await self.set_member_color(ctx.author, couleur)
-                em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}** (chargée depuis *{name}*)", color=role.color)
+                em = discord.Embed(description=f"Vous avez désormais la couleur **{role.name}** (*{self.color_name(role.name)}*) (chargée depuis *{name}*)", color=role.color)
                 if not await self.is_color_displayed(ctx.author, role):
                     em.set_footer(
                         text="⚠️ Attention, la couleur demandée ne pourra s'afficher qu'après avoir retiré le rôle coloré hiérarchiquement supérieur !")
@@ -464,19 +513,17 @@ class HexColor(commands.Cog):
         async with ctx.channel.typing():
             inv = await self.config.user(user).colors()
             if inv:
-                path = str(self.temp)
-                filename = path + "/colorinventory_{}.png".format(user.id)
-                self.repr_colors_inventory({inv[c]: c for c in inv}, filename)
+                image = await self.repr_colors_inventory({inv[c]: c for c in inv})
 
                 await notif.delete()
-                file = discord.File(filename)
+                ext = await self.config.image_format()
+                file = discord.File(BytesIO(image), filename="colorinventory_{}.{}".format(user.id, ext))
                 try:
                     await ctx.reply("**Voici votre inventaire :**", file=file, mention_author=False)
                 except:
                     await ctx.send("**Impossible** • Je n'ai pas réussi à upload l'image de l'inventaire, désolé.")
                     logger.error(msg="Inventory_custom_color : Impossible d'upload l'image représentative de l'inventaire",
                                  exc_info=True)
-                os.remove(filename)
             else:
                 await ctx.send("**Inventaire vide** • Commencez à mettre des couleurs dans votre inventaire avec `colorme save` !")
 
@@ -485,11 +532,13 @@ class HexColor(commands.Cog):
         """Retire toutes les rôles colorés que vous possédez (attribués par le bot)"""
         user = ctx.author
         async with ctx.channel.typing():
-            all_colors = await self.config.guild(ctx.guild).roles()
-            user_colors = [r for r in user.roles if r.name in all_colors]
+            user_colors = await self.get_member_colors(user)
 
             if user_colors:
                 await user.remove_roles(*user_colors, reason="Retrait du/des rôle(s) sur demande du membre")
+                index = await self.get_role_index(ctx.guild)
+                for r in user_colors:
+                    index.unassign(user.id, r.id)
                 await ctx.send("**Couleur(s) retirée(s)** • Vous n'avez plus aucun rôle coloré provenant du bot")
                 await asyncio.sleep(3)  # Eviter les limitations Discord
                 await self.safe_bulk_clear_guild_colors(ctx.guild, [i.name for i in user_colors])
@@ -497,18 +546,6 @@ class HexColor(commands.Cog):
                 await ctx.send("**Aucun rôle** • Aucun rôle coloré que vous possédez ne provient de ce bot")
 
 
-    async def download(self, url: str, path: str):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        with open(path, "wb") as f:
-                            f.write(data)
-                        return resp.headers.get("Content-type", "").lower()
-        except asyncio.TimeoutError:
-            return False
-
     @commands.command(name="palette")
     async def get_image_palette(self, ctx, nb: Optional[int] = 5, url: ImageFinder = None):
         """Extrait une palette de X couleurs de l'image donnée"""
@@ -519,29 +556,39 @@ class HexColor(commands.Cog):
         msg = await ctx.message.channel.send("⏳ Veuillez patienter durant la génération de votre palette de couleurs (peut être long pour les grosses images)")
         async with ctx.typing():
             url = url[0]
-            filename = urlsplit(url).path.rsplit('/')[-1]
-            filepath = str(self.temp / filename)
-            palette_path = str(self.temp) + "/palette_{}.png".format(filename.split('.')[0])
             try:
-                await self.download(url, filepath)
-            except:
-                await ctx.send("**Téléchargement échoué** • Réessayez d'une autre façon")
-
-            colors = await self.extract_colors(filepath, limit=nb)
-            if colors:
-                self.show_palette([i[0] for i in colors], palette_path)
+                data = (await self.downloader.fetch(url)).data
+            except DownloadError:
                 await msg.delete()
-                file = discord.File(palette_path)
+                return await ctx.send("**Téléchargement échoué** • Réessayez d'une autre façon (20 Mo max.)")
+
+            tolerance = await self.config.extcolors_tolerance()
+            method = await self.config.extractor()
+            fmt = await self.config.image_format()
+            key = make_key('palette', content_hash(data), method, nb, tolerance, fmt, imaging.RENDER_VERSION)
+            cached = await self.cache.get(key, need_image=True)
+            if cached:
+                colors, image = cached
+            else:
+                try:
+                    colors, image = await self.pool.run(imaging.extract_and_render, data, tolerance, nb, self.FONT, method,
+                                                        self.NAMES, fmt)
+                    if colors:
+                        await self.cache.set(key, colors, image, fmt)
+                except Exception:
+                    logger.error(msg="palette : Erreur lors de l'extraction de la palette", exc_info=True)
+                    colors, image = None, None
+            await msg.delete()
+            if colors:
+                file = discord.File(BytesIO(image), filename=f"palette.{fmt}")
                 try:
                     await ctx.reply(file=file, mention_author=False)
                 except:
                     await ctx.send("**Impossible** • Je n'ai pas réussi à upload l'image de la palette.")
                     logger.error(msg="palette : Impossible d'upload l'image palette",
                                  exc_info=True)
-                os.remove(palette_path)
             else:
                 await ctx.reply("**Impossible** • Je n'ai pas réussi à créer une palette depuis cette image.")
-            os.remove(filepath)
 
     @commands.group(name="colorset")
     @commands.guild_only()
@@ -563,15 +610,9 @@ class HexColor(commands.Cog):
                         f"**Rôle délimiteur modifié** • Les rôles colorés se rangeront auto. sous ***{role.name}*** "
                         f"dans la liste de rôles lors de leur création")
 
-            delimpos = role.position
-            all_roles = await self.config.guild(guild).roles()
-            for r in all_roles:
-                check = discord_get(guild.roles, name=r)
-                if check:
-                    setpos = delimpos - 1 if delimpos > 1 else 1
-                    await check.edit(position=setpos)
+            job = await self.sort_role(guild)
             await ctx.send(
-                f"**Rôles rangés** • Les rôles ont été rangés conformément aux paramètres")
+                f"**Rôles rangés** • {job.moved} rôles ont été rangés conformément aux paramètres")
 
         else:
             await self.config.guild(guild).delimiter.set(None)
@@ -582,25 +623,53 @@ class HexColor(commands.Cog):
     async def clear_colors(self, ctx):
         """Lance manuellement une vérification et suppression des rôles de couleurs qui ne sont plus utilisés par personne"""
         guild = ctx.guild
-        all_roles = await self.config.guild(guild).roles()
-        roles = await self.safe_bulk_clear_guild_colors(guild, [r for r in all_roles])
-        await ctx.send(f"**Vérification terminée** • {len(roles)} rôles obsolètes ont été supprimés")
+        job = await self.reconcile(guild)
+        msg = await ctx.send(f"⏳ **Vérification en cours** • {job.progress()}")
+        while not job.task.done():
+            await asyncio.wait({job.task}, timeout=5)
+            if not job.task.done():
+                await msg.edit(content=f"⏳ **Vérification en cours** • {job.progress()}")
+        if job.state == 'done':
+            await msg.edit(content=f"**Vérification terminée** • {len(job.deleted)} rôles obsolètes ont été supprimés "
+                                   f"et {job.moved} rôles rangés")
+        elif job.state == 'interrupted':
+            await msg.edit(content=f"**Vérification interrompue** • Discord limite les requêtes ({job.progress()}), "
+                                   f"relancez la commande plus tard pour reprendre là où elle s'est arrêtée")
+        else:
+            await msg.edit(content=f"**Erreur** • La vérification a échoué ({job.progress()}), vérifiez mes permissions")
 
     @_color_settings.command(name="deleteall")
     async def deleteall_colors(self, ctx):
         """Supprime tous les rôles colorés créés par le bot"""
         guild = ctx.guild
         aut = str(ctx.author)
-        all_roles = await self.config.guild(guild).roles()
+        index = await self.get_role_index(guild)
         count = 0
-        for r in all_roles:
-            role = discord_get(guild.roles, name=r)
+        for role_id in list(index.by_role):
+            role = guild.get_role(role_id)
             if role:
                 await role.delete(reason=f"Suppression du rôle sur demande de {aut}")
                 count += 1
         await self.config.guild(guild).clear_raw("roles")
+        self.role_indexes.pop(guild.id, None)
         await ctx.send(f"**Suppression réalisée** • {count} rôles ont été supprimés")
 
+    @_color_settings.command(name="snap")
+    async def set_snap_delta(self, ctx, delta: float = 0.0):
+        """Regroupe les couleurs demandées sur les rôles existants perceptuellement proches
+
+        `delta` : écart maximal (ΔE CIEDE2000) entre la couleur demandée et celle d'un rôle existant pour réutiliser ce dernier
+        Repères : ~1 = différence imperceptible, ~2-3 = à peine visible, ~5 = nette mais proche, 0 = désactivé
+        Permet de limiter le nombre de rôles créés (Discord en autorise 250 au maximum par serveur)"""
+        guild = ctx.guild
+        if delta < 0 or delta > 50:
+            return await ctx.send("**Valeur invalide** • L'écart doit être compris entre 0 et 50 (0 pour désactiver)")
+        await self.config.guild(guild).snap_delta.set(delta)
+        if delta:
+            await ctx.send(f"**Regroupement activé** • Les couleurs à moins de ΔE {delta:g} d'un rôle existant réutiliseront ce rôle")
+        else:
+            await ctx.send("**Regroupement désactivé** • Chaque couleur demandée aura son propre rôle")
+
     @_color_settings.command(name="give")
     async def give_color(self, ctx, user: discord.Member, couleur: str):
         """Donne la couleur voulue au membre, même si celui-ci n'est pas autorisé à le faire lui-même"""
@@ -619,12 +688,12 @@ class HexColor(commands.Cog):
     async def refresh_colors(self, ctx):
         """Rafraichit le cache des rôles manuellement si celui-ci est corrompu ou incomplet"""
         guild = ctx.guild
-        count = 0
-        await self.config.guild(guild).clear_raw("roles")
-        for role in guild.roles:
-            if role.name.startswith("#") and self.format_color(role.name):
-                await self.add_color_to_cache(guild, role.name)
-                count += 1
+        roles = {self.format_color(r.name, '#'): self.format_color(r.name, '0x') for r in guild.roles
+                 if r.name.startswith("#") and len(r.name) == 7 and self.format_color(r.name)}
+        await self.config.guild(guild).roles.set(roles)
+        self.role_indexes.pop(guild.id, None)
+        count = len(roles)
+        await self.reconcile(guild, delete=False)
         await ctx.send(f"**Rafrachissement terminé** • {count} rôles ont été rajoutés au cache et sont maintenant considérés par le bot")
 
 
@@ -702,8 +771,8 @@ class HexColor(commands.Cog):
     @checks.is_owner()
     async def get_colors_cache(self, ctx):
         """Affiche ce que contient le cache des rôles de couleur"""
-        roles = await self.config.guild(ctx.guild).roles()
-        txt = "\n".join([discord_get(ctx.guild.roles, name=r) for r in roles])
+        index = await self.get_role_index(ctx.guild)
+        txt = "\n".join([f"{name} : {index.count(role_id)} membre(s)" for name, role_id in index.by_hex.items()])
         if txt:
             await ctx.send(txt)
         else:
@@ -729,6 +798,90 @@ class HexColor(commands.Cog):
         else:
             await ctx.send(f"Valeur invalide, elle doit être comprise entre 0 et 100 (%).")
 
+    @_color_settings.command(name="extractor")
+    @checks.is_owner()
+    async def set_extractor(self, ctx, method: str):
+        """Modifie la méthode d'extraction des couleurs dominantes
+
+        `kmeans` : K-moyennes dans l'espace Lab (par défaut, rapide et précis sur les dégradés)
+        `mediancut` : Découpage médian dans l'espace Lab (le plus rapide)
+        `extcolors` : Ancienne méthode, utilise la tolérance réglée avec `exttolerance`"""
+        method = method.lower()
+        if method not in ('kmeans', 'mediancut', 'extcolors'):
+            return await ctx.send("Méthode invalide, choisissez entre `kmeans`, `mediancut` et `extcolors`.")
+        await self.config.extractor.set(method)
+        await ctx.send(f"L'extracteur de couleurs utilisera désormais la méthode `{method}`.")
+
+    @_color_settings.command(name="format")
+    @checks.is_owner()
+    async def set_image_format(self, ctx, fmt: str):
+        """Modifie le format des images générées (palettes, inventaires)
+
+        `png` : PNG en mode palette (par défaut, compatible partout)
+        `webp` : WebP sans perte (plus léger)"""
+        fmt = fmt.lower()
+        if fmt not in ('png', 'webp'):
+            return await ctx.send("Format invalide, choisissez entre `png` et `webp`.")
+        await self.config.image_format.set(fmt)
+        await ctx.send(f"Les images générées seront désormais au format `{fmt}`.")
+
+    @_color_settings.command(name="cache")
+    @checks.is_owner()
+    async def palette_cache_info(self, ctx, clear: bool = False):
+        """Affiche l'état du cache des palettes extraites, ou le vide si `clear` vaut `true`"""
+        if clear:
+            await self.cache.clear()
+            return await ctx.send("**Cache vidé** • Les palettes et couleurs d'avatars seront recalculées à la prochaine demande.")
+        stats = self.cache.stats()
+        await ctx.send(f"**Cache des palettes** • {stats['memory_entries']} entrées en mémoire "
+                       f"({stats['memory_size'] / 1024:.0f} Ko), {stats['disk_entries']} sur disque "
+                       f"({stats['disk_size'] / 1024:.0f} Ko)\n"
+                       f"Succès : {stats['hits']} / Échecs : {stats['misses']} ({stats['hit_rate']:.0%})")
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        index = self.role_indexes.get(role.guild.id)
+        if index:
+            index.add_role(role)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        index = self.role_indexes.get(role.guild.id)
+        if index:
+            index.remove_role(role.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        index = self.role_indexes.get(after.guild.id)
+        if index and before.name != after.name and index.by_role.get(after.id) != after.name:
+            index.remove_role(after.id)
+            if index.add_role(after):
+                for member in after.members:
+                    index.assign(member.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        index = self.role_indexes.get(after.guild.id)
+        if index and before.roles != after.roles:
+            index.update_member(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        index = self.role_indexes.get(member.guild.id)
+        if index:
+            index.remove_member(member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.role_indexes.pop(guild.id, None)
+
     async def red_delete_data_for_user(self, **kwargs):
         """Nothing to delete."""
-        return
\ No newline at end of file
+        return
+
+    def cog_unload(self):
+        for job in self.reconcile_jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+        self.bot.loop.create_task(self.downloader.close())
+        self.pool.shutdown()
\ No newline at end of file
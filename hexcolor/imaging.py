@@ -0,0 +1,123 @@
+# Traitements d'images de HexColor : ces fonctions ne prennent et ne renvoient que des données sérialisables
+# (bytes, listes) afin d'être exécutées dans un pool de processus, hors de la boucle d'événements du bot
+
+from functools import lru_cache
+from io import BytesIO
+from typing import List, Tuple
+
+import extcolors
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .colorspace import hex_to_rgb
+from .extract import EXTRACTORS
+from .names import nearest_names
+
+MAX_SIDE = 256  # Taille max. de l'image analysée, largement suffisante pour des couleurs dominantes
+RENDER_VERSION = 3  # À incrémenter lorsque le rendu change, pour invalider les images en cache
+
+
+def open_image(data: bytes, max_side: int = MAX_SIDE) -> Image.Image:
+    """Ouvre une image depuis des bytes et la réduit avant tout traitement"""
+    img = Image.open(BytesIO(data))
+    img.draft('RGB', (max_side, max_side))  # Décodage JPEG directement à taille réduite
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    img.thumbnail((max_side, max_side))
+    return img
+
+
+def extract_palette(data: bytes, tolerance: int, limit: int, method: str = 'kmeans') -> List[Tuple[str, float]]:
+    """Extrait les couleurs dominantes d'une image sous la forme (hex, pourcentage)
+
+    `method` : 'kmeans' ou 'mediancut' (NumPy, espace Lab) ou 'extcolors' (seul à utiliser `tolerance`)"""
+    img = open_image(data)
+    if method in EXTRACTORS:
+        pixels = np.asarray(img.convert('RGBA')).reshape(-1, 4)
+        return EXTRACTORS[method](pixels, limit)
+    colors, pixel_count = extcolors.extract_from_image(img, tolerance, limit=limit)
+    return [(f"#{''.join(f'{hex(c)[2:].upper():0>2}' for c in clr)}", round(pixnb / pixel_count * 100, 2))
+            for clr, pixnb in colors]
+
+
+@lru_cache(maxsize=16)
+def get_font(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    """Police chargée une seule fois par processus et par taille"""
+    return ImageFont.truetype(font_path, size)
+
+
+@lru_cache(maxsize=1024)
+def glyph(font_path: str, size: int, char: str) -> Tuple[Image.Image, int, int, int]:
+    """Rendu et métriques d'un caractère (masque, décalage x, décalage y, avance), calculés une fois par processus"""
+    font = get_font(font_path, size)
+    left, top, right, bottom = font.getbbox(char)
+    mask = Image.new('L', (max(right - left, 1), max(bottom - top, 1)))
+    ImageDraw.Draw(mask).text((-left, -top), char, fill=255, font=font)
+    return mask, left, top, int(round(font.getlength(char)))
+
+
+@lru_cache(maxsize=2048)
+def text_mask(font_path: str, size: int, text: str) -> Image.Image:
+    """Masque d'un texte assemblé à partir des glyphes en cache, recadré sur les pixels dessinés"""
+    ascent, descent = get_font(font_path, size).getmetrics()
+    glyphs = [glyph(font_path, size, c) for c in text]
+    mask = Image.new('L', (max(sum(g[3] for g in glyphs), 1), ascent + descent))
+    x = 0
+    for gmask, left, top, advance in glyphs:
+        mask.paste(gmask, (x + left, top), gmask)
+        x += advance
+    bbox = mask.getbbox()
+    return mask.crop(bbox) if bbox else mask
+
+
+def encode(img: Image.Image, fmt: str = 'PNG') -> bytes:
+    """Encode l'image en mémoire : PNG en mode palette (compact et rapide) ou WebP sans perte"""
+    buffer = BytesIO()
+    if fmt.upper() == 'WEBP':
+        img.convert('RGB').save(buffer, 'WEBP', lossless=True, method=2)
+    else:
+        img.save(buffer, 'PNG', optimize=False, compress_level=6)
+    return buffer.getvalue()
+
+
+def render_swatches(colors: List[str], labels: List[str], font_path: str, font_size: int, swatchsize: int = 200,
+                    sublabels: List[str] = None, fmt: str = 'PNG') -> bytes:
+    """Dessine une bande de carrés de couleur légendés et renvoie l'image encodée (PNG ou WebP) en bytes
+
+    La bande est construite directement comme un tableau d'indices de palette (une entrée par couleur, plus le noir
+    et le blanc des légendes) et les légendes sont assemblées à partir de glyphes déjà rendus.
+    `sublabels` : légendes secondaires optionnelles (ex. nom de la couleur), écrites plus petit sous la légende principale"""
+    count = len(colors)
+    black, white = count, count + 1
+    strip = np.repeat(np.arange(count, dtype=np.uint8), swatchsize)
+    palette = Image.fromarray(np.ascontiguousarray(np.broadcast_to(strip, (swatchsize, count * swatchsize))), 'P')
+    rgb = [c for color in colors for c in hex_to_rgb(color)]
+    palette.putpalette(rgb + [0, 0, 0, 255, 255, 255])
+
+    draw = ImageDraw.Draw(palette)
+    small_size = max(font_size // 2, 12)
+
+    def write(text: str, size: int, center: float, posy: float):
+        mask = text_mask(font_path, size, text)
+        w, h = mask.size
+        draw.rectangle([center - w / 1.75, posy - h / 1.75, center + w / 1.75, posy + h / 1.75], fill=black)
+        palette.paste(white, (int(center - w / 2), int(posy - h / 2)), mask)
+
+    half = swatchsize / 2
+    for n, label in enumerate(labels):
+        write(label, font_size, n * swatchsize + half, half)
+        if sublabels:
+            write(sublabels[n], small_size, n * swatchsize + half, swatchsize * 0.78)
+
+    del draw
+    return encode(palette, fmt)
+
+
+def extract_and_render(data: bytes, tolerance: int, limit: int, font_path: str, method: str = 'kmeans',
+                       names_path: str = None, fmt: str = 'PNG') -> Tuple[List[Tuple[str, float]], bytes]:
+    """Extraction et rendu de la palette (légendée avec le nom de couleur le plus proche) en un seul aller-retour avec le pool"""
+    colors = extract_palette(data, tolerance, limit, method)
+    if not colors:
+        return colors, b''
+    hexes = [c[0] for c in colors]
+    return colors, render_swatches(hexes, hexes, font_path, 36, sublabels=nearest_names(hexes, names_path), fmt=fmt)
@@ -0,0 +1,61 @@
+# Pool de processus des cogs d'images : nombre de travaux en attente borné et traitements trop longs réellement arrêtés
+#
+# Module partagé : chaque cog s'installant séparément, ce fichier est copié à l'identique dans hexcolor et imgedit
+# (comme downloader.py). Toute modification doit être reportée dans les deux copies, ce que vérifie
+# tests/test_shared_modules.py
+
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+logger = logging.getLogger("red.RedAppsv2.jobpool")
+
+
+class JobPool:
+    """Pool de processus exécutant les traitements d'images hors de la boucle d'événements
+
+    `asyncio.wait_for` n'interrompt que l'attente : le processus continuerait le traitement bloqué et les travaux
+    suivants s'accumuleraient derrière lui. Le nombre de travaux soumis est donc limité à deux par processus, et un
+    traitement qui dépasse sa limite de temps entraîne le remplacement du pool et l'arrêt de ses processus."""
+
+    def __init__(self, workers: int = 2, timeout: float = 60, initializer: Optional[Callable] = None,
+                 initargs: tuple = ()):
+        self.workers = workers
+        self.timeout = timeout
+        self.initializer = initializer
+        self.initargs = initargs
+        self.executor = self._new_executor()
+        self.jobs = asyncio.Semaphore(workers * 2)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer, initargs=self.initargs)
+
+    def recycle(self):
+        """Remplace le pool et arrête ses processus, seul moyen d'interrompre un traitement qui ne se termine pas
+
+        Les autres traitements en cours dans l'ancien pool échouent"""
+        executor, self.executor = self.executor, self._new_executor()
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False)
+        for process in processes:
+            process.terminate()
+
+    async def run(self, func, *args, timeout: float = None, **kwargs):
+        """Exécute le traitement dans un processus du pool
+
+        Si le traitement dépasse `timeout` secondes (par défaut celle du pool), asyncio.TimeoutError est soulevée et le
+        pool est remplacé afin que le processus bloqué ne continue pas d'occuper une place"""
+        timeout = timeout or self.timeout
+        async with self.jobs:
+            future = asyncio.get_event_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+            try:
+                return await asyncio.wait_for(future, timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Traitement {func.__name__} interrompu après {timeout}s, remplacement du pool")
+                self.recycle()
+                raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
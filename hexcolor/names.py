@@ -0,0 +1,145 @@
+# Table précalculée des noms de couleurs (CSS/X11) avec recherche du nom le plus proche dans l'espace Lab
+# et résolution tolérante des noms saisis (préfixes, fautes de frappe)
+
+import json
+import logging
+import os
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from .colorspace import EUCLIDEAN_BOUND, KDTree, ciede2000, hex_to_lab
+
+logger = logging.getLogger("red.RedAppsv2.HexColor.names")
+
+CSS_COLORS = {
+    'rebeccapurple': '663399',
+    'aliceblue': 'F0F8FF', 'antiquewhite': 'FAEBD7', 'aqua': '00FFFF', 'aquamarine': '7FFFD4', 'azure': 'F0FFFF',
+    'beige': 'F5F5DC', 'bisque': 'FFE4C4', 'black': '000000', 'blanchedalmond': 'FFEBCD', 'blue': '0000FF',
+    'blueviolet': '8A2BE2', 'brown': 'A52A2A', 'burlywood': 'DEB887', 'cadetblue': '5F9EA0', 'chartreuse': '7FFF00',
+    'chocolate': 'D2691E', 'coral': 'FF7F50', 'cornflowerblue': '6495ED', 'cornsilk': 'FFF8DC', 'crimson': 'DC143C',
+    'cyan': '00FFFF', 'darkblue': '00008B', 'darkcyan': '008B8B', 'darkgoldenrod': 'B8860B', 'darkgray': 'A9A9A9',
+    'darkgreen': '006400', 'darkgrey': 'A9A9A9', 'darkkhaki': 'BDB76B', 'darkmagenta': '8B008B',
+    'darkolivegreen': '556B2F', 'darkorange': 'FF8C00', 'darkorchid': '9932CC', 'darkred': '8B0000',
+    'darksalmon': 'E9967A', 'darkseagreen': '8FBC8F', 'darkslateblue': '483D8B', 'darkslategray': '2F4F4F',
+    'darkslategrey': '2F4F4F', 'darkturquoise': '00CED1', 'darkviolet': '9400D3', 'deeppink': 'FF1493',
+    'deepskyblue': '00BFFF', 'dimgray': '696969', 'dimgrey': '696969', 'dodgerblue': '1E90FF', 'firebrick': 'B22222',
+    'floralwhite': 'FFFAF0', 'forestgreen': '228B22', 'fuchsia': 'FF00FF', 'gainsboro': 'DCDCDC',
+    'ghostwhite': 'F8F8FF', 'gold': 'FFD700', 'goldenrod': 'DAA520', 'gray': '808080', 'green': '008000',
+    'greenyellow': 'ADFF2F', 'grey': '808080', 'honeydew': 'F0FFF0', 'hotpink': 'FF69B4', 'indianred': 'CD5C5C',
+    'indigo': '4B0082', 'ivory': 'FFFFF0', 'khaki': 'F0E68C', 'lavender': 'E6E6FA', 'lavenderblush': 'FFF0F5',
+    'lawngreen': '7CFC00', 'lemonchiffon': 'FFFACD', 'lightblue': 'ADD8E6', 'lightcoral': 'F08080',
+    'lightcyan': 'E0FFFF', 'lightgoldenrodyellow': 'FAFAD2', 'lightgray': 'D3D3D3', 'lightgreen': '90EE90',
+    'lightgrey': 'D3D3D3', 'lightpink': 'FFB6C1', 'lightsalmon': 'FFA07A', 'lightseagreen': '20B2AA',
+    'lightskyblue': '87CEFA', 'lightslategray': '778899', 'lightslategrey': '778899', 'lightsteelblue': 'B0C4DE',
+    'lightyellow': 'FFFFE0', 'lime': '00FF00', 'limegreen': '32CD32', 'linen': 'FAF0E6', 'magenta': 'FF00FF',
+    'maroon': '800000', 'mediumaquamarine': '66CDAA', 'mediumblue': '0000CD', 'mediumorchid': 'BA55D3',
+    'mediumpurple': '9370DB', 'mediumseagreen': '3CB371', 'mediumslateblue': '7B68EE', 'mediumspringgreen': '00FA9A',
+    'mediumturquoise': '48D1CC', 'mediumvioletred': 'C71585', 'midnightblue': '191970', 'mintcream': 'F5FFFA',
+    'mistyrose': 'FFE4E1', 'moccasin': 'FFE4B5', 'navajowhite': 'FFDEAD', 'navy': '000080', 'oldlace': 'FDF5E6',
+    'olive': '808000', 'olivedrab': '6B8E23', 'orange': 'FFA500', 'orangered': 'FF4500', 'orchid': 'DA70D6',
+    'palegoldenrod': 'EEE8AA', 'palegreen': '98FB98', 'paleturquoise': 'AFEEEE', 'palevioletred': 'DB7093',
+    'papayawhip': 'FFEFD5', 'peachpuff': 'FFDAB9', 'peru': 'CD853F', 'pink': 'FFC0CB', 'plum': 'DDA0DD',
+    'powderblue': 'B0E0E6', 'purple': '800080', 'red': 'FF0000', 'rosybrown': 'BC8F8F', 'royalblue': '4169E1',
+    'saddlebrown': '8B4513', 'salmon': 'FA8072', 'sandybrown': 'F4A460', 'seagreen': '2E8B57', 'seashell': 'FFF5EE',
+    'sienna': 'A0522D', 'silver': 'C0C0C0', 'skyblue': '87CEEB', 'slateblue': '6A5ACD', 'slategray': '708090',
+    'slategrey': '708090', 'snow': 'FFFAFA', 'springgreen': '00FF7F', 'steelblue': '4682B4', 'tan': 'D2B48C',
+    'teal': '008080', 'thistle': 'D8BFD8', 'tomato': 'FF6347', 'turquoise': '40E0D0', 'violet': 'EE82EE',
+    'wheat': 'F5DEB3', 'white': 'FFFFFF', 'whitesmoke': 'F5F5F5', 'yellow': 'FFFF00', 'yellowgreen': '9ACD32',
+}
+
+# Couleurs X11 absentes de CSS ou dont la valeur diffère de leur homonyme CSS
+X11_COLORS = {
+    'lightgoldenrod': 'EEDD82', 'lightslateblue': '8470FF', 'navyblue': '000080', 'violetred': 'D02090',
+    'x11gray': 'BEBEBE', 'x11green': '00FF00', 'x11maroon': 'B03060', 'x11purple': 'A020F0',
+}
+
+
+def normalize(name: str) -> str:
+    return ''.join(c for c in name.lower() if c.isalnum())
+
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """Distance d'édition entre deux chaînes, abandonnée (renvoie limit + 1) dès qu'elle dépasse `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class ColorNames:
+    """Table de noms de couleurs indexée par nom normalisé (recherche tolérante) et par coordonnées Lab (nom le plus proche)"""
+
+    def __init__(self, table: Dict[str, str]):
+        self.by_key = {}  # Nom normalisé -> (Nom, Hex)
+        for name, color in table.items():
+            self.by_key.setdefault(normalize(name), (name, color.lstrip('#').upper()))
+        self.keys = sorted(self.by_key)
+
+        # Un seul nom par couleur pour la recherche inverse, en préférant l'orthographe « gray »
+        unique = {}
+        for name, color in sorted(self.by_key.values(), key=lambda i: ('grey' in i[0], len(i[0]), i[0])):
+            unique.setdefault(color, name)
+        self.tree = KDTree((hex_to_lab(color), (name, color)) for color, name in unique.items())
+
+    def lookup(self, query: str) -> Optional[Tuple[str, str]]:
+        """Résout un nom saisi : nom exact, puis plus court nom commençant par la saisie, puis plus proche en distance d'édition"""
+        key = normalize(query)
+        if not key:
+            return None
+        if key in self.by_key:
+            return self.by_key[key]
+
+        start = bisect_left(self.keys, key)
+        prefixed = []
+        for k in self.keys[start:]:
+            if not k.startswith(key):
+                break
+            prefixed.append(k)
+        if prefixed:
+            return self.by_key[min(prefixed, key=len)]
+
+        # À distance égale, on préfère les noms plus longs que la saisie (lettre oubliée), puis les plus courts
+        limit = max(1, len(key) // 4)
+        best, best_rank = None, (limit + 1,)
+        for k in self.keys:
+            dist = levenshtein(key, k, min(limit, best_rank[0]))
+            rank = (dist, len(k) <= len(key), len(k))
+            if dist <= limit and rank < best_rank:
+                best, best_rank = k, rank
+        return self.by_key[best] if best else None
+
+    def nearest(self, color: str) -> Tuple[str, float]:
+        """Renvoie le nom de couleur perceptuellement le plus proche (ΔE CIEDE2000) et l'écart correspondant"""
+        lab = hex_to_lab(color)
+        _, other, value = self.tree.nearest(lab)
+        radius = ciede2000(lab, other) * EUCLIDEAN_BOUND
+        best = min(((ciede2000(lab, other), value) for _, other, value in self.tree.within(lab, radius)),
+                   default=(0.0, value))
+        return best[1][0], best[0]
+
+
+@lru_cache(maxsize=4)
+def get_names(extended: str = None) -> ColorNames:
+    """Table des noms CSS et X11, complétée si fourni par un fichier JSON {nom: hex} (mise en cache par processus)"""
+    table = dict(CSS_COLORS)
+    table.update(X11_COLORS)
+    if extended and os.path.exists(extended):
+        try:
+            with open(extended, 'r') as f:
+                table.update(json.load(f))
+        except (OSError, ValueError):
+            logger.warning(f"Liste de couleurs étendue illisible : {extended}", exc_info=True)
+    return ColorNames(table)
+
+
+def nearest_names(colors: List[str], extended: str = None) -> List[str]:
+    names = get_names(extended)
+    return [names.nearest(c)[0] for c in colors]
@@ -0,0 +1,179 @@
+# Réconciliation des rôles colorés d'un serveur : suppression des rôles inutilisés et rangement sous le délimiteur
+# en un minimum d'appels à l'API, avec reprise possible après une interruption
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import discord
+
+from .roleindex import RoleIndex
+
+logger = logging.getLogger("red.RedAppsv2.HexColor.reconcile")
+
+
+def plan_positions(roles: List[discord.Role], color_ids: Iterable[int], delimiter: discord.Role,
+                   ceiling: int) -> Dict[discord.Role, int]:
+    """Calcule en un seul passage les positions à appliquer pour que les rôles colorés se trouvent juste sous le délimiteur
+
+    `roles` doit être trié du plus bas au plus haut (ordre de `guild.roles`). L'ordre relatif des rôles colorés est conservé.
+    Seuls les rôles dont la position change et qui sont sous `ceiling` (position du plus haut rôle du bot) sont renvoyés."""
+    color_ids = set(color_ids)
+    others = [r for r in roles if r.id not in color_ids]
+    colors = [r for r in roles if r.id in color_ids and r.position < ceiling]
+    others += [r for r in roles if r.id in color_ids and r.position >= ceiling]
+    others.sort(key=lambda r: (r.position, r.id))
+    if delimiter not in others:
+        return {}
+    cut = others.index(delimiter)
+    order = others[:cut] + colors + others[cut:]
+    return {r: pos for pos, r in enumerate(order)
+            if pos and r.position != pos and r.position < ceiling and pos < ceiling}
+
+
+class ReconcileJob:
+    """Tâche de réconciliation d'un serveur
+
+    Les rôles à supprimer sont enregistrés dans la config avant d'être traités et retirés au fur et à mesure : une tâche
+    interrompue (redémarrage, limitation de l'API) reprend là où elle s'était arrêtée. Les positions sont recalculées
+    à chaque exécution puisque leur application est idempotente."""
+
+    CONCURRENCY = 4
+    BATCH_SIZE = 10
+    MAX_RETRIES = 3
+
+    def __init__(self, guild: discord.Guild, index: RoleIndex, config, *, delete: bool = True, sort: bool = True,
+                 targets: Iterable[int] = None, extra_roles: Iterable[discord.Role] = ()):
+        self.guild = guild
+        self.index = index
+        self.config = config  # Groupe de config du serveur
+        self.delete = delete
+        self.sort = sort
+        self.targets = set(targets) if targets is not None else None  # Limite les suppressions à ces rôles (non persisté)
+        self.extra_roles = list(extra_roles)  # Rôles tout juste créés, pas encore présents dans le cache du serveur
+        self.pending = []
+        self.deleted = []
+        self.failed = 0
+        self.moved = 0
+        self.total = 0
+        self.state = 'pending'
+        self.task = None  # type: Optional[asyncio.Task]
+
+    @property
+    def done(self) -> bool:
+        return self.state in ('done', 'interrupted', 'error')
+
+    def progress(self) -> str:
+        return f"{len(self.deleted)}/{self.total} rôles supprimés, {self.moved} déplacés"
+
+    async def _save(self):
+        if self.targets is not None:
+            return
+        if self.pending:
+            await self.config.reconcile.set({'delete': list(self.pending), 'sort': self.sort})
+        else:
+            await self.config.reconcile.clear()
+
+    async def prepare(self):
+        """Reprend les suppressions restantes d'une exécution précédente et y ajoute les rôles actuellement inutilisés"""
+        if self.targets is not None:
+            pending = self.targets
+        else:
+            saved = await self.config.reconcile()
+            pending = set(saved.get('delete', []))
+            if saved.get('sort'):
+                self.sort = True
+            if self.delete:
+                pending |= self.index.unused()
+        # Un rôle réattribué entre-temps n'est plus à supprimer
+        self.pending = [i for i in pending if i in self.index.by_role and not self.index.count(i)]
+        self.total = len(self.pending)
+        await self._save()
+
+    async def _delete_one(self, role_id: int, semaphore: asyncio.Semaphore):
+        """Supprime le rôle et renvoie son nom, None s'il n'existait déjà plus ou False s'il a été réattribué entre-temps"""
+        async with semaphore:
+            if self.index.count(role_id):
+                return role_id, False
+            role = self.guild.get_role(role_id)
+            if role is None:
+                return role_id, None
+            for attempt in range(self.MAX_RETRIES):
+                try:
+                    await role.delete(reason="Suppression de rôle de couleur obsolète")
+                    return role_id, role.name
+                except discord.NotFound:
+                    return role_id, role.name
+                except discord.HTTPException as e:
+                    if e.status != 429 or attempt == self.MAX_RETRIES - 1:
+                        raise
+                    await asyncio.sleep(2 ** attempt * 5)
+
+    async def _apply_deletions(self):
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+        while self.pending:
+            batch = self.pending[:self.BATCH_SIZE]
+            results = await asyncio.gather(*[self._delete_one(i, semaphore) for i in batch], return_exceptions=True)
+            names = []
+            for role_id, result in zip(batch, results):
+                if isinstance(result, discord.Forbidden):
+                    raise result
+                if isinstance(result, BaseException):
+                    if isinstance(result, discord.HTTPException) and result.status == 429:
+                        raise result
+                    logger.warning(f"Impossible de supprimer le rôle {role_id} de {self.guild.id}", exc_info=result)
+                    self.failed += 1
+                    self.pending.remove(role_id)
+                    continue
+                _, name = result
+                self.pending.remove(role_id)
+                if name is False:
+                    continue
+                name = name or self.index.by_role.get(role_id)
+                self.index.remove_role(role_id)
+                if name:
+                    self.index.unregister_name(name)
+                    names.append(name)
+                    self.deleted.append(name)
+            if names:
+                async with self.config.roles() as roles:
+                    for name in names:
+                        roles.pop(name, None)
+            await self._save()
+
+    async def _apply_positions(self):
+        delimiter_id = await self.config.delimiter()
+        delimiter = self.guild.get_role(delimiter_id) if delimiter_id else None
+        if not delimiter:
+            return
+        roles = self.guild.roles + [r for r in self.extra_roles if r not in self.guild.roles]
+        roles.sort(key=lambda r: (r.position, r.id))
+        positions = plan_positions(roles, self.index.by_role, delimiter, self.guild.me.top_role.position)
+        if positions:
+            await self.guild.edit_role_positions(positions=positions, reason="Rangement des rôles colorés")
+            self.moved = len(positions)
+
+    async def run(self) -> 'ReconcileJob':
+        self.state = 'running'
+        try:
+            await self.prepare()
+            await self._apply_deletions()
+            if self.sort:
+                await self._apply_positions()
+        except discord.HTTPException as e:
+            self.state = 'interrupted' if e.status == 429 else 'error'
+            logger.warning(f"Réconciliation de {self.guild.id} interrompue ({self.progress()})", exc_info=True)
+        except asyncio.CancelledError:
+            self.state = 'interrupted'
+            raise
+        except Exception:
+            self.state = 'error'
+            logger.exception(f"Erreur lors de la réconciliation de {self.guild.id} ({self.progress()})")
+            # Les suppressions restantes sont conservées pour être reprises au prochain démarrage
+            try:
+                await self._save()
+            except Exception:
+                logger.exception(f"Impossible d'enregistrer les suppressions restantes de {self.guild.id}")
+        else:
+            self.state = 'done'
+        return self
@@ -0,0 +1,130 @@
+# Index en mémoire des rôles colorés d'un serveur, maintenu à jour par les événements de rôles et de membres
+
+from typing import Iterable, Optional, Set
+
+import discord
+
+
+class RoleIndex:
+    """Index bidirectionnel des rôles colorés d'un serveur
+
+    `by_hex` : couleur (#RRGGBB) -> ID du rôle
+    `by_role` : ID du rôle -> couleur
+    `holders` : ID du rôle -> IDs des membres qui le possèdent
+    `member_roles` : ID du membre -> IDs des rôles colorés qu'il possède
+
+    Les noms reconnus comme rôles colorés (`names`) sont ceux enregistrés dans la config du serveur.
+    `version` est incrémentée à chaque modification de l'ensemble des rôles, pour invalider les structures qui en dérivent."""
+
+    def __init__(self, guild: discord.Guild, names: Iterable[str]):
+        self.guild_id = guild.id
+        self.names = set(names)
+        self.by_hex = {}
+        self.by_role = {}
+        self.holders = {}
+        self.member_roles = {}
+        self.version = 0
+        self.build(guild)
+
+    def build(self, guild: discord.Guild):
+        """Reconstruit l'index en un seul passage sur les rôles puis sur les membres du serveur"""
+        self.by_hex.clear()
+        self.by_role.clear()
+        self.holders.clear()
+        self.member_roles.clear()
+        self.version += 1
+        for role in guild.roles:
+            self.add_role(role)
+        if not self.by_role:
+            return
+        for member in guild.members:
+            self.update_member(member)
+
+    # Rôles
+
+    def add_role(self, role: discord.Role) -> bool:
+        """Indexe le rôle s'il s'agit d'un rôle coloré géré par le bot"""
+        if role.name not in self.names or role.name in self.by_hex:
+            return False
+        self.by_hex[role.name] = role.id
+        self.by_role[role.id] = role.name
+        self.holders.setdefault(role.id, set())
+        self.version += 1
+        return True
+
+    def remove_role(self, role_id: int):
+        name = self.by_role.pop(role_id, None)
+        if name is not None and self.by_hex.get(name) == role_id:
+            del self.by_hex[name]
+        self.version += 1
+        for member_id in self.holders.pop(role_id, ()):
+            roles = self.member_roles.get(member_id)
+            if roles:
+                roles.discard(role_id)
+                if not roles:
+                    del self.member_roles[member_id]
+
+    def rename_role(self, role: discord.Role, name: str):
+        """Met à jour la couleur associée à un rôle recyclé sans perdre ses détenteurs"""
+        old = self.by_role.get(role.id)
+        if old is not None and self.by_hex.get(old) == role.id:
+            del self.by_hex[old]
+        self.by_hex[name] = role.id
+        self.by_role[role.id] = name
+        self.holders.setdefault(role.id, set())
+        self.version += 1
+
+    def register_name(self, name: str):
+        self.names.add(name)
+
+    def unregister_name(self, name: str):
+        self.names.discard(name)
+
+    # Membres
+
+    def update_member(self, member: discord.Member):
+        """Recalcule les rôles colorés d'un membre à partir de ses rôles actuels"""
+        current = {r.id for r in member.roles if r.id in self.by_role}
+        previous = self.member_roles.get(member.id, set())
+        for role_id in previous - current:
+            self.holders.get(role_id, set()).discard(member.id)
+        for role_id in current - previous:
+            self.holders.setdefault(role_id, set()).add(member.id)
+        if current:
+            self.member_roles[member.id] = current
+        else:
+            self.member_roles.pop(member.id, None)
+
+    def remove_member(self, member_id: int):
+        for role_id in self.member_roles.pop(member_id, ()):
+            self.holders.get(role_id, set()).discard(member_id)
+
+    def assign(self, member_id: int, role_id: int):
+        """Enregistre immédiatement l'attribution d'un rôle par le bot (sans attendre l'événement correspondant)"""
+        self.holders.setdefault(role_id, set()).add(member_id)
+        self.member_roles.setdefault(member_id, set()).add(role_id)
+
+    def unassign(self, member_id: int, role_id: int):
+        self.holders.get(role_id, set()).discard(member_id)
+        roles = self.member_roles.get(member_id)
+        if roles:
+            roles.discard(role_id)
+            if not roles:
+                del self.member_roles[member_id]
+
+    # Requêtes
+
+    def role_id(self, name: str) -> Optional[int]:
+        return self.by_hex.get(name)
+
+    def count(self, role_id: int) -> int:
+        return len(self.holders.get(role_id, ()))
+
+    def holders_of(self, role_id: int) -> Set[int]:
+        return self.holders.get(role_id, set())
+
+    def roles_of(self, member_id: int) -> Set[int]:
+        return self.member_roles.get(member_id, set())
+
+    def unused(self) -> Set[int]:
+        return {role_id for role_id, members in self.holders.items() if not members and role_id in self.by_role}
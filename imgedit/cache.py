@@ -0,0 +1,158 @@
+# Cache des images produites par ImgEdit, adressé par le contenu de l'image source et les paramètres du traitement
+
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("red.RedAppsv2.imgedit.cache")
+
+# Les URLs de ces hôtes sont propres à un contenu (avatars et pièces jointes sont adressés par leur empreinte)
+STABLE_HOSTS = ('cdn.discordapp.com', 'media.discordapp.net')
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def make_key(command: str, digest: str, *params) -> str:
+    """Clef d'une entrée : la commande, l'empreinte de l'image source et les paramètres du traitement"""
+    raw = ":".join([command, digest] + [repr(p) for p in params])
+    return hashlib.sha1(raw.encode('utf8')).hexdigest()
+
+
+class ResultCache:
+    """Cache LRU des résultats en mémoire, avec débordement sur disque
+
+    Les entrées évincées de la mémoire sont écrites sur disque plutôt que perdues ; le disque est lui aussi borné en taille.
+    Garde aussi l'empreinte du contenu des URLs stables déjà téléchargées pour éviter de les télécharger à nouveau.
+
+    Proche du `PaletteCache` de HexColor (qui ne peut être importé, chaque cog s'installant séparément), mais adapté
+    à des résultats lourds et opaques : les images ne sont écrites sur disque qu'à leur éviction de la mémoire (et non
+    à chaque ajout), une entrée relue depuis le disque y est retirée pour revenir en mémoire, et l'extension du fichier
+    produit est conservée avec l'image au lieu d'un couple couleurs/PNG."""
+
+    def __init__(self, path: Path, max_memory: int = 64 * 1024 * 1024, max_disk: int = 256 * 1024 * 1024,
+                 max_urls: int = 4096):
+        self.path = path
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.max_urls = max_urls
+        self.memory = OrderedDict()  # Clef -> (Image, Extension)
+        self.memory_size = 0
+        self.disk = OrderedDict()  # Clef -> (Taille, Extension)
+        self.disk_size = 0
+        self.urls = OrderedDict()  # URL -> Empreinte du contenu
+        self.hits = 0
+        self.misses = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        files = sorted(os.scandir(str(self.path)), key=lambda f: f.stat().st_mtime)
+        for file in files:
+            key, ext = os.path.splitext(file.name)
+            size = file.stat().st_size
+            self.disk[key] = (size, ext[1:])
+            self.disk_size += size
+        self._evict_disk()
+
+    def _file(self, key: str, ext: str) -> str:
+        return str(self.path / f"{key}.{ext}")
+
+    def _evict_disk(self):
+        while self.disk_size > self.max_disk and self.disk:
+            key, (size, ext) = self.disk.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(self._file(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def _spill(self, key: str, image: bytes, ext: str):
+        if key in self.disk or len(image) > self.max_disk:
+            return
+        try:
+            with open(self._file(key, ext), 'wb') as f:
+                f.write(image)
+        except OSError:
+            logger.warning(f"Impossible d'écrire le résultat {key} sur disque", exc_info=True)
+            return
+        self.disk[key] = (len(image), ext)
+        self.disk_size += len(image)
+        self._evict_disk()
+
+    def _remember(self, key: str, image: bytes, ext: str):
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key)[0])
+        self.memory[key] = (image, ext)
+        self.memory_size += len(image)
+        while self.memory_size > self.max_memory and len(self.memory) > 1:
+            old_key, (old_image, old_ext) = self.memory.popitem(last=False)
+            self.memory_size -= len(old_image)
+            self._spill(old_key, old_image, old_ext)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+        elif key in self.disk:
+            size, ext = self.disk.pop(key)
+            self.disk_size -= size
+            path = self._file(key, ext)
+            try:
+                with open(path, 'rb') as f:
+                    entry = (f.read(), ext)
+                os.remove(path)
+            except OSError:
+                entry = None
+            if entry is not None:
+                self._remember(key, *entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def set(self, key: str, image: bytes, ext: str):
+        self._remember(key, image, ext)
+
+    def url_digest(self, url: str) -> Optional[str]:
+        digest = self.urls.get(url)
+        if digest is not None:
+            self.urls.move_to_end(url)
+        return digest
+
+    def remember_url(self, url: str, digest: str):
+        if urlsplit(url).hostname not in STABLE_HOSTS:
+            return
+        self.urls[url] = digest
+        self.urls.move_to_end(url)
+        while len(self.urls) > self.max_urls:
+            self.urls.popitem(last=False)
+
+    def flush(self):
+        """Écrit sur disque les résultats encore en mémoire (au déchargement du module)"""
+        for key, (image, ext) in self.memory.items():
+            self._spill(key, image, ext)
+
+    def clear(self):
+        for key, (_, ext) in list(self.disk.items()):
+            try:
+                os.remove(self._file(key, ext))
+            except FileNotFoundError:
+                pass
+        self.memory.clear()
+        self.disk.clear()
+        self.urls.clear()
+        self.memory_size = self.disk_size = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'memory_entries': len(self.memory), 'memory_size': self.memory_size,
+                'disk_entries': len(self.disk), 'disk_size': self.disk_size,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
@@ -0,0 +1,287 @@
+# Moteur de composition d'ImgEdit : ces fonctions ne prennent et ne renvoient que des bytes afin d'être exécutées
+# dans un pool de processus, hors de la boucle d'événements du bot et sans fichier temporaire
+
+import math
+from collections import OrderedDict
+from io import BytesIO
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+DITHER_NONE = getattr(Image, 'Dither', Image).NONE
+MEDIANCUT = getattr(Image, 'Quantize', Image).MEDIANCUT
+
+RENDER_VERSION = 2  # À incrémenter lorsque le rendu change, pour invalider les résultats en cache
+SIZE_BUCKET = 8  # Les calques sont redimensionnés par paliers de 8px pour être réutilisés d'une image à l'autre
+ASSETS = {}  # type: Dict[str, Image.Image]
+
+# Budget par défaut des GIFs produits : nombre d'images, pixels cumulés de toutes les images et taille du fichier
+GIF_BUDGET = {'max_frames': 150, 'max_pixels': 24_000_000, 'max_bytes': 8 * 1024 * 1024}
+GIF_ATTEMPTS = 4
+GIF_MIN_SCALE = 0.35  # En dessous, on retire des images plutôt que de réduire encore leur taille
+PALETTE_SAMPLES = 6
+TRANSPARENT = 255  # Index de palette réservé à la transparence
+
+
+class AnimationTooLarge(Exception):
+    """Soulevée lorsqu'un GIF ne peut pas respecter la taille maximale d'envoi malgré la réduction et le retrait d'images"""
+
+
+class Overlay(NamedTuple):
+    """Calque à appliquer à une image
+
+    Collé par-dessus l'image dans le coin `anchor`, en tenant dans un carré de (largeur de l'image / `scale`) pixels,
+    ou, si `behind` est vrai, placé devant l'image redimensionnée à sa taille"""
+    path: str
+    behind: bool = False
+    anchor: str = 'bottom_right'
+    scale: float = 1.0
+    margin: Tuple[int, int] = (0, 0)
+    mirror: bool = False
+
+
+def load_asset(path: str) -> Image.Image:
+    """Renvoie le calque décodé en RGBA, chargé une seule fois par processus"""
+    asset = ASSETS.get(path)
+    if asset is None:
+        asset = Image.open(path).convert('RGBA')
+        ASSETS[path] = asset
+    return asset
+
+
+def preload(paths: Iterable[str]):
+    """Initialisation des processus du pool : décode tous les calques d'avance"""
+    for path in paths:
+        load_asset(path)
+
+
+class OverlayCache:
+    """Cache LRU (borné en octets) des variantes redimensionnées et/ou retournées des calques"""
+
+    def __init__(self, max_bytes: int = 48 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # (Chemin, Palier, Miroir) -> Image
+
+    def get(self, path: str, box: Optional[int], mirror: bool) -> Image.Image:
+        """Renvoie le calque tenant dans un carré de `box` pixels (arrondi au palier supérieur, taille d'origine si None)"""
+        asset = load_asset(path)
+        bucket = max(SIZE_BUCKET, -(-box // SIZE_BUCKET) * SIZE_BUCKET) if box else None
+        if bucket and bucket >= max(asset.size):
+            bucket = None  # Jamais agrandi : toutes les grandes tailles partagent la même entrée
+        key = (path, bucket, mirror)
+        overlay = self.entries.get(key)
+        if overlay is not None:
+            self.entries.move_to_end(key)
+            return overlay
+
+        overlay = ImageOps.mirror(asset) if mirror else asset
+        if bucket:
+            overlay = overlay.copy() if overlay is asset else overlay
+            overlay.thumbnail((bucket, bucket))
+        self.entries[key] = overlay
+        self.size += overlay.width * overlay.height * 4
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.size -= old.width * old.height * 4
+        return overlay
+
+
+overlays = OverlayCache()
+
+
+def open_image(data: bytes) -> Image.Image:
+    return Image.open(BytesIO(data))
+
+
+def is_animated(image: Image.Image) -> bool:
+    return image.format == 'GIF' and getattr(image, 'is_animated', False)
+
+
+class DecodedFrames:
+    """Images d'un GIF décodées en RGBA
+
+    Lorsque plusieurs rendus sont faits à partir du même GIF, les images décodées sont gardées (dans la limite de
+    `max_pixels`) pour n'être décodées qu'une fois ; chaque rendu en reçoit une copie qu'il peut modifier."""
+
+    def __init__(self, image: Image.Image, max_pixels: int = 0):
+        self.image = image
+        self.max_pixels = max_pixels
+        self.frames = {}  # type: Dict[int, Image.Image]
+        self.pixels = 0
+
+    def get(self, index: int) -> Image.Image:
+        frame = self.frames.get(index)
+        if frame is not None:
+            return frame.copy()
+        self.image.seek(index)
+        frame = self.image.convert('RGBA')
+        if self.pixels + frame.width * frame.height <= self.max_pixels:
+            self.frames[index] = frame
+            self.pixels += frame.width * frame.height
+            return frame.copy()
+        return frame
+
+
+def frame_timeline(image: Image.Image) -> List[Tuple[int, int]]:
+    """Durée (ms) et méthode de disposition de chaque image du GIF"""
+    timeline = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        timeline.append((image.info.get('duration') or 100, getattr(image, 'disposal_method', 0)))
+    image.seek(0)
+    return timeline
+
+
+def select_frames(timeline: List[Tuple[int, int]], max_frames: int) -> List[Tuple[int, int, int]]:
+    """Garde au plus `max_frames` images réparties uniformément, sous la forme (index, durée, disposition)
+
+    La durée des images retirées est reportée sur l'image gardée qui les précède, la durée totale est donc conservée"""
+    step = max(1, math.ceil(len(timeline) / max(1, max_frames)))
+    return [(index, sum(d for d, _ in timeline[index:index + step]), timeline[index][1])
+            for index in range(0, len(timeline), step)]
+
+
+def shared_palette(decoded: DecodedFrames, frames: List[Tuple[int, int, int]], size: Tuple[int, int],
+                   render: Callable) -> Image.Image:
+    """Palette commune (255 couleurs) calculée sur un échantillon d'images, l'index 255 étant réservé à la transparence"""
+    samples = frames[::max(1, len(frames) // PALETTE_SAMPLES)][:PALETTE_SAMPLES]
+    thumbs = []
+    for index, _, _ in samples:
+        thumb = render(decoded.get(index), size)
+        thumb.thumbnail((128, 128))
+        thumbs.append(thumb)
+    montage = Image.new('RGB', (sum(t.width for t in thumbs), max(t.height for t in thumbs)))
+    posx = 0
+    for thumb in thumbs:
+        montage.paste(thumb, (posx, 0), mask=thumb)
+        posx += thumb.width
+
+    palette = montage.quantize(colors=255, method=MEDIANCUT).getpalette()[:255 * 3]
+    palette += [0, 0, 0] * (255 - len(palette) // 3)
+    shared = Image.new('P', (1, 1))
+    # L'index 255 reprend la première couleur : à égalité, la quantification choisit l'index le plus bas et ne l'utilise jamais
+    shared.putpalette(palette + palette[:3])
+    return shared
+
+
+def to_palette(frame: Image.Image, palette: Image.Image) -> Image.Image:
+    indexed = frame.convert('RGB').quantize(palette=palette, dither=DITHER_NONE)
+    mask = frame.getchannel('A').point([255] * 128 + [0] * 128)
+    if mask.getbbox():
+        indexed.paste(TRANSPARENT, mask=mask)
+    return indexed
+
+
+def encode_animation(decoded: DecodedFrames, frames: List[Tuple[int, int, int]], size: Tuple[int, int],
+                     render: Callable) -> bytes:
+    """Rend et encode les images une par une : seule l'image en cours est gardée en RGBA, l'encodeur ne conserve
+    que des images indexées (1 octet par pixel)"""
+    palette = shared_palette(decoded, frames, size, render)
+    image = decoded.image
+
+    def indexed_frames():
+        for index, _, _ in frames:
+            yield to_palette(render(decoded.get(index), size), palette)
+
+    iterator = indexed_frames()
+    first = next(iterator)
+    buffer = BytesIO()
+    # Chaque image est complète et utilise l'index de transparence : elle doit effacer la précédente (disposition 2),
+    # sans quoi ses pixels transparents laisseraient voir l'image d'avant
+    first.save(buffer, format='GIF', save_all=True, append_images=iterator, loop=image.info.get('loop', 0),
+               duration=[d for _, d, _ in frames], disposal=2, transparency=TRANSPARENT, optimize=False)
+    return buffer.getvalue()
+
+
+def render_animation(image: Image.Image, size: Tuple[int, int], render: Callable, budget: dict = None,
+                     decoded: DecodedFrames = None) -> bytes:
+    """Applique `render(image RGBA, taille) -> image RGBA` à chaque image du GIF dans les limites du budget
+
+    La taille est d'abord réduite pour respecter le budget de pixels, puis, si le fichier dépasse la taille maximale,
+    réduite encore ou allégée d'une image sur deux jusqu'à tenir dans la limite"""
+    budget = dict(GIF_BUDGET, **(budget or {}))
+    decoded = decoded or DecodedFrames(image)
+    timeline = frame_timeline(image)
+    max_frames = budget['max_frames']
+    frames = select_frames(timeline, max_frames)
+    scale = min(1.0, math.sqrt(budget['max_pixels'] / (size[0] * size[1] * len(frames))))
+
+    for _ in range(GIF_ATTEMPTS):
+        out_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        data = encode_animation(decoded, frames, out_size, render)
+        if len(data) <= budget['max_bytes']:
+            return data
+        scale *= math.sqrt(budget['max_bytes'] / len(data)) * 0.9
+        if scale < GIF_MIN_SCALE and len(frames) > 1:
+            max_frames = len(frames) // 2
+            frames = select_frames(timeline, max_frames)
+            scale *= math.sqrt(2)
+    raise AnimationTooLarge(f"GIF de {len(data)} octets après {GIF_ATTEMPTS} tentatives")
+
+
+def save_image(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def overlay_position(size: Tuple[int, int], paste_size: Tuple[int, int], margin: tuple, position: str) -> Tuple[int, int]:
+    image_width, image_height = size
+    if position.lower() == 'bottom_left':
+        return 0 + margin[0], image_height - margin[1] - paste_size[1]
+    elif position.lower() == 'top_left':
+        return 0 + margin[0], 0 + margin[1]
+    elif position.lower() == 'top_right':
+        return image_width - margin[0] - paste_size[0], 0 + margin[1]
+    return image_width - paste_size[0] - margin[0], image_height - paste_size[1] - margin[1]
+
+
+def overlay_renderer(overlay: Overlay, image_size: Tuple[int, int]) -> Tuple[Tuple[int, int], Callable]:
+    """Renvoie la taille du rendu et la fonction `render(image RGBA, taille) -> image RGBA` appliquant le calque"""
+    path, mirror = overlay.path, overlay.mirror
+    if overlay.behind:
+        front = overlays.get(path, None, mirror)
+
+        def render(frame: Image.Image, size: Tuple[int, int]) -> Image.Image:
+            layer = front if size == front.size else overlays.get(path, max(size), mirror)
+            frame = frame.resize(layer.size)
+            frame.paste(layer, (0, 0), mask=layer)
+            return frame
+        return front.size, render
+
+    def render(frame: Image.Image, size: Tuple[int, int]) -> Image.Image:
+        ratio = size[0] / image_size[0]
+        paste = overlays.get(path, round(size[0] / overlay.scale), mirror)
+        margin = (round(overlay.margin[0] * ratio), round(overlay.margin[1] * ratio))
+        frame = frame.resize(size) if frame.size != size else frame
+        frame.paste(paste, overlay_position(size, paste.size, margin, overlay.anchor), mask=paste)
+        return frame
+    return image_size, render
+
+
+def render_batch(sources: List[Tuple[bytes, List[Overlay]]], budget: dict = None) -> List[List[Optional[Tuple[bytes, str]]]]:
+    """Applique à chaque image source (statique ou GIF animé) la liste de calques qui l'accompagne
+
+    Chaque image n'est ouverte et décodée qu'une seule fois pour l'ensemble de ses rendus. Renvoie, pour chaque source,
+    la liste des images obtenues en bytes avec leur extension, ou None pour un GIF ne tenant pas dans le budget"""
+    max_pixels = dict(GIF_BUDGET, **(budget or {}))['max_pixels']
+    results = []
+    for data, layers in sources:
+        image = open_image(data)
+        outputs = []
+        if is_animated(image):
+            decoded = DecodedFrames(image, max_pixels if len(layers) > 1 else 0)
+            for layer in layers:
+                size, render = overlay_renderer(layer, image.size)
+                try:
+                    outputs.append((render_animation(image, size, render, budget, decoded), 'gif'))
+                except AnimationTooLarge:
+                    outputs.append(None)
+        else:
+            base = image.convert('RGBA')
+            for layer in layers:
+                size, render = overlay_renderer(layer, image.size)
+                outputs.append((save_image(render(base.copy(), size)), 'png'))
+        results.append(outputs)
+    return results
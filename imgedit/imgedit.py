@@ -1,29 +1,21 @@
 import asyncio
 import logging
-import logging
-import os
-import re
-import time
-import uuid
 from io import BytesIO
-from typing import Optional
-from urllib.parse import urlsplit
+from typing import List, Optional, Tuple
 
-import aiofiles
-import aiohttp
 import discord
-from PIL import Image, ImageSequence, ImageOps
 from redbot.core import Config, commands, checks
-from redbot.core.data_manager import cog_data_path, bundled_data_path
+from redbot.core.data_manager import bundled_data_path, cog_data_path
 
+from .cache import ResultCache, content_hash, make_key
 from .converters import ImageFinder
+from .downloader import Downloader, DownloadError
+from .jobpool import JobPool
+from .templates import TEMPLATES
+from . import compose
 
 logger = logging.getLogger("red.RedAppsv2.imgedit")
 
-FILES_LINKS = re.compile(
-    r"(https?:\/\/[^\"\'\s]*\.(?:png|jpg|jpeg|gif|svg|mp4)(\?size=[0-9]*)?)", flags=re.I
-)
-
 
 class ImgEdit(commands.Cog):
     """Commandes d'édition d'images"""
@@ -33,117 +25,135 @@ class ImgEdit(commands.Cog):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=736144321857978388, force_registration=True)
 
-        self.temp = cog_data_path(self) / "temp"
-        self.temp.mkdir(exist_ok=True, parents=True)
+        default_global = {'gif_max_frames': compose.GIF_BUDGET['max_frames'],
+                          'gif_max_pixels': compose.GIF_BUDGET['max_pixels']}
+        self.config.register_global(**default_global)
+
+        # Calques décodés une seule fois au démarrage de chaque processus du pool
+        self.assets = {t.asset: str(bundled_data_path(self) / f"{t.asset}.png") for t in TEMPLATES.values()}
+        self.pool = JobPool(self.POOL_SIZE, self.JOB_TIMEOUT, initializer=compose.preload,
+                            initargs=(list(self.assets.values()),))
+        self.cache = ResultCache(cog_data_path(self) / "cache")
+        # Les résultats en cache dépendent du contenu des calques, qui peut changer d'une version du module à l'autre
+        self.asset_digests = {path: self.file_digest(path) for path in self.assets.values()}
+        self.downloader = Downloader()
+
+    POOL_SIZE = 2
+    JOB_TIMEOUT = 60
+    MAX_BATCH = 10  # Nombre maximal d'images produites par une commande (limite de fichiers par message)
+
+    async def gif_budget(self, ctx) -> dict:
+        """Budget des GIFs produits, dont la taille maximale d'envoi du serveur"""
+        limit = ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
+        return {'max_frames': await self.config.gif_max_frames(),
+                'max_pixels': await self.config.gif_max_pixels(),
+                'max_bytes': limit - 64 * 1024}
+
+    @staticmethod
+    def file_digest(path: str) -> str:
+        with open(path, 'rb') as f:
+            return content_hash(f.read())
+
+    def template_overlay(self, name: str, **kwargs) -> compose.Overlay:
+        template = TEMPLATES[name]
+        return template.overlay(self.assets[template.asset], **kwargs)
+
+    async def lookup(self, url: str, outputs: List[Tuple[str, compose.Overlay]], params: tuple):
+        """Cherche en cache les rendus demandés pour une image et ne la télécharge que s'il en manque
+
+        Renvoie les clefs des rendus, ceux trouvés en cache (index -> (image, extension)) et l'image source si nécessaire"""
+        def find(digest: str):
+            keys = [make_key(name, digest, overlay, self.asset_digests[overlay.path], compose.RENDER_VERSION, *params)
+                    for name, overlay in outputs]
+            return keys, {i: hit for i, hit in enumerate(map(self.cache.get, keys)) if hit}
+
+        # Une URL stable déjà traitée est servie depuis le cache sans être téléchargée à nouveau
+        digest = self.cache.url_digest(url)
+        keys, found = find(digest) if digest else ([], {})
+        if len(found) == len(outputs):
+            return keys, found, None
+        data = (await self.downloader.fetch(url)).data
+        fetched = content_hash(data)
+        self.cache.remember_url(url, fetched)
+        if fetched != digest:
+            keys, found = find(fetched)
+        return keys, found, data if len(found) < len(outputs) else None
+
+    async def render_and_send(self, ctx, urls: List[str], outputs: List[Tuple[str, compose.Overlay]]):
+        """Applique chaque calque demandé à chaque image et envoie les résultats
+
+        Les rendus sont mis en cache selon le contenu de l'image source et leurs paramètres ; ceux qui manquent sont
+        faits en un seul travail du pool, qui ne décode chaque image qu'une fois"""
+        msg = await ctx.message.channel.send("⏳ Patientez pendant la préparation de votre image")
 
-    async def download(self, url: str, path: str):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        with open(path, "wb") as f:
-                            f.write(data)
-                        return resp.headers.get("Content-type", "").lower()
-        except asyncio.TimeoutError:
-            return False
-
-    async def bytes_download(self, url: str):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        mime = resp.headers.get("Content-type", "").lower()
-                        b = BytesIO(data)
-                        b.seek(0)
-                        return b, mime
-                    else:
-                        return False, False
-        except asyncio.TimeoutError:
-            return False, False
-        except Exception:
-            logger.error("Impossible de télécharger en bytes-like", exc_info=True)
-            return False, False
-
-    def paste_image(self, input_path: str, output_path: str, paste_img_path: str, *,
-                    scale: float = 1.0, margin: tuple = (0, 0), mirror: bool = False, position: str = 'bottom_right'):
-        paste = Image.open(paste_img_path).convert('RGBA')
-        try:
-            image = Image.open(input_path).convert('RGBA')
-        except:
-            image = Image.open(input_path).convert('RGB')
-        image_width, image_height = image.size
-
-        if mirror:
-            paste = ImageOps.mirror(paste)
-
-        paste.thumbnail((round(image_width / scale), round(image_width / scale)))
-
-        if position.lower() == 'bottom_left':
-            pos = (0 + margin[0], image_height - margin[1] - paste.size[1])
-        elif position.lower() == 'top_left':
-            pos = (0 + margin[0], 0 + margin[1])
-        elif position.lower() == 'top_right':
-            pos = (image_width - margin[0] - paste[0], 0 + margin[1])
-        else:
-            pos = (image_width - paste.size[0] - margin[0], image_height - paste.size[1] - margin[1])
-
-        if input_path.endswith('gif') or input_path.endswith('gifv'):
-            image = Image.open(input_path)
-            dur = 1000 / image.info['duration']
-            frames = []
-            for frame in ImageSequence.Iterator(image):
-                transparent = Image.new('RGBA', (image_width, image_height), (0, 0, 0, 0))
-                transparent.paste(frame, (0, 0))
-                transparent.paste(paste, pos, mask=paste)
-                frames.append(transparent)
-            frames[0].save(output_path, format='GIF', append_images=frames[1:], save_all=True,
-                           loop=0, duration=round(dur * 0.90))
-        else:
-            transparent = Image.new('RGBA', (image_width, image_height), (0, 0, 0, 0))
-            transparent.paste(image, (0, 0))
-            transparent.paste(paste, pos, mask=paste)
-            transparent.save(output_path, format='PNG')
-        return output_path
-
-
-    async def add_fp_gun(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
-                        margin_x: int = 0, margin_y: int = 0, *, mirrored: bool = False):
-        if prpt <= 0:
-            return await ctx.send("**Proportion invalide** • La valeur de proportion doit être supérieure à 0.")
+            async with ctx.typing():
+                budget = await self.gif_budget(ctx)
+                params = tuple(sorted(budget.items()))
+                try:
+                    entries = await asyncio.gather(*[self.lookup(url, outputs, params) for url in urls])
+                except DownloadError:
+                    return await ctx.send("**Téléchargement échoué** • Réessayez d'une autre façon (20 Mo max.)")
+
+                jobs = [(keys, found, data, [i for i in range(len(outputs)) if i not in found])
+                        for keys, found, data in entries if data]
+                if jobs:
+                    try:
+                        rendered = await self.pool.run(
+                            compose.render_batch, [(data, [outputs[i][1] for i in missing]) for _, _, data, missing in jobs],
+                            budget=budget, timeout=self.JOB_TIMEOUT * sum(len(job[3]) for job in jobs))
+                    except asyncio.TimeoutError:
+                        return await ctx.send("**Trop long** • L'image est trop lourde pour être traitée, essayez avec une image plus petite.")
+                    except Exception:
+                        logger.error(f"Impossible de faire {', '.join(name for name, _ in outputs)}", exc_info=True)
+                        return await ctx.send("**Erreur** • Impossible de créer l'image demandée.")
+                    for (keys, found, _, missing), results in zip(jobs, rendered):
+                        for i, result in zip(missing, results):
+                            if result:
+                                self.cache.set(keys[i], *result)
+                                found[i] = result
+
+                names = [name for name, _ in outputs]
+                names = names if len(set(names)) == len(names) else [f"{name}{i}" for i, name in enumerate(names, start=1)]
+                files = []
+                for n, (_, found, _) in enumerate(entries, start=1):
+                    for i, name in enumerate(names):
+                        if i in found:
+                            image, ext = found[i]
+                            files.append((f"{name}_{n}.{ext}" if len(entries) > 1 else f"{name}.{ext}", image))
+                if len(files) < len(outputs) * len(entries):
+                    await ctx.send("**Trop lourd** • Même réduit, le GIF obtenu dépasse la taille d'envoi autorisée sur ce serveur.")
+                await self.send_files(ctx, files)
+        finally:
+            await msg.delete()
+
+    async def send_files(self, ctx, files: List[Tuple[str, bytes]]):
+        """Envoie les fichiers en aussi peu de messages que le permettent les limites de Discord"""
+        limit = ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
+        groups, size = [[]], 0
+        for filename, data in files:
+            if groups[-1] and (len(groups[-1]) == self.MAX_BATCH or size + len(data) > limit):
+                groups.append([])
+                size = 0
+            groups[-1].append(discord.File(BytesIO(data), filename=filename))
+            size += len(data)
+        for group in groups:
+            if not group:
+                continue
+            try:
+                await ctx.send(files=group)
+            except:
+                await ctx.send("**Impossible** • Je n'ai pas réussi à upload l'image (probablement trop lourde)")
+                logger.error(msg=f"{', '.join(f.filename for f in group)} : Impossible d'upload l'image", exc_info=True)
 
+    async def apply_template(self, ctx, name: str, url: Optional[List[str]], prpt: float = None,
+                             margin_x: int = 0, margin_y: int = 0, *, mirrored: bool = False):
+        if prpt is not None and prpt <= 0:
+            return await ctx.send("**Proportion invalide** • La valeur de proportion doit être supérieure à 0.")
         if url is None:
             url = await ImageFinder().search_for_images(ctx)
-        msg = await ctx.message.channel.send("⏳ Patientez pendant la préparation de votre image")
-
-        async with ctx.typing():
-            url = url[0]
-            filename = urlsplit(url).path.rsplit('/')[-1]
-            filepath = str(self.temp / filename)
-            try:
-                await self.download(url, filepath)
-            except:
-                await ctx.send("**Téléchargement échoué** • Réessayez d'une autre façon")
-            else:
-                gun = bundled_data_path(self) / "GunWM.png"
-                try:
-                    task = self.paste_image(filepath, filepath, str(gun), scale=prpt, margin=(margin_x, margin_y),
-                                            mirror=mirrored, position='bottom_right' if not mirrored else 'bottom_left')
-                except:
-                    os.remove(filepath)
-                    logger.error("Impossible de faire gun_right/gun_left", exc_info=True)
-                    return await ctx.send("**Erreur** • Impossible de créer l'image demandée.")
-
-                file = discord.File(task)
-                try:
-                    await ctx.send(file=file)
-                except:
-                    await ctx.send("**Impossible** • Je n'ai pas réussi à upload l'image (probablement trop lourde)")
-                    logger.error(msg="GUN : Impossible d'upload l'image", exc_info=True)
-                os.remove(filepath)
-            finally:
-                await msg.delete()
+        overlay = self.template_overlay(name, scale=prpt, margin=(margin_x, margin_y), mirror=mirrored)
+        await self.render_and_send(ctx, url[:1], [(name, overlay)])
 
     @commands.command(name='gunr', aliases=['gun'])
     async def gun_right(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
@@ -153,7 +163,7 @@ class ImgEdit(commands.Cog):
         **[prpt]** = Proportion du pistolet, plus le chiffre est élevé plus il sera petit (1 = à la proportion de l'image source)
         **[url]** = URL de l'image sur laquelle appliquer le filtre (optionnel)
         **[margin_x/margin_y]** = Marges à ajouter (en pixels) à l'image du pistolet par rapport aux bords de l'image source (nécéssite l'utilisation d'une URL)"""
-        return await self.add_fp_gun(ctx, prpt, url, margin_x, margin_y)
+        return await self.apply_template(ctx, 'gun', url, prpt, margin_x, margin_y)
 
     @commands.command(name='gunl')
     async def gun_left(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
@@ -163,45 +173,7 @@ class ImgEdit(commands.Cog):
         **[prpt]** = Proportion du pistolet, plus le chiffre est élevé plus il sera petit (1 = à la proportion de l'image source)
         **[url]** = URL de l'image sur laquelle appliquer le filtre (optionnel)
         **[margin_x/margin_y]** = Marges à ajouter (en pixels) à l'image du pistolet par rapport aux bords de l'image source (nécéssite l'utilisation d'une URL)"""
-        return await self.add_fp_gun(ctx, prpt, url, margin_x, margin_y, mirrored=True)
-
-
-    async def add_tp_gun(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
-                         margin_x: int = 0, margin_y: int = 0, *, mirrored: bool = False):
-        if prpt <= 0:
-            return await ctx.send("**Proportion invalide** • La valeur de proportion doit être supérieure à 0.")
-
-        if url is None:
-            url = await ImageFinder().search_for_images(ctx)
-        msg = await ctx.message.channel.send("⏳ Patientez pendant la préparation de votre image")
-
-        async with ctx.typing():
-            url = url[0]
-            filename = urlsplit(url).path.rsplit('/')[-1]
-            filepath = str(self.temp / filename)
-            try:
-                await self.download(url, filepath)
-            except:
-                await ctx.send("**Téléchargement échoué** • Réessayez d'une autre façon")
-            else:
-                gun = bundled_data_path(self) / "HoldUpWM.png"
-                try:
-                    task = self.paste_image(filepath, filepath, str(gun), scale=prpt, margin=(margin_x, margin_y),
-                                            mirror=mirrored, position='bottom_left' if not mirrored else 'bottom_right')
-                except:
-                    os.remove(filepath)
-                    logger.error("Impossible de faire tp_gun", exc_info=True)
-                    return await ctx.send("**Erreur** • Impossible de créer l'image demandée.")
-
-                file = discord.File(task)
-                try:
-                    await ctx.send(file=file)
-                except:
-                    await ctx.send("**Impossible** • Je n'ai pas réussi à upload l'image (probablement trop lourde)")
-                    logger.error(msg="GUN : Impossible d'upload l'image", exc_info=True)
-                os.remove(filepath)
-            finally:
-                await msg.delete()
+        return await self.apply_template(ctx, 'gun', url, prpt, margin_x, margin_y, mirrored=True)
 
     @commands.command(name='holdupr', aliases=['holupr'])
     async def holdup_right(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
@@ -211,7 +183,7 @@ class ImgEdit(commands.Cog):
         **[prpt]** = Proportion du pistolet, plus le chiffre est élevé plus il sera petit (1 = à la proportion de l'image source)
         **[url]** = URL de l'image sur laquelle appliquer le filtre (optionnel)
         **[margin_x/margin_y]** = Marges à ajouter (en pixels) à l'image du pistolet par rapport aux bords de l'image source (nécéssite l'utilisation d'une URL)"""
-        return await self.add_tp_gun(ctx, prpt, url, margin_x, margin_y, mirrored=True)
+        return await self.apply_template(ctx, 'holdup', url, prpt, margin_x, margin_y, mirrored=True)
 
     @commands.command(name='holdupl', aliases=['holdup', 'holup'])
     async def holdup_left(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
@@ -221,44 +193,7 @@ class ImgEdit(commands.Cog):
         **[prpt]** = Proportion du pistolet, plus le chiffre est élevé plus il sera petit (1 = à la proportion de l'image source)
         **[url]** = URL de l'image sur laquelle appliquer le filtre (optionnel)
         **[margin_x/margin_y]** = Marges à ajouter (en pixels) à l'image du pistolet par rapport aux bords de l'image source (nécéssite l'utilisation d'une URL)"""
-        return await self.add_tp_gun(ctx, prpt, url, margin_x, margin_y)
-
-    async def add_vibecheck(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
-                         margin_x: int = 0, margin_y: int = 0, *, mirrored: bool = False):
-        if prpt <= 0:
-            return await ctx.send("**Proportion invalide** • La valeur de proportion doit être supérieure à 0.")
-
-        if url is None:
-            url = await ImageFinder().search_for_images(ctx)
-        msg = await ctx.message.channel.send("⏳ Patientez pendant la préparation de votre image")
-
-        async with ctx.typing():
-            url = url[0]
-            filename = urlsplit(url).path.rsplit('/')[-1]
-            filepath = str(self.temp / filename)
-            try:
-                await self.download(url, filepath)
-            except:
-                await ctx.send("**Téléchargement échoué** • Réessayez d'une autre façon")
-            else:
-                gun = bundled_data_path(self) / "VibecheckWM.png"
-                try:
-                    task = self.paste_image(filepath, filepath, str(gun), scale=prpt, margin=(margin_x, margin_y),
-                                            mirror=mirrored, position='bottom_left' if not mirrored else 'bottom_right')
-                except:
-                    os.remove(filepath)
-                    logger.error("Impossible de faire vibcheck", exc_info=True)
-                    return await ctx.send("**Erreur** • Impossible de créer l'image demandée.")
-
-                file = discord.File(task)
-                try:
-                    await ctx.send(file=file)
-                except:
-                    await ctx.send("**Impossible** • Je n'ai pas réussi à upload l'image (probablement trop lourde)")
-                    logger.error(msg="Vibecheck : Impossible d'upload l'image", exc_info=True)
-                os.remove(filepath)
-            finally:
-                await msg.delete()
+        return await self.apply_template(ctx, 'holdup', url, prpt, margin_x, margin_y)
 
     @commands.command(name='vibecheckr', aliases=['vbr'])
     async def vibecheck_right(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
@@ -268,7 +203,7 @@ class ImgEdit(commands.Cog):
         **[prpt]** = Proportion de la main, plus le chiffre est élevé plus il sera petit (1 = à la proportion de l'image source)
         **[url]** = URL de l'image sur laquelle appliquer le filtre (optionnel)
         **[margin_x/margin_y]** = Marges à ajouter (en pixels) à l'image de la main par rapport aux bords de l'image source (nécéssite l'utilisation d'une URL)"""
-        return await self.add_vibecheck(ctx, prpt, url, margin_x, margin_y, mirrored=True)
+        return await self.apply_template(ctx, 'vibecheck', url, prpt, margin_x, margin_y, mirrored=True)
 
     @commands.command(name='vibecheckl', aliases=['vbl', 'vibecheck'])
     async def vibecheck_left(self, ctx, prpt: Optional[float] = 1.75, url: ImageFinder = None,
@@ -278,41 +213,7 @@ class ImgEdit(commands.Cog):
         **[prpt]** = Proportion de la main, plus le chiffre est élevé plus il sera petit (1 = à la proportion de l'image source)
         **[url]** = URL de l'image sur laquelle appliquer le filtre (optionnel)
         **[margin_x/margin_y]** = Marges à ajouter (en pixels) à l'image de la main par rapport aux bords de l'image source (nécéssite l'utilisation d'une URL)"""
-        return await self.add_vibecheck(ctx, prpt, url, margin_x, margin_y)
-
-    def paste_image_behind(self, input_path: str, output_path: str, paste_img_path: str, *, mirror: bool = False):
-        front = Image.open(paste_img_path).convert('RGBA')
-        try:
-            image = Image.open(input_path).convert('RGBA')
-        except:
-            image = Image.open(input_path).convert('RGB')
-        final_width, final_height = front.size
-
-        if mirror:
-            front = ImageOps.mirror(front)
-
-        if input_path.endswith('gif') or input_path.endswith('gifv'):
-            image = Image.open(input_path)
-            image = image.resize((final_width, final_height))
-            dur = 1000 / image.info['duration']
-            frames = []
-            for frame in ImageSequence.Iterator(image):
-                frame.thumbnail((final_width, final_height), Image.ANTIALIAS)
-
-                transparent = Image.new('RGBA', (final_width, final_height), (0, 0, 0, 0))
-                transparent.paste(frame, (0, 0))
-                transparent.paste(front, (0, 0), mask=front)
-                frames.append(transparent)
-
-            frames[0].save(output_path, format='GIF', append_images=frames[1:], save_all=True,
-                           loop=0, duration=round(dur * 0.90))
-        else:
-            image = image.resize((final_width, final_height))
-            transparent = Image.new('RGBA', (final_width, final_height), (0, 0, 0, 0))
-            transparent.paste(image, (0, 0))
-            transparent.paste(front, (0, 0), mask=front)
-            transparent.save(output_path, format='PNG')
-        return output_path
+        return await self.apply_template(ctx, 'vibecheck', url, prpt, margin_x, margin_y)
 
     @commands.command(name='zahando', aliases=['thehand'])
     async def za_hando(self, ctx, url: ImageFinder = None, mirror: bool = False):
@@ -320,37 +221,55 @@ class ImgEdit(commands.Cog):
 
         **[url]** = URL de l'image sur laquelle appliquer le filtre (optionnel)
         **[mirror]** = Inverse le sens de Za Hando"""
-
-        if url is None:
-            url = await ImageFinder().search_for_images(ctx)
-        msg = await ctx.message.channel.send("⏳ Patientez pendant la préparation de votre image")
-
-        async with ctx.typing():
-            url = url[0]
-            filename = urlsplit(url).path.rsplit('/')[-1]
-            filepath = str(self.temp / filename)
-            try:
-                await self.download(url, filepath)
-            except:
-                await ctx.send("**Téléchargement échoué** • Réessayez d'une autre façon")
-            else:
-                gun = bundled_data_path(self) / "ZaHando.png"
-                try:
-                    task = self.paste_image_behind(filepath, filepath, str(gun), mirror=mirror)
-                except:
-                    os.remove(filepath)
-                    logger.error("Impossible de faire za_hando", exc_info=True)
-                    return await ctx.send("**Erreur** • Impossible de créer l'image demandée.")
-
-                file = discord.File(task)
-                try:
-                    await ctx.send(file=file)
-                except:
-                    await ctx.send("**Impossible** • Je n'ai pas réussi à upload l'image (probablement trop lourde)")
-                    logger.error(msg="GUN : Impossible d'upload l'image", exc_info=True)
-                os.remove(filepath)
-            finally:
-                await msg.delete()
+        await self.apply_template(ctx, 'zahando', url, mirrored=mirror)
+
+    @commands.command(name='imgbatch', aliases=['memes'])
+    async def batch_templates(self, ctx, templates: str, *, urls: ImageFinder = None):
+        """Applique plusieurs modèles à une ou plusieurs images en une seule fois
+
+        **templates** = Noms des modèles séparés par des virgules (ex. `gun,holdup,zahando`), précédez un nom de `~` pour retourner le calque (ex. `~gun`)
+        **[urls]** = Images (liens, mentions ou fichiers joints) sur lesquelles appliquer les modèles (optionnel, dernière image du salon par défaut)"""
+        names = [n.strip().lower() for n in templates.split(',') if n.strip()]
+        unknown = [n for n in names if n.lstrip('~') not in TEMPLATES]
+        if unknown or not names:
+            return await ctx.send(f"**Modèle inconnu** • Modèles disponibles : {', '.join(f'`{n}`' for n in TEMPLATES)}")
+        if urls is None:
+            urls = (await ImageFinder().search_for_images(ctx))[:1]
+        urls = list(dict.fromkeys(urls))
+        if len(names) * len(urls) > self.MAX_BATCH:
+            return await ctx.send(f"**Trop d'images** • Une même commande ne peut produire plus de {self.MAX_BATCH} images.")
+        outputs = [(n.lstrip('~'), self.template_overlay(n.lstrip('~'), mirror=n.startswith('~'))) for n in names]
+        await self.render_and_send(ctx, urls, outputs)
+
+    @commands.group(name="imgset")
+    @checks.is_owner()
+    async def _imgedit_settings(self, ctx):
+        """Paramètres d'ImgEdit"""
+
+    @_imgedit_settings.command(name="gifbudget")
+    async def set_gif_budget(self, ctx, max_frames: int, max_megapixels: float):
+        """Modifie le budget des GIFs produits
+
+        **max_frames** = Nombre maximal d'images conservées (les autres sont retirées en conservant la durée totale)
+        **max_megapixels** = Nombre maximal de pixels (en millions) cumulés sur toutes les images, au-delà les images sont réduites"""
+        if max_frames < 1 or max_megapixels <= 0:
+            return await ctx.send("**Valeurs invalides** • Les deux valeurs doivent être positives.")
+        await self.config.gif_max_frames.set(max_frames)
+        await self.config.gif_max_pixels.set(int(max_megapixels * 1_000_000))
+        await ctx.send(f"**Budget modifié** • Les GIFs produits auront au plus {max_frames} images "
+                       f"et {max_megapixels:g} millions de pixels cumulés.")
+
+    @_imgedit_settings.command(name="cache")
+    async def result_cache_info(self, ctx, clear: bool = False):
+        """Affiche l'état du cache des images produites, ou le vide si `clear` vaut `true`"""
+        if clear:
+            self.cache.clear()
+            return await ctx.send("**Cache vidé** • Les images seront recalculées à la prochaine demande.")
+        stats = self.cache.stats()
+        await ctx.send(f"**Cache des images** • {stats['memory_entries']} entrées en mémoire "
+                       f"({stats['memory_size'] / 1024:.0f} Ko), {stats['disk_entries']} sur disque "
+                       f"({stats['disk_size'] / 1024:.0f} Ko)\n"
+                       f"Succès : {stats['hits']} / Échecs : {stats['misses']} ({stats['hit_rate']:.0%})")
 
     @commands.command(name="nsfwswitch")
     @checks.mod_or_permissions(manage_messages=True)
@@ -392,3 +311,8 @@ class ImgEdit(commands.Cog):
                 return
             if msg.attachments:
                 first = False
+
+    def cog_unload(self):
+        self.pool.shutdown()
+        self.cache.flush()
+        self.bot.loop.create_task(self.downloader.close())
@@ -0,0 +1,45 @@
+# Registre des modèles d'ImgEdit : chaque modèle décrit son calque et la façon de l'appliquer, le rendu étant fait
+# par `compose.render_batch` ; ajouter un modèle revient à ajouter son calque dans les données et une entrée ici
+
+from typing import NamedTuple, Tuple
+
+from .compose import Overlay
+
+
+def flip_anchor(anchor: str) -> str:
+    """Inverse horizontalement un coin (bottom_right <-> bottom_left)"""
+    if anchor.endswith('_right'):
+        return anchor[:-len('right')] + 'left'
+    if anchor.endswith('_left'):
+        return anchor[:-len('left')] + 'right'
+    return anchor
+
+
+class Template(NamedTuple):
+    """Modèle d'édition
+
+    `asset` : nom du calque (fichier PNG des données du module, sans extension)
+    `anchor` : coin de l'image où est placé le calque, inversé horizontalement lorsque le calque est retourné
+    `scale` : proportion par défaut, le calque tient dans un carré de (largeur de l'image / scale) pixels
+    `behind` : l'image est redimensionnée à la taille du calque et placée derrière lui au lieu d'être recouverte
+    `mirror` : le calque est retourné par défaut"""
+    asset: str
+    anchor: str = 'bottom_right'
+    scale: float = 1.75
+    behind: bool = False
+    mirror: bool = False
+
+    def overlay(self, path: str, *, scale: float = None, margin: Tuple[int, int] = (0, 0),
+                mirror: bool = False) -> Overlay:
+        """Calque à appliquer pour ce modèle, `mirror` retournant le calque par rapport à son sens par défaut"""
+        mirror = mirror != self.mirror
+        anchor = flip_anchor(self.anchor) if mirror else self.anchor
+        return Overlay(path, self.behind, anchor, scale or self.scale, tuple(margin), mirror)
+
+
+TEMPLATES = {
+    'gun': Template('GunWM'),
+    'holdup': Template('HoldUpWM', anchor='bottom_left'),
+    'vibecheck': Template('VibecheckWM', anchor='bottom_left'),
+    'zahando': Template('ZaHando', behind=True),
+}
@@ -0,0 +1,105 @@
+# Réconciliation des rôles colorés de HexColor, avec un serveur et une config simulés
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('discord')
+pytest.importorskip('redbot')
+
+from hexcolor.reconcile import ReconcileJob
+from hexcolor.roleindex import RoleIndex
+
+
+class FakeValue:
+    """Valeur de config : `await value()`, `value.set()`, `value.clear()` et `async with value()`"""
+
+    def __init__(self, data: dict, name: str):
+        self.data = data
+        self.name = name
+
+    def __call__(self):
+        return self
+
+    def __await__(self):
+        return self._get().__await__()
+
+    async def _get(self):
+        return self.data.get(self.name, {})
+
+    async def set(self, value):
+        self.data[self.name] = value
+
+    async def clear(self):
+        self.data.pop(self.name, None)
+
+    async def __aenter__(self):
+        return self.data.setdefault(self.name, {})
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeGroup:
+    def __init__(self, **data):
+        self.data = data
+
+    def __getattr__(self, name):
+        return FakeValue(self.data, name)
+
+
+class FakeRole:
+    def __init__(self, role_id: int, name: str):
+        self.id = role_id
+        self.name = name
+        self.deleted = False
+
+    async def delete(self, reason: str = None):
+        self.deleted = True
+
+
+def make_guild(roles):
+    by_id = {r.id: r for r in roles}
+    return SimpleNamespace(id=1, roles=roles, members=[], get_role=by_id.get)
+
+
+def test_role_reassigned_during_job_is_kept():
+    unused, reassigned = FakeRole(10, '#FF0000'), FakeRole(11, '#00FF00')
+    guild = make_guild([unused, reassigned])
+    config = FakeGroup(roles={'#FF0000': {}, '#00FF00': {}}, reconcile={}, delimiter=None)
+    index = RoleIndex(guild, config.data['roles'])
+    job = ReconcileJob(guild, index, config, sort=False)
+
+    async def scenario():
+        await job.prepare()
+        assert set(job.pending) == {10, 11}
+        index.assign(42, 11)  # Le rôle est attribué à un membre entre la préparation et l'application
+        await job._apply_deletions()
+
+    asyncio.run(scenario())
+
+    assert unused.deleted and not reassigned.deleted
+    assert job.deleted == ['#FF0000']
+    assert not job.pending
+    assert index.by_role == {11: '#00FF00'}
+    assert '#00FF00' in index.names
+    assert set(config.data['roles']) == {'#00FF00'}
+    assert 'reconcile' not in config.data
+
+
+def test_unexpected_error_ends_job_and_keeps_pending():
+    role = FakeRole(10, '#FF0000')
+    guild = make_guild([role])
+    config = FakeGroup(roles={'#FF0000': {}}, reconcile={}, delimiter=None)
+    index = RoleIndex(guild, config.data['roles'])
+    job = ReconcileJob(guild, index, config, sort=False)
+
+    async def broken(*args):
+        raise KeyError('index')
+    job._apply_deletions = broken
+
+    asyncio.run(job.run())
+
+    assert job.state == 'error' and job.done
+    assert config.data['reconcile'] == {'delete': [10], 'sort': False}
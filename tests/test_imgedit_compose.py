@@ -0,0 +1,51 @@
+# Encodage des GIFs d'ImgEdit : le moteur de composition ne dépend que de Pillow, il est chargé directement depuis son
+# fichier pour ne pas importer le cog (et Red)
+
+import importlib.util
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('PIL')
+
+from PIL import Image
+
+SPEC = importlib.util.spec_from_file_location(
+    'imgedit_compose', Path(__file__).resolve().parent.parent / 'imgedit' / 'compose.py')
+compose = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(compose)
+
+SIZE = (40, 20)
+RED, BLUE = (255, 0, 0, 255), (0, 0, 255, 255)
+
+
+def two_frame_gif(disposal: int) -> bytes:
+    """GIF opaque de deux images : entièrement rouge, puis entièrement bleue"""
+    frames = [Image.new('RGBA', SIZE, RED), Image.new('RGBA', SIZE, BLUE)]
+    buffer = BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=100,
+                   disposal=disposal, loop=0)
+    return buffer.getvalue()
+
+
+def moving_square(frame: Image.Image, size) -> Image.Image:
+    """Rendu laissant des pixels transparents : un carré de la couleur de l'image, à gauche si rouge, à droite si bleue"""
+    color = frame.getpixel((0, 0))
+    square = Image.new('RGBA', size, (0, 0, 0, 0))
+    square.paste(color, (0, 0, 20, 20) if color[0] > 200 else (20, 0, 40, 20))
+    return square
+
+
+@pytest.mark.parametrize('disposal', [0, 1, 2])
+def test_animation_leaves_no_trail_of_previous_frame(disposal):
+    source = compose.open_image(two_frame_gif(disposal))
+    data = compose.render_animation(source, SIZE, moving_square)
+
+    result = Image.open(BytesIO(data))
+    assert result.n_frames == 2
+    result.seek(1)
+    second = result.convert('RGBA')
+    # La moitié gauche n'était occupée que par le carré de la première image : elle doit être de nouveau transparente
+    assert second.getchannel('A').crop((0, 0, 20, 20)).getextrema() == (0, 0)
+    assert second.getpixel((30, 10))[2] > 200
@@ -0,0 +1,22 @@
+# Les modules partagés sont copiés dans chaque cog qui les utilise (les cogs s'installent séparément) :
+# ces tests échouent dès qu'une copie diverge des autres
+
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SHARED = {
+    'downloader.py': ('canva', 'hexcolor', 'imgedit'),
+    'converters.py': ('canva', 'hexcolor', 'imgedit'),
+    'jobpool.py': ('hexcolor', 'imgedit'),
+}
+
+
+@pytest.mark.parametrize('module', sorted(SHARED))
+def test_copies_are_identical(module):
+    copies = {cog: (ROOT / cog / module).read_bytes() for cog in SHARED[module]}
+    reference = copies[SHARED[module][0]]
+    different = [cog for cog, data in copies.items() if data != reference]
+    assert not different, f"{module} diffère de la copie de {SHARED[module][0]} dans : {', '.join(different)}"
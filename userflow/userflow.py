@@ -1,7 +1,8 @@
 import asyncio
 import re
+import time
 from copy import copy
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Union
 
 import discord
@@ -18,6 +19,55 @@ from tabulate import tabulate
 
 logger = logging.getLogger("red.RedAppsv2.userflow")
 
+AGE_BINS = (1, 7, 30, 365)  # Bornes supérieures (en jours) des tranches d'âge de compte
+RAID_HISTORY = 14 * 86400  # Durée de conservation des périodes de protection (celle de l'attribution des rôles à délai)
+
+
+class JoinWindow:
+    """Fenêtre glissante d'arrivées à mémoire constante (buffer circulaire)
+
+    La fenêtre est découpée en `slots` cases de durée égale, chacune contenant l'histogramme des âges de compte
+    des membres arrivés pendant cette période. Une case périmée est simplement réinitialisée lorsqu'elle est réutilisée."""
+
+    def __init__(self, span: int, slots: int = 60):
+        self.span = max(span, 1)
+        self.slots = slots
+        self.resolution = self.span / slots
+        self.epochs = [-1] * slots
+        self.buckets = [[0] * (len(AGE_BINS) + 1) for _ in range(slots)]
+
+    @staticmethod
+    def age_bin(account_age: timedelta) -> int:
+        for n, bound in enumerate(AGE_BINS):
+            if account_age.days < bound:
+                return n
+        return len(AGE_BINS)
+
+    def _current(self, now: float = None) -> int:
+        return int((now if now is not None else time.time()) // self.resolution)
+
+    def add(self, account_age: timedelta, now: float = None):
+        """Enregistre une arrivée dans la case courante"""
+        epoch = self._current(now)
+        slot = epoch % self.slots
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.buckets[slot] = [0] * (len(AGE_BINS) + 1)
+        self.buckets[slot][self.age_bin(account_age)] += 1
+
+    def histogram(self, now: float = None) -> list:
+        """Renvoie l'histogramme des âges de compte sur toute la fenêtre"""
+        epoch = self._current(now)
+        hist = [0] * (len(AGE_BINS) + 1)
+        for slot in range(self.slots):
+            if epoch - self.slots < self.epochs[slot] <= epoch:
+                for n, v in enumerate(self.buckets[slot]):
+                    hist[n] += v
+        return hist
+
+    def count(self, now: float = None) -> int:
+        return sum(self.histogram(now))
+
 
 class UserFlow(commands.Cog):
     """Contrôle de l'entrée et sortie des membres du serveur"""
@@ -28,10 +78,22 @@ class UserFlow(commands.Cog):
         self.config = Config.get_conf(self, identifier=736144321857978388, force_registration=True)
 
         default_member = {'messages_count': 0}
-        default_guild = {'joining_roles': []}
+        default_guild = {'joining_roles': [],
+                         'raid_periods': [],
+                         'raid_settings': {'enabled': False,
+                                           'window': 60,
+                                           'threshold': 10,
+                                           'young_days': 7,
+                                           'young_threshold': 5,
+                                           'lockdown': 900,
+                                           'alert_channel': None}}
         self.config.register_member(**default_member)
         self.config.register_guild(**default_guild)
 
+        self.join_windows = {}
+        self.raid_lockdowns = {}
+        self.raid_periods = {}
+
         self.userflow_loop.start()
 
     @tasks.loop(minutes=1)
@@ -39,15 +101,18 @@ class UserFlow(commands.Cog):
         all_guilds = await self.config.all_guilds()
         for g in all_guilds:
             guild = self.bot.get_guild(g)
+            if guild is None or self.is_locked_down(guild):
+                continue
             data = all_guilds[g]['joining_roles']
             if data:
+                periods = await self.get_raid_periods(guild)
                 for r in data:
                     role = guild.get_role(r['role'])
                     if r['rules'].get('delay'):
                         tdel = self.parse_timedelta(r['rules']['delay'])
                         cond = lambda u: (u.joined_at + tdel) <= datetime.utcnow()
                         for member in guild.members:
-                            if (datetime.now() - member.joined_at).days <= 14:
+                            if (datetime.now() - member.joined_at).days <= 14 and not self.joined_during_raid(member, periods):
                                 if r['role'] not in (mr.id for mr in member.roles):
                                     if cond(member):
                                         await member.add_roles(role, reason="Attribution auto. à l'arrivée | Condition de délai respectée")
@@ -57,6 +122,96 @@ class UserFlow(commands.Cog):
         logger.info('Starting userflow_loop...')
         await self.bot.wait_until_ready()
 
+    def get_join_window(self, guild: discord.Guild, span: int) -> JoinWindow:
+        """Renvoie la fenêtre d'arrivées du serveur, recréée si sa durée a été modifiée"""
+        window = self.join_windows.get(guild.id)
+        if not window or window.span != span:
+            window = JoinWindow(span)
+            self.join_windows[guild.id] = window
+        return window
+
+    def is_locked_down(self, guild: discord.Guild) -> bool:
+        """Vérifie si le mode protection anti-raid est actif sur le serveur"""
+        until = self.raid_lockdowns.get(guild.id)
+        if until is None:
+            return False
+        if until <= time.time():
+            del self.raid_lockdowns[guild.id]
+            return False
+        return True
+
+    async def get_raid_periods(self, guild: discord.Guild) -> list:
+        """Renvoie les périodes de protection récentes du serveur sous la forme [début, fin] (timestamps)"""
+        periods = self.raid_periods.get(guild.id)
+        if periods is None:
+            periods = await self.config.guild(guild).raid_periods()
+            self.raid_periods[guild.id] = periods
+        return periods
+
+    async def save_raid_period(self, guild: discord.Guild, start: float, end: float, extend: bool):
+        """Enregistre une période de protection (ou prolonge la dernière) et oublie celles qui sont trop anciennes"""
+        periods = [p for p in await self.get_raid_periods(guild) if p[1] > time.time() - RAID_HISTORY]
+        if extend and periods:
+            periods[-1] = [periods[-1][0], end]
+        else:
+            periods.append([start, end])
+        self.raid_periods[guild.id] = periods
+        await self.config.guild(guild).raid_periods.set(periods)
+
+    @staticmethod
+    def joined_during_raid(member: discord.Member, periods: list) -> bool:
+        """Vérifie si le membre est arrivé pendant une période de protection"""
+        joined_at = getattr(member, 'joined_at', None)
+        if not periods or not joined_at:
+            return False
+        joined = joined_at.replace(tzinfo=timezone.utc).timestamp()
+        return any(start <= joined <= end for start, end in periods)
+
+    async def check_raid(self, user: discord.Member) -> bool:
+        """Enregistre l'arrivée du membre et active le mode protection si les seuils sont dépassés
+
+        Renvoie True si le serveur est (ou vient d'être placé) en mode protection"""
+        guild = user.guild
+        settings = await self.config.guild(guild).raid_settings()
+        if not settings['enabled']:
+            return False
+
+        window = self.get_join_window(guild, settings['window'])
+        window.add(datetime.utcnow() - user.created_at)
+        hist = window.histogram()
+        total = sum(hist)
+        young = sum(hist[n] for n, bound in enumerate(AGE_BINS) if bound <= settings['young_days'])
+
+        if total < settings['threshold'] and young < settings['young_threshold']:
+            return self.is_locked_down(guild)
+
+        already = self.is_locked_down(guild)
+        now = time.time()
+        self.raid_lockdowns[guild.id] = now + settings['lockdown']
+        # Les arrivées ayant déclenché la protection font partie de la période
+        await self.save_raid_period(guild, now - settings['window'], now + settings['lockdown'], extend=already)
+        if not already:
+            logger.warning(f"Mode protection anti-raid activé sur {guild.id} ({total} arrivées, {young} comptes récents)")
+            await self.send_raid_alert(guild, settings, hist)
+        return True
+
+    async def send_raid_alert(self, guild: discord.Guild, settings: dict, hist: list):
+        """Alerte les modérateurs de l'activation du mode protection"""
+        channel = guild.get_channel(settings['alert_channel']) if settings['alert_channel'] else None
+        if not channel:
+            return
+        labels = [f"< {b}j" for b in AGE_BINS] + [f"≥ {AGE_BINS[-1]}j"]
+        tab = tabulate(list(zip(labels, hist)), headers=["Âge du compte", "Arrivées"])
+        em = discord.Embed(title="Mode protection anti-raid activé",
+                           description=f"**{sum(hist)}** arrivées ces **{settings['window']}s**, les rôles d'arrivée ne seront pas attribués pendant "
+                                       f"**{settings['lockdown'] // 60} minutes** (prolongé tant que l'afflux continue).\n" + box(tab),
+                           color=discord.Color.red())
+        em.set_footer(text="Utilisez ;joinset raid unlock pour désactiver la protection manuellement")
+        try:
+            await channel.send(embed=em)
+        except discord.HTTPException:
+            logger.warning(f"Impossible d'envoyer l'alerte anti-raid sur {guild.id}")
+
     def parse_timedelta(self, time_string: str) -> timedelta:
         """Renvoie un objet *timedelta* à partir d'un str contenant des informations de durée (Xj Xh Xm Xs)"""
         if not isinstance(time_string, str):
@@ -166,6 +321,96 @@ class UserFlow(commands.Cog):
                     guildroles.remove(r)
         await ctx.send("**Rôles supprimés** : les rôles demandés ont été retirés du système d'attribution automatique à l'arrivée")
 
+    @_joining_set.group(name="raid")
+    async def _raid_set(self, ctx):
+        """Paramètres de détection des raids (afflux d'arrivées)"""
+
+    @_raid_set.command(name="toggle")
+    async def raid_toggle(self, ctx):
+        """Activer/désactiver la détection des raids"""
+        current = await self.config.guild(ctx.guild).raid_settings.get_raw('enabled')
+        if current:
+            self.raid_lockdowns.pop(ctx.guild.id, None)
+            self.join_windows.pop(ctx.guild.id, None)
+            await ctx.send("**Désactivé** • Les arrivées ne sont plus surveillées")
+        else:
+            await ctx.send("**Activé** • Les afflux d'arrivées suspendront l'attribution des rôles et alerteront les modérateurs")
+        await self.config.guild(ctx.guild).raid_settings.set_raw('enabled', value=not current)
+
+    @_raid_set.command(name="threshold")
+    async def raid_threshold(self, ctx, window: int, joins: int, young_joins: int = None):
+        """Configurer les seuils de détection
+
+        <window> = Durée de la fenêtre d'observation (en secondes, 10 à 3600)
+        <joins> = Nombre d'arrivées dans la fenêtre déclenchant la protection
+        [young_joins] = Nombre d'arrivées de comptes récents déclenchant la protection (voir `;joinset raid youngdays`)"""
+        if not 10 <= window <= 3600:
+            return await ctx.send("**Erreur** • La fenêtre doit être comprise entre 10 et 3600 secondes")
+        if joins < 2 or (young_joins is not None and young_joins < 1):
+            return await ctx.send("**Erreur** • Les seuils sont trop bas")
+        async with self.config.guild(ctx.guild).raid_settings() as settings:
+            settings['window'] = window
+            settings['threshold'] = joins
+            if young_joins is not None:
+                settings['young_threshold'] = young_joins
+            young = settings['young_threshold']
+        await ctx.send(f"**Seuils modifiés** • Protection déclenchée à partir de {joins} arrivées ou {young} comptes récents en {window}s")
+
+    @_raid_set.command(name="youngdays")
+    async def raid_young_days(self, ctx, days: int = 7):
+        """Modifier l'âge (en jours) en dessous duquel un compte est considéré comme récent
+
+        Valeurs possibles : 1, 7, 30, 365"""
+        if days not in AGE_BINS:
+            return await ctx.send(f"**Erreur** • Valeurs possibles : {', '.join(map(str, AGE_BINS))}")
+        await self.config.guild(ctx.guild).raid_settings.set_raw('young_days', value=days)
+        await ctx.send(f"**Valeur modifiée** • Les comptes de moins de {days} jours sont considérés comme récents")
+
+    @_raid_set.command(name="lockdown")
+    async def raid_lockdown_duration(self, ctx, minutes: int = 15):
+        """Modifier la durée (en minutes) du mode protection après le dernier dépassement de seuil"""
+        if minutes < 1:
+            return await ctx.send("**Erreur** • La durée ne peut être inférieure à 1 minute")
+        await self.config.guild(ctx.guild).raid_settings.set_raw('lockdown', value=minutes * 60)
+        await ctx.send(f"**Valeur modifiée** • Le mode protection durera {minutes} minutes")
+
+    @_raid_set.command(name="channel")
+    async def raid_alert_channel(self, ctx, channel: discord.TextChannel = None):
+        """Configurer le salon recevant les alertes de raid
+
+        Ne pas préciser de salon désactive les alertes"""
+        await self.config.guild(ctx.guild).raid_settings.set_raw('alert_channel', value=channel.id if channel else None)
+        if channel:
+            await ctx.send(f"**Salon configuré** • Les alertes de raid seront envoyées sur {channel.mention}")
+        else:
+            await ctx.send("**Alertes désactivées** • Aucun salon ne recevra les alertes de raid")
+
+    @_raid_set.command(name="status")
+    async def raid_status(self, ctx):
+        """Afficher l'état de la détection des raids et les arrivées récentes"""
+        settings = await self.config.guild(ctx.guild).raid_settings()
+        window = self.join_windows.get(ctx.guild.id)
+        hist = window.histogram() if window else [0] * (len(AGE_BINS) + 1)
+        labels = [f"< {b}j" for b in AGE_BINS] + [f"≥ {AGE_BINS[-1]}j"]
+        tab = tabulate(list(zip(labels, hist)), headers=["Âge du compte", "Arrivées"])
+        state = "Protection active" if self.is_locked_down(ctx.guild) else ("Surveillance" if settings['enabled'] else "Désactivé")
+        em = discord.Embed(title="Détection des raids", description=box(tab), color=ctx.author.color)
+        em.add_field(name="État", value=state)
+        em.add_field(name="Seuils", value=f"{settings['threshold']} arrivées / {settings['young_threshold']} récents "
+                                          f"(< {settings['young_days']}j) en {settings['window']}s")
+        await ctx.send(embed=em)
+
+    @_raid_set.command(name="unlock")
+    async def raid_unlock(self, ctx):
+        """Désactiver manuellement le mode protection"""
+        if self.raid_lockdowns.pop(ctx.guild.id, None) is None:
+            return await ctx.send("**Inutile** • Le mode protection n'est pas actif sur ce serveur")
+        self.join_windows.pop(ctx.guild.id, None)
+        periods = await self.get_raid_periods(ctx.guild)
+        if periods:
+            await self.save_raid_period(ctx.guild, periods[-1][0], time.time(), extend=True)
+        await ctx.send("**Protection désactivée** • Les rôles d'arrivée sont de nouveau attribués (les membres arrivés pendant la protection ne les reçoivent pas rétroactivement)")
+
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.guild:
@@ -175,7 +420,8 @@ class UserFlow(commands.Cog):
             await self.config.member(author).messages_count.set(cur + 1)
 
             data = await self.config.guild(message.guild).joining_roles()
-            if data:
+            if data and not self.is_locked_down(message.guild) \
+                    and not self.joined_during_raid(author, await self.get_raid_periods(message.guild)):
                 for r in data:
                     role = message.guild.get_role(r['role'])
                     if role not in author.roles:
@@ -186,11 +432,16 @@ class UserFlow(commands.Cog):
     @commands.Cog.listener()
     async def on_member_join(self, user):
         guild = user.guild
+        if await self.check_raid(user):
+            return
+
         if user.pending:
             while user.pending:
                 if user not in [m for m in self.bot.get_guild(guild.id).members]:
                     return
                 await asyncio.sleep(5)
+            if self.is_locked_down(guild):
+                return
 
         data = await self.config.guild(user.guild).joining_roles()
         if data: